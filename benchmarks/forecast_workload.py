@@ -0,0 +1,55 @@
+"""
+Workload forecast of a large collection: notes reviewed during the last two months with intervals of up to
+two months, and some new ones. Times the simulation the deck stats window runs, the exit status is 1
+when it takes longer than the budget.
+
+    python -m benchmarks.forecast_workload --notes 1000000 --days 365 --budget 3
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from logic.forecast import DEFAULT_EASE_DISTRIBUTION, simulateWorkload
+
+ONE_DAY = 60 * 60 * 24
+
+
+def createSchedule(notes: int, new: float, now: int):
+    """Returns (last_r, next_r) columns of the notes, a share of them was never reviewed"""
+    rng = np.random.default_rng(1)
+    last_r = now - rng.integers(0, ONE_DAY * 60, notes)
+    next_r = last_r + rng.integers(ONE_DAY // 2, ONE_DAY * 60, notes)
+    unseen = rng.random(notes) < new
+    last_r[unseen], next_r[unseen] = 0, 0
+    return last_r, next_r
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=1000000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--simulations", type=int, default=8)
+    parser.add_argument("--new", type=float, default=0.1, help="share of notes never reviewed")
+    parser.add_argument("--budget", type=float, default=3.0, help="seconds the simulation may take")
+    args = parser.parse_args()
+
+    now = int(time.time())
+    last_r, next_r = createSchedule(args.notes, args.new, now)
+    start = time.perf_counter()
+    forecast = simulateWorkload(last_r, next_r, DEFAULT_EASE_DISTRIBUTION, args.days, args.simulations, now=now, seed=1)
+    elapsed = time.perf_counter() - start
+
+    print(f"simulated {args.notes} notes over {args.days} days, {args.simulations} simulations in {elapsed:.2f} s")
+    for day in (0, 1, 7, 30, args.days - 1):
+        if day < args.days:
+            print(f"    day {day:>4}: {forecast.mean[day]:>10.1f} reviews, "
+                  f"band {forecast.lower[day]:.0f} - {forecast.upper[day]:.0f}")
+    withinBudget = elapsed <= args.budget
+    print(f"budget {args.budget:.1f} s {'met' if withinBudget else 'exceeded'}")
+    sys.exit(0 if withinBudget else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Timings of the views on synthetic data, without a display: dialog construction including load_ui,
+note browser fill, flashcard render and show cycles and stats chart creation.
+Every case runs a few times after a warm-up, pending events are processed inside the timing so layout
+and painting are included. Results are written as JSON, compared with a baseline report when one is given,
+the exit status is 1 when a case got slower than the baseline allows.
+Has to run from the root of the repository, templates are loaded by relative paths.
+
+    python -m benchmarks.gui_views --rows 1000,100000 --output gui.json --baseline gui-baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import PySide2
+from PySide2.QtWidgets import QApplication
+
+from data import dbmodel as dbm
+from data.consts import CARD_FRONT_TEMPLATE, CARD_BACK_TEMPLATE
+from logic.notequery import NotePage
+from logic.statutils import BAR_DAYS, FORECAST_DAYS
+from views.views import MainWindowView, CardListView, DeckListView, NoteBrowserView, DeckStatsView, NoteStatsView
+
+FIELDS = ["Front", "Back"]
+FLASHCARD_CYCLES = 50  # front and back shown per run of the flashcard case
+DEFAULT_TOLERANCE = 0.25  # a case may be this much slower than the baseline
+MIN_SLACK_MS = 2.0  # differences below this are noise, whatever the tolerance says
+
+
+def noteRows(count: int) -> List[tuple]:
+    return [(n, [f"question number {n}", f"the answer to question {n} is here"], 1700000000 + n, 1690000000 + n, n % 7)
+            for n in range(1, count + 1)]
+
+
+def measure(app: QApplication, case: Callable[[], object], repeat: int) -> Dict[str, float]:
+    """Runs the case once to warm up and then repeat times, the views it returns are closed after each run"""
+    timings = []
+    for run in range(repeat + 1):
+        start = time.perf_counter()
+        views = case()
+        app.processEvents()
+        elapsed = (time.perf_counter() - start) * 1000
+        for view in views or []:
+            view.close()
+        app.processEvents()
+        if run:
+            timings.append(elapsed)
+    return {"median_ms": statistics.median(timings), "min_ms": min(timings), "max_ms": max(timings),
+            "runs": len(timings)}
+
+
+def cases(rows: List[int]) -> Dict[str, Callable[[], object]]:
+    mainWindow = MainWindowView()
+    decks = [f"Deck {d}" for d in range(50)]
+    deckIds = list(range(1, len(decks) + 1))
+    fields = list(zip(FIELDS, ["What is the capital of France?", "Paris"]))
+
+    def flashcardCycles():
+        for _ in range(FLASHCARD_CYCLES):
+            mainWindow.updateFlashcard("Deck", CARD_FRONT_TEMPLATE, CARD_BACK_TEMPLATE, fields, True)
+            QApplication.processEvents()
+            mainWindow.updateFlashcard("Deck", CARD_FRONT_TEMPLATE, CARD_BACK_TEMPLATE, fields, False)
+            QApplication.processEvents()
+
+    def deckStats():
+        view = DeckStatsView()
+        view.setDataPie([("New", 120), ("Young", 340), ("Adult", 560), ("Old", 780)])
+        view.setDataBar([(day * 37) % 100 for day in range(BAR_DAYS)])
+        mean = [float((day * 37) % 100) for day in range(FORECAST_DAYS)]
+        view.setDataForecast((mean, [value * 0.8 for value in mean], [value * 1.2 for value in mean]))
+        view.show()
+        return [view]
+
+    def noteStats():
+        view = NoteStatsView()
+        view.setNoteDataPie([("1", 4), ("3", 12), ("5", 7)])
+        view._window.show()  # exec() would block, the chart is laid out the same when shown
+        return [view]
+
+    selected = {
+        "main_window_construct": lambda: [MainWindowView()._window],
+        "deck_list_construct": lambda: [DeckListView(decks, deckIds)],
+        "card_list_construct": lambda: [CardListView(decks, deckIds)._window],
+        "flashcard_cycles": flashcardCycles,
+        "deck_stats_charts": deckStats,
+        "note_stats_chart": noteStats,
+    }
+    def noteBrowser(data: List[tuple]):
+        view = NoteBrowserView("Deck", FIELDS)
+        view.refresh(NotePage(data, None))
+        return [view]
+
+    for count in rows:
+        data = noteRows(count)
+        selected[f"note_browser_fill_{count}"] = lambda data=data: noteBrowser(data)
+    return selected
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Returns descriptions of the cases slower than the baseline allows"""
+    regressions = []
+    for name, result in report["cases"].items():
+        previous = baseline.get("cases", {}).get(name)
+        limit = baseline.get("thresholds", {}).get(name)  # explicit limits of the baseline win
+        if limit is None and previous is not None:
+            limit = max(previous["median_ms"] * (1 + tolerance), previous["median_ms"] + MIN_SLACK_MS)
+        if limit is not None and result["median_ms"] > limit:
+            regressions.append(f"{name}: {result['median_ms']:.1f} ms, limit {limit:.1f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="1000,100000", help="row counts of the note browser, comma separated")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--case", action="append", help="run only this case, may be given several times")
+    parser.add_argument("--output", help="write the JSON report here instead of the standard output")
+    parser.add_argument("--baseline", help="JSON report of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+    dbm.Engine.echo = dbm.ReaderEngine.echo = False
+    app = QApplication.instance() or QApplication(sys.argv)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": os.environ["QT_QPA_PLATFORM"],
+        "python": platform.python_version(),
+        "pyside": PySide2.__version__,
+        "cases": {},
+    }
+    for name, case in cases([int(count) for count in args.rows.split(",") if count]).items():
+        if args.case and name not in args.case:
+            continue
+        report["cases"][name] = result = measure(app, case, args.repeat)
+        print(f"{name:<28}{result['median_ms']:>10.1f} ms  (min {result['min_ms']:.1f}, max {result['max_ms']:.1f})",
+              file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
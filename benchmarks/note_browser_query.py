@@ -0,0 +1,132 @@
+"""
+Pages of the note browser read from a large deck: the first page and a page deep into the deck,
+reached by OFFSET and by keyset pagination, for every sort column with and without its index,
+and a filtered first page. Prints the query plan of the keyset page of each sort.
+
+    python -m benchmarks.note_browser_query --notes 200000 --depth 150000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import sqlalchemy as sql
+from sqlalchemy.orm import sessionmaker
+
+from data import dbmodel as dbm
+from data.dbmodel import Note, Review
+from logic.notequery import NoteQuery, SortIndexes, createSortIndex, fetchNotePage, sortExpression, SORT_ID, SORT_DUE, SORT_LAST, SORT_REVIEWS, \
+    PAGE_SIZE
+
+WORDS = ["apple", "river", "stone", "cloud", "ember", "frost", "maple", "cedar", "delta", "harbor"]
+
+
+def createCollection(path: str, notes: int, reviews: int, now: int) -> sql.engine.Engine:
+    engine = dbm.createEngine(f"sqlite:///{path}")
+    dbm.prepareDatabase(engine)
+    rng = random.Random(1)
+    with engine.begin() as connection:
+        connection.execute(dbm.Card.__table__.insert(), {"c_name": "Basic", "c_fields": json.dumps(["Front", "Back"])})
+        connection.execute(dbm.Deck.__table__.insert(), [{"d_name": "Deck", "c_id": 1}])
+        rows = []
+        for n in range(notes):
+            last = now - rng.randrange(0, 86400 * 60)
+            front = " ".join(rng.choice(WORDS) for _ in range(3))
+            rows.append({"n_data": json.dumps([f"{front} {n}", f"back {n}"]), "n_last_r": last,
+                         "n_next_r": last + rng.randrange(0, 86400 * 60), "d_id": 1})
+        connection.execute(Note.__table__.insert(), rows)
+        connection.execute(Review.__table__.insert(), [
+            {"r_ease": rng.choice((1, 3, 5)), "n_id": rng.randrange(1, notes + 1)} for _ in range(reviews)])
+    return engine
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def keysetAt(factory: sessionmaker, query: NoteQuery, depth: int):
+    """Keyset of the row at the depth, read once so the keyset page can be timed alone"""
+    with dbm.sessionScope(factory) as session:
+        page = fetchNotePage(session, query, 2, limit=depth)
+    return page.nextKey
+
+
+def offsetPage(factory: sessionmaker, query: NoteQuery, depth: int) -> int:
+    """The same page read by OFFSET, the way a client side paging of the same query would"""
+    with dbm.sessionScope(factory) as session:
+        rows = session.query(Note.n_id, Note.n_data).filter(Note.d_id == query.d_id) \
+            .order_by(sortExpression(query.sort), Note.n_id).offset(depth).limit(PAGE_SIZE).all()
+    return len(rows)
+
+
+def keysetPage(factory: sessionmaker, query: NoteQuery, after: tuple) -> int:
+    with dbm.sessionScope(factory) as session:
+        return len(fetchNotePage(session, query, 2, after).rows)
+
+
+def queryPlan(engine: sql.engine.Engine, query: NoteQuery, after: tuple) -> str:
+    session = sessionmaker(bind=engine)()
+    try:
+        # the statement fetchNotePage runs is caught on its way to the driver and explained
+        statements = []
+        listener = lambda conn, cursor, statement, parameters, context, many: statements.append((statement, parameters))
+        sql.event.listen(engine, "before_cursor_execute", listener)
+        fetchNotePage(session, query, 2, after)
+        sql.event.remove(engine, "before_cursor_execute", listener)
+        statement, parameters = statements[-1]
+        plan = session.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+        return "\n".join(f"    {row[-1]}" for row in plan)
+    finally:
+        session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=200000)
+    parser.add_argument("--reviews", type=int, default=400000)
+    parser.add_argument("--depth", type=int, default=150000, help="row the deep page starts at")
+    parser.add_argument("--plans", action="store_true", help="print query plans of the keyset pages")
+    args = parser.parse_args()
+    dbm.Engine.echo = dbm.ReaderEngine.echo = False
+    now = int(time.time())
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "collection.db")
+        engine, seconds = timed(createCollection, path, args.notes, args.reviews, now)
+        print(f"created {args.notes} notes and {args.reviews} reviews in {seconds / 1000:.1f} s")
+        factory = sessionmaker(bind=engine)
+        indexes = SortIndexes(threshold=1)
+
+        print(f"{'sort':<16}{'index':>7}{'first ms':>10}{'offset ms':>11}{'keyset ms':>11}")
+        for sort in [SORT_ID, SORT_DUE, SORT_LAST, SORT_REVIEWS, 0]:
+            for indexed in [False, True]:
+                if indexed:
+                    if SortIndexes.indexDefinition(sort) is None:
+                        continue
+                    createSortIndex(engine, indexes.noteSorted(sort))
+                query = NoteQuery(1, sort)
+                with dbm.sessionScope(factory) as session:
+                    _, first = timed(fetchNotePage, session, query, 2)
+                _, offset = timed(offsetPage, factory, query, args.depth)
+                after = keysetAt(factory, query, args.depth)
+                _, keyset = timed(keysetPage, factory, query, after)
+                name = "field 0" if sort == 0 else sort
+                print(f"{name:<16}{'yes' if indexed else 'no':>7}{first:>10.1f}{offset:>11.1f}{keyset:>11.1f}")
+                if args.plans:
+                    print(queryPlan(engine, query, after))
+
+        for query in [NoteQuery(1, 0, filterColumn=0, filterText="ember river"),
+                      NoteQuery(1, SORT_DUE, filterColumn=SORT_DUE, filterText="<=7"),
+                      NoteQuery(1, 0, filterText="back 1999")]:
+            with dbm.sessionScope(factory) as session:
+                page, elapsed = timed(fetchNotePage, session, query, 2)
+            print(f"filter {query.filterColumn!s:<6} {query.filterText!r:<14}{len(page.rows):>5} rows{elapsed:>9.1f} ms")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Time of switching between profiles the way the controller does it: open the profile,
+release the connections of the previous one and list its decks from the metadata cache.
+The first switch to a profile creates its database, later ones find it in the LRU of open profiles.
+
+    python -m benchmarks.profile_switch --profiles 4 --switches 200
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from data import dbmodel as dbm
+from logic.profiles import ProfileManager, ProfileRegistry, MAX_OPEN_PROFILES
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", type=int, default=MAX_OPEN_PROFILES)
+    parser.add_argument("--switches", type=int, default=200)
+    args = parser.parse_args()
+    dbm.Engine.echo = dbm.ReaderEngine.echo = False
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)  # profile databases are created relative to the working directory
+        registry = ProfileRegistry()
+        names = [f"Profile {idx}" for idx in range(args.profiles)]
+        for name in names:
+            registry.add(name)
+        manager = ProfileManager(registry)
+        current = manager.open(names[0])
+        timings = {"cold": [], "warm": []}
+        for idx in range(args.switches):
+            name = names[(idx + 1) % len(names)]
+            kind = "warm" if manager.isOpen(name) else "cold"
+            start = time.perf_counter()
+            profile = manager.open(name)
+            current.release()
+            profile.metadata.decks()
+            timings[kind].append(time.perf_counter() - start)
+            current = profile
+        manager.closeAll()
+        os.chdir(cwd)
+        for kind, values in timings.items():
+            if values:
+                print(f"{kind} switches: {len(values)}, median {statistics.median(values) * 1000:.2f} ms, "
+                      f"max {max(values) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Memory held per queued note by the representations the study queue went through:
+ORM Note instances kept by a session, heap entries of column tuples with n_data,
+and the array-backed queue holding only IDs and times.
+Allocations are measured with tracemalloc while the structure is alive.
+
+    python -m benchmarks.queue_memory --notes 100000
+"""
+import argparse
+import gc
+import heapq
+import json
+import time
+import tracemalloc
+from collections import namedtuple
+
+import sqlalchemy as sql
+from sqlalchemy.orm import sessionmaker
+
+from data import dbmodel as dbm
+from data.dbmodel import Base, Card, Deck, Note
+from logic.studyqueue import StudyQueue
+
+# row of the previous queue, same columns as dbmodel.NOTE_COLUMNS
+FullNote = namedtuple("FullNote", ["n_id", "n_data", "n_last_r", "n_next_r", "d_id"])
+
+
+def createCollection(notes: int, now: int) -> sessionmaker:
+    engine = sql.create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine, expire_on_commit=False)
+    with dbm.sessionScope(factory) as session:
+        session.add(Card(c_id=1, c_name="Basic", c_fields=json.dumps(["Front", "Back"])))
+        session.add(Deck(d_id=1, d_name="Deck", c_id=1))
+        session.flush()
+        session.bulk_insert_mappings(Note, [
+            {"n_data": json.dumps([f"question number {n}", f"the answer to question {n} is here"]),
+             "n_last_r": now - 86400 * (1 + n % 30), "n_next_r": now - n % 86400, "d_id": 1}
+            for n in range(notes)])
+    return factory
+
+
+def measure(build) -> int:
+    """Returns bytes allocated by build() and still held by its result"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del result
+    return held
+
+
+def ormQueue(factory: sessionmaker):
+    session = factory()
+    notes = session.query(Note).order_by(Note.n_next_r, Note.n_id).all()
+    return session, notes  # the session keeps the instances in its identity map
+
+
+def tupleHeapQueue(factory: sessionmaker):
+    with dbm.sessionScope(factory) as session:
+        rows = session.query(*dbm.NOTE_COLUMNS).order_by(Note.n_next_r, Note.n_id).all()
+    heap = []
+    for sequence, row in enumerate(rows):
+        heapq.heappush(heap, (row.n_next_r, sequence, FullNote(*row)))
+    return heap
+
+
+def arrayQueue(factory: sessionmaker):
+    with dbm.sessionScope(factory) as session:
+        rows = session.query(*dbm.QUEUE_COLUMNS).order_by(Note.n_next_r, Note.n_id).all()
+    queue = StudyQueue()
+    queue.fill(iter(rows), len(rows), eager=True)
+    return queue
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=100000)
+    args = parser.parse_args()
+    dbm.Engine.echo = dbm.ReaderEngine.echo = False
+    factory = createCollection(args.notes, int(time.time()))
+    for name, build in [("ORM instances", ormQueue), ("tuple heap", tupleHeapQueue), ("array queue", arrayQueue)]:
+        held = measure(lambda: build(factory))
+        print(f"{name:>14}: {held / 2**20:7.1f} MiB, {held / args.notes:6.0f} B per note")
+
+
+if __name__ == "__main__":
+    main()
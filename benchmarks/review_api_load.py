@@ -0,0 +1,138 @@
+"""
+Load test of the local review API: many concurrent clients on keep-alive connections study a generated collection
+for a while, each of them lists due notes of a deck, renders the front and the back of a note and rates it.
+Prints requests per second, latency percentiles by endpoint and how many ratings were written per transaction.
+Run it again with --max-batch 1 to see the API with every rating in its own transaction.
+
+    python -m benchmarks.review_api_load --clients 64 --seconds 10 --notes 100000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from data import dbmodel as dbm
+from data.dbmodel import Note
+from logic.reviewapi import ReviewApi, DEFAULT_WORKERS, MAX_BATCH
+
+
+def createCollection(path: str, notes: int, decks: int, now: int) -> None:
+    engine = dbm.createEngine(f"sqlite:///{path}")
+    dbm.prepareDatabase(engine)
+    rng = random.Random(1)
+    with engine.begin() as connection:
+        connection.execute(dbm.Card.__table__.insert(), {
+            "c_name": "Basic", "c_fields": json.dumps(["Front", "Back"]),
+            "c_layout_f": "<h1>{{Front}}</h1>", "c_layout_b": "{{FrontSide}}<hr>{{Back}}"})
+        connection.execute(dbm.Deck.__table__.insert(), [{"d_name": f"Deck {d}", "c_id": 1} for d in range(decks)])
+        connection.execute(Note.__table__.insert(), [
+            {"n_data": json.dumps([f"question {n}", f"answer {n}"]), "n_last_r": now - 86400,
+             "n_next_r": now - rng.randrange(0, 86400), "d_id": 1 + n % decks} for n in range(notes)])
+    engine.dispose()
+
+
+class Client:
+    """One keep-alive connection, requests are sent one after another"""
+
+    def __init__(self, port: int, latencies: Dict[str, List[float]]):
+        self._port = port
+        self._latencies = latencies
+
+    async def open(self) -> None:
+        self._reader, self._writer = await asyncio.open_connection("localhost", self._port)
+
+    async def request(self, name: str, method: str, path: str, payload: dict = None):
+        body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        start = time.perf_counter()
+        self._writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n"
+                           .encode("latin-1") + body)
+        status = int((await self._reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self._reader.readline()
+            if line == b"\r\n":
+                break
+            header, _, value = line.decode("latin-1").partition(":")
+            if header.lower() == "content-length":
+                length = int(value)
+        data = json.loads(await self._reader.readexactly(length))
+        self._latencies[name].append((time.perf_counter() - start) * 1000)
+        if status != 200:
+            raise RuntimeError(f"{method} {path}: {status} {data}")
+        return data
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+async def study(client: Client, decks: List[int], deadline: float, rng: random.Random) -> None:
+    await client.open()
+    try:
+        while time.perf_counter() < deadline:
+            d_id = rng.choice(decks)
+            due = await client.request("due", "GET", f"/decks/{d_id}/due?limit=20")
+            if not due["notes"]:
+                continue
+            n_id = rng.choice(due["notes"])["n_id"]
+            await client.request("front", "GET", f"/notes/{n_id}/card?side=front")
+            await client.request("back", "GET", f"/notes/{n_id}/card?side=back")
+            await client.request("rate", "POST", f"/notes/{n_id}/rate", {"ease": rng.choice((1, 3, 5))})
+    finally:
+        client.close()
+
+
+async def run(path: str, args) -> None:
+    api = ReviewApi(path, args.workers, args.max_batch)
+    port = await api.start("localhost", 0)
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    probe = Client(port, latencies)
+    await probe.open()
+    decks = [deck["d_id"] for deck in (await probe.request("decks", "GET", "/decks"))["decks"]]
+    probe.close()
+
+    start = time.perf_counter()
+    deadline = start + args.seconds
+    await asyncio.gather(*(study(Client(port, latencies), decks, deadline, random.Random(seed))
+                           for seed in range(args.clients)))
+    elapsed = time.perf_counter() - start
+    await api.stop()
+
+    total = sum(len(values) for name, values in latencies.items() if name != "decks")
+    print(f"{args.clients} clients, {args.workers} workers, batches of at most {args.max_batch}")
+    print(f"{total} requests in {elapsed:.1f} s, {total / elapsed:.0f} requests/s")
+    print(f"{'endpoint':<10}{'count':>8}{'p50 ms':>9}{'p99 ms':>9}")
+    for name in ["due", "front", "back", "rate"]:
+        values = sorted(latencies[name])
+        if values:
+            print(f"{name:<10}{len(values):>8}{statistics.median(values):>9.1f}"
+                  f"{values[min(len(values) - 1, int(len(values) * 0.99))]:>9.1f}")
+    if api.batcher.batches:
+        print(f"{api.batcher.ratings} ratings in {api.batcher.batches} transactions, "
+              f"{api.batcher.ratings / api.batcher.batches:.1f} per transaction")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--notes", type=int, default=100000)
+    parser.add_argument("--decks", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    args = parser.parse_args()
+    dbm.Engine.echo = dbm.ReaderEngine.echo = False
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "collection.db")
+        createCollection(path, args.notes, args.decks, int(time.time()))
+        asyncio.run(run(path, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Upgrade of a large collection created before migrations were versioned: no foreign keys, no change log columns,
+the old ix_n_d_id index and some orphaned rows. Times every migration at startup, then runs the backfills,
+which copy notes and reviews into tables with foreign keys and fill guids, while another thread keeps writing
+the way the app does. Stops them partway and continues with a new runner, as after a restart.
+Prints the worst wait of the app writes and checks the upgraded schema.
+
+    python -m benchmarks.schema_migrations --notes 500000 --reviews 1000000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+import sqlalchemy as sql
+
+from data import dbmodel as dbm
+from data.migrations import BackfillRunner, migrate, BACKFILL_CHUNK
+
+LEGACY_SCHEMA = [
+    "CREATE TABLE cards (c_id INTEGER PRIMARY KEY, c_name VARCHAR(20) NOT NULL UNIQUE, "
+    "c_fields VARCHAR(255) NOT NULL, c_layout_f TEXT, c_layout_b TEXT)",
+    "CREATE TABLE decks (d_id INTEGER PRIMARY KEY, d_name VARCHAR(20) NOT NULL UNIQUE, c_id INTEGER NOT NULL)",
+    "CREATE TABLE notes (n_id INTEGER PRIMARY KEY, n_data VARCHAR(255) NOT NULL, n_last_r INTEGER NOT NULL, "
+    "n_next_r INTEGER NOT NULL, d_id INTEGER NOT NULL)",
+    "CREATE TABLE reviews (r_id INTEGER PRIMARY KEY, r_ease INTEGER NOT NULL, n_id INTEGER NOT NULL)",
+    "CREATE INDEX ix_n_d_id ON notes (d_id)",
+    "CREATE INDEX ix_r_n_id ON reviews (n_id)",
+]
+
+
+def createLegacyCollection(path: str, notes: int, reviews: int, decks: int, orphans: int) -> None:
+    engine = sql.create_engine(f"sqlite:///{path}")
+    rng = random.Random(1)
+    now = int(time.time())
+    with engine.begin() as connection:
+        for statement in LEGACY_SCHEMA:
+            connection.exec_driver_sql(statement)
+        connection.execute(sql.text("INSERT INTO cards (c_name, c_fields) VALUES ('Basic', :fields)"),
+                           {"fields": json.dumps(["Front", "Back"])})
+        connection.execute(sql.text("INSERT INTO decks (d_name, c_id) VALUES (:name, 1)"),
+                           [{"name": f"Deck {d}"} for d in range(decks)])
+        # orphans point at a deck or note deleted while foreign keys weren't enforced
+        connection.execute(sql.text("INSERT INTO notes (n_data, n_last_r, n_next_r, d_id) VALUES (:data, :last, :next, :d_id)"),
+                           [{"data": json.dumps([f"question {n}", f"answer {n}"]), "last": now - 86400,
+                             "next": now + rng.randrange(-86400, 86400 * 30),
+                             "d_id": decks + 1 if n < orphans else 1 + n % decks} for n in range(notes)])
+        connection.execute(sql.text("INSERT INTO reviews (r_ease, n_id) VALUES (:ease, :n_id)"),
+                           [{"ease": rng.choice((1, 3, 5)),
+                             "n_id": notes + 1 if r < orphans else rng.randrange(orphans + 1, notes + 1)}
+                            for r in range(reviews)])
+    engine.dispose()
+
+
+def rowCounts(engine: sql.engine.Engine) -> dict:
+    with engine.connect() as connection:
+        return {table: connection.exec_driver_sql(f"SELECT COUNT(*) FROM {table}").scalar()
+                for table, *_ in dbm.SYNCED_TABLES}
+
+
+def appWrites(engine: sql.engine.Engine, notes: int, stop: threading.Event, waits: list) -> None:
+    """Rates random notes one transaction at a time, records how long each one took"""
+    rng = random.Random(2)
+    while not stop.is_set():
+        n_id = rng.randrange(1, notes + 1)
+        start = time.perf_counter()
+        with engine.begin() as connection:
+            connection.execute(sql.text("UPDATE notes SET n_next_r = n_next_r + 86400 WHERE n_id = :n_id"),
+                               {"n_id": n_id})
+            connection.execute(sql.text("INSERT INTO reviews (r_ease, n_id) SELECT 3, n_id FROM notes WHERE n_id = :n_id"),
+                               {"n_id": n_id})
+        waits.append((time.perf_counter() - start) * 1000)
+        time.sleep(0.005)
+
+
+def runBackfills(engine: sql.engine.Engine, args) -> None:
+    stop = threading.Event()
+    waits = []
+    writer = threading.Thread(target=appWrites, args=(engine, args.notes, stop, waits))
+    writer.start()
+
+    start = time.perf_counter()
+    runner = BackfillRunner(engine, dbm.MIGRATIONS, chunk=args.chunk)
+    halfway = threading.Timer(args.stop_after, runner.stop)
+    halfway.start()
+    runner.complete()
+    halfway.cancel()
+    for name, last, end, done in runner.progress():
+        print(f"    stopped {name:<16}{'done' if done else f'{last} of {end}'}")
+
+    # a new runner continues from the recorded progress, as after a restart
+    runner = BackfillRunner(engine, dbm.MIGRATIONS, chunk=args.chunk)
+    print(f"    pending after restart: {runner.isPending()}")
+    runner.complete()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    writer.join()
+
+    waits.sort()
+    print(f"backfills done in {elapsed:.1f} s, chunks of {args.chunk}")
+    print(f"app writes meanwhile: {len(waits)}, p50 {waits[len(waits) // 2]:.1f} ms, "
+          f"p99 {waits[min(len(waits) - 1, int(len(waits) * 0.99))]:.1f} ms, worst {waits[-1]:.1f} ms")
+
+
+def check(engine: sql.engine.Engine, before: dict, orphans: int) -> None:
+    with engine.connect() as connection:
+        version = connection.exec_driver_sql("SELECT version FROM schema_version").scalar()
+        print(f"schema version {version} of {dbm.MIGRATIONS[-1].version}")
+        for table, key, prefix, _ in dbm.SYNCED_TABLES:
+            rows, guids, distinct = connection.exec_driver_sql(
+                f"SELECT COUNT(*), COUNT({prefix}_guid), COUNT(DISTINCT {prefix}_guid) FROM {table}").fetchone()
+            keys = len(connection.exec_driver_sql(f"PRAGMA foreign_key_list({table})").fetchall())
+            print(f"    {table:<8} rows {before[table]:>8} -> {rows:>8}, without guid {rows - guids}, "
+                  f"duplicate guids {guids - distinct}, foreign keys {keys}")
+        indexes = {row[0] for row in connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        triggers = {row[0] for row in connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+        declared = {index.name for table in dbm.Base.metadata.tables.values() for index in table.indexes}
+        print(f"    missing indexes {sorted(declared - indexes) or 'none'}, ix_n_d_id dropped {'ix_n_d_id' not in indexes}")
+        print(f"    triggers {len(triggers)}, foreign key violations "
+              f"{len(connection.exec_driver_sql('PRAGMA foreign_key_check').fetchall())}")
+    print(f"    {orphans} orphaned notes and reviews were purged, app writes added reviews")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=500000)
+    parser.add_argument("--reviews", type=int, default=1000000)
+    parser.add_argument("--decks", type=int, default=20)
+    parser.add_argument("--orphans", type=int, default=1000)
+    parser.add_argument("--chunk", type=int, default=BACKFILL_CHUNK)
+    parser.add_argument("--stop-after", type=float, default=1.0, help="seconds before the first runner is stopped")
+    args = parser.parse_args()
+    dbm.Engine.echo = dbm.ReaderEngine.echo = False
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "collection.db")
+        start = time.perf_counter()
+        createLegacyCollection(path, args.notes, args.reviews, args.decks, args.orphans)
+        print(f"created a legacy collection of {args.notes} notes and {args.reviews} reviews "
+              f"in {time.perf_counter() - start:.1f} s")
+
+        engine = dbm.createEngine(f"sqlite:///{path}")
+        before = rowCounts(engine)
+        dbm.Base.metadata.create_all(engine)
+        total = 0.0
+        for count, migration in enumerate(dbm.MIGRATIONS, 1):
+            start = time.perf_counter()
+            migrate(engine, dbm.MIGRATIONS[:count])
+            elapsed = time.perf_counter() - start
+            total += elapsed
+            print(f"    migration {migration.version} {migration.name:<40}{elapsed * 1000:>9.0f} ms")
+        print(f"startup migrations took {total:.1f} s")
+
+        runBackfills(engine, args)
+        check(engine, before, args.orphans)
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
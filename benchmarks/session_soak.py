@@ -0,0 +1,114 @@
+"""
+Soak benchmark of the controller data access patterns.
+Runs the same mix of actions (study session, rating, stats, note browsing) with one long-lived session
+and with a unit of work per action, reporting RSS and identity map size along the way.
+
+    python -m benchmarks.session_soak --actions 10000 --notes 20000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import sqlalchemy as sql
+from sqlalchemy import and_
+from sqlalchemy.orm import sessionmaker
+
+from data import dbmodel as dbm
+from data.dbmodel import Base, Card, Deck, Note, Review
+from logic.memutils import currentRss
+from logic.scheduling import computeNextReview
+
+
+def createCollection(path: str, decks: int, notes: int) -> sessionmaker:
+    engine = sql.create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine, expire_on_commit=False)
+    with dbm.sessionScope(factory) as session:
+        session.add(Card(c_id=1, c_name="Basic", c_fields=json.dumps(["Front", "Back"])))
+        session.add_all([Deck(d_id=d, d_name=f"Deck {d}", c_id=1) for d in range(1, decks + 1)])
+        session.bulk_insert_mappings(Note, [
+            {"n_data": json.dumps([f"front {n}", f"back {n}" * 8]), "d_id": n % decks + 1} for n in range(notes)
+        ])
+    return factory
+
+
+def sharedSessionActions(factory: sessionmaker, decks: int, notes: int):
+    """Access pattern of a controller holding a single session for the process lifetime"""
+    session = factory()
+
+    def action(step: int):
+        d_id = step % decks + 1
+        kind = step % 4
+        if kind == 0:
+            session.query(Deck).filter_by(d_id=d_id).first()
+            session.query(Card).filter_by(c_id=1).first()
+            session.query(Note).filter(and_(Note.d_id == d_id, Note.n_next_r <= int(time.time()))).all()
+        elif kind == 1:
+            note = session.query(Note).filter_by(n_id=random.randint(1, notes)).first()
+            session.add(Review(r_ease=3, n_id=note.n_id))
+            note.n_last_r, note.n_next_r = computeNextReview(note.n_last_r, note.n_next_r, 3, int(time.time()))
+            session.commit()
+        elif kind == 2:
+            session.query(Note).filter_by(d_id=d_id).all()
+        else:
+            session.query(Review).filter_by(n_id=random.randint(1, 100)).all()
+
+    return action, lambda: len(session.identity_map)
+
+
+def scopedSessionActions(factory: sessionmaker, decks: int, notes: int):
+    """Access pattern of a controller opening a unit of work per action"""
+
+    def action(step: int):
+        d_id = step % decks + 1
+        kind = step % 4
+        with dbm.sessionScope(factory) as session:
+            if kind == 0:
+                session.query(*dbm.DECK_COLUMNS).filter(Deck.d_id == d_id).first()
+                session.query(*dbm.CARD_COLUMNS).filter(Card.c_id == 1).first()
+                session.query(*dbm.NOTE_COLUMNS).filter(and_(Note.d_id == d_id, Note.n_next_r <= int(time.time()))).all()
+            elif kind == 1:
+                note = session.query(*dbm.NOTE_COLUMNS).filter(Note.n_id == random.randint(1, notes)).first()
+                n_last_r, n_next_r = computeNextReview(note.n_last_r, note.n_next_r, 3, int(time.time()))
+                session.add(Review(r_ease=3, n_id=note.n_id))
+                session.query(Note).filter(Note.n_id == note.n_id) \
+                    .update({Note.n_last_r: n_last_r, Note.n_next_r: n_next_r}, synchronize_session=False)
+            elif kind == 2:
+                session.query(Note.n_last_r, Note.n_next_r).filter(Note.d_id == d_id).all()
+            else:
+                session.query(Review.r_ease).filter(Review.n_id == random.randint(1, 100)).all()
+
+    return action, lambda: dbm.sessionStats.lastIdentityMap
+
+
+def soak(name: str, actions: int, samples: int, action, identityMapSize):
+    print(f"{name}")
+    print("actions\trss_mb\tidentity_map\telapsed_s")
+    start = time.perf_counter()
+    for step in range(actions):
+        action(step)
+        if (step + 1) % max(1, actions // samples) == 0:
+            print(f"{step + 1}\t{currentRss() / 2**20:.1f}\t{identityMapSize()}\t{time.perf_counter() - start:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--actions", type=int, default=10000)
+    parser.add_argument("--notes", type=int, default=20000)
+    parser.add_argument("--decks", type=int, default=40)
+    parser.add_argument("--samples", type=int, default=10)
+    args = parser.parse_args()
+    dbm.Engine.echo = False
+
+    with tempfile.TemporaryDirectory() as directory:
+        scoped = createCollection(os.path.join(directory, "scoped.db"), args.decks, args.notes)
+        soak("unit of work per action", args.actions, args.samples, *scopedSessionActions(scoped, args.decks, args.notes))
+        shared = createCollection(os.path.join(directory, "shared.db"), args.decks, args.notes)
+        soak("single long-lived session", args.actions, args.samples, *sharedSessionActions(shared, args.decks, args.notes))
+
+
+if __name__ == '__main__':
+    main()
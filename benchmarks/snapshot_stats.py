@@ -0,0 +1,120 @@
+"""
+Deck and note stats computed by queries, the way the stats windows used to load them,
+against the memory-mapped columnar snapshot: the first build, a refresh with nothing new,
+and a refresh after a batch of ratings. Checks that both ways give the same charts.
+
+    python -m benchmarks.snapshot_stats --notes 300000 --reviews 1000000 --decks 10 --ratings 500
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import sqlalchemy as sql
+from sqlalchemy.orm import sessionmaker
+
+from data import dbmodel as dbm
+from data.dbmodel import Note, Review
+from logic.forecast import loadEaseDistribution, normalizeEaseCounts
+from logic.scheduling import computeNextReview
+from logic.snapshot import CollectionSnapshot
+from logic.statutils import prepareDeckDataPie, prepareDeckDataBar, prepareNoteDataPie, \
+    prepareDeckDataColumns, prepareNoteDataColumns
+
+
+def createCollection(path: str, notes: int, reviews: int, decks: int, now: int) -> sql.engine.Engine:
+    engine = dbm.createEngine(f"sqlite:///{path}")
+    dbm.prepareDatabase(engine)
+    rng = random.Random(1)
+    with engine.begin() as connection:
+        connection.execute(dbm.Card.__table__.insert(), {"c_name": "Basic", "c_fields": json.dumps(["Front", "Back"])})
+        connection.execute(dbm.Deck.__table__.insert(), [{"d_name": f"Deck {d}", "c_id": 1} for d in range(decks)])
+        rows = []
+        for n in range(notes):
+            last = now - rng.randrange(0, 86400 * 60)
+            rows.append({"n_data": json.dumps([f"front {n}", f"back {n}"]), "n_last_r": last,
+                         "n_next_r": last + rng.randrange(0, 86400 * 60), "d_id": 1 + n % decks})
+        connection.execute(Note.__table__.insert(), rows)
+        connection.execute(Review.__table__.insert(), [
+            {"r_ease": rng.choice((1, 3, 5)), "n_id": rng.randrange(1, notes + 1)} for _ in range(reviews)])
+    return engine
+
+
+def rate(engine: sql.engine.Engine, count: int, notes: int, now: int) -> None:
+    """Rates random notes the way the controller does, one transaction per rating"""
+    rng = random.Random(2)
+    for _ in range(count):
+        n_id, ease = rng.randrange(1, notes + 1), rng.choice((1, 3, 5))
+        with engine.begin() as connection:
+            last_r, next_r = connection.execute(sql.select([Note.n_last_r, Note.n_next_r])
+                                                .where(Note.n_id == n_id)).one()
+            last_r, next_r = computeNextReview(last_r, next_r, ease, now)
+            connection.execute(Note.__table__.update().where(Note.n_id == n_id), {"n_last_r": last_r, "n_next_r": next_r})
+            connection.execute(Review.__table__.insert(), {"r_ease": ease, "n_id": n_id})
+
+
+def queryStats(factory: sessionmaker, d_id: int, n_id: int, now: int):
+    with dbm.sessionScope(factory) as session:
+        notes = session.query(Note.n_last_r, Note.n_next_r).filter(Note.d_id == d_id).all()
+        bar = prepareDeckDataBar(notes, now)
+        eases = loadEaseDistribution(session, d_id)
+        reviews = session.query(Review.r_ease).filter(Review.n_id == n_id).all()
+    return dict(prepareDeckDataPie(notes)), bar, eases, sorted(prepareNoteDataPie(reviews))
+
+
+def snapshotStats(snapshot: CollectionSnapshot, d_id: int, n_id: int, now: int):
+    snapshot.refresh()
+    last_r, next_r = snapshot.deckSchedule(d_id)
+    pie, bar = prepareDeckDataColumns(last_r, next_r, now)
+    eases = normalizeEaseCounts(snapshot.easeCounts(d_id))
+    return pie, bar, eases, sorted(prepareNoteDataColumns(snapshot.noteEases(n_id)))
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=300000)
+    parser.add_argument("--reviews", type=int, default=1000000)
+    parser.add_argument("--decks", type=int, default=10)
+    parser.add_argument("--ratings", type=int, default=500)
+    args = parser.parse_args()
+    dbm.Engine.echo = dbm.ReaderEngine.echo = False
+    now = int(time.time())  # the bar chart buckets depend on the time, both ways use the same one
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "appdata.db")
+        engine = createCollection(path, args.notes, args.reviews, args.decks, now)
+        reader = dbm.createEngine(f"sqlite:///{path}", readOnly=True)
+        factory = sessionmaker(bind=reader, expire_on_commit=False)
+        snapshot = CollectionSnapshot(f"{path}.snapshot", factory)
+
+        expected, queried = timed(queryStats, factory, 1, 1, now)
+        _, built = timed(snapshot.refresh)
+        size = sum(entry.stat().st_size for entry in os.scandir(f"{path}.snapshot"))
+        result, unchanged = timed(snapshotStats, snapshot, 1, 1, now)
+        assert result == expected, "snapshot stats differ from queried stats"
+
+        rate(engine, args.ratings, args.notes, now)
+        expected, queriedAfter = timed(queryStats, factory, 1, 1, now)
+        result, refreshed = timed(snapshotStats, snapshot, 1, 1, now)
+        assert result == expected, "snapshot stats differ after ratings"
+        reader.dispose()
+        engine.dispose()
+
+    print(f"collection: {args.notes} notes, {args.reviews} reviews, snapshot {size / 2**20:.1f} MiB")
+    print(f"query stats:                      {queried * 1000:8.1f} ms")
+    print(f"snapshot first build:             {built * 1000:8.1f} ms")
+    print(f"snapshot stats, nothing new:      {unchanged * 1000:8.1f} ms")
+    print(f"query stats after {args.ratings} ratings:    {queriedAfter * 1000:8.1f} ms")
+    print(f"snapshot stats after {args.ratings} ratings: {refreshed * 1000:8.1f} ms")
+    print("stats match")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmark of the study queue against the reversed list StudySession used before.
+Both queues are filled with the same due notes and studied to the end, a share of the notes is failed
+and has to come back later in the session: the list keeps its order with bisect.insort, the heap pushes.
+
+    python -m benchmarks.study_queue --notes 100000 --failed 0.1
+"""
+import argparse
+import bisect
+import random
+import time
+
+from logic.studyqueue import StudyQueue, QueuedNote, LEARNING_DELAY
+
+
+def createNotes(count: int, newShare: float, now: int):
+    notes = []
+    for n_id in range(count):
+        if random.random() < newShare:
+            notes.append(QueuedNote(n_id, 0, 0, 1))
+        else:
+            last = now - random.randint(2, 90) * 86400
+            notes.append(QueuedNote(n_id, last, random.randint(last + 1, now), 1))
+    return sorted(notes, key=lambda note: (note.n_next_r, note.n_id))
+
+
+def studyList(notes, failed: float, now: int) -> int:
+    """Previous StudySession: a list reversed at load time, the next note is at its end"""
+    # descending by due time, so the next note is at the end
+    queue = [(-note.n_next_r, -note.n_id, note) for note in notes[::-1]]
+    shown = 0
+    while queue:
+        _, _, note = queue.pop()
+        shown += 1
+        if note.n_last_r != now and random.random() < failed:
+            relearned = note._replace(n_last_r=now, n_next_r=now + LEARNING_DELAY)
+            bisect.insort(queue, (-relearned.n_next_r, -relearned.n_id, relearned))
+    return shown
+
+
+def studyHeap(notes, failed: float, now: int) -> int:
+    queue = StudyQueue(clock=lambda: now)
+    queue.fill(iter(notes), len(notes))
+    shown = 0
+    while not queue.isEmpty():
+        note = queue.pop()
+        shown += 1
+        if note.n_last_r != now and random.random() < failed:
+            queue.relearn(note._replace(n_last_r=now, n_next_r=now + LEARNING_DELAY))
+    return shown
+
+
+def measure(name: str, study, notes, failed: float, now: int) -> None:
+    random.seed(1)
+    start = time.perf_counter()
+    shown = study(notes, failed, now)
+    elapsed = time.perf_counter() - start
+    print(f"{name:>6}: {shown} cards shown in {elapsed:.3f}s, {elapsed / shown * 1e6:.2f} us per card")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=100000)
+    parser.add_argument("--failed", type=float, default=0.1, help="share of the notes rated Hard")
+    parser.add_argument("--new", type=float, default=0.2, help="share of new notes")
+    args = parser.parse_args()
+    now = int(time.time())
+    random.seed(0)
+    notes = createNotes(args.notes, args.new, now)
+    measure("list", studyList, notes, args.failed, now)
+    measure("heap", studyHeap, notes, args.failed, now)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Delta sync between two collections: a full first sync, then a day of reviews and edits on both sides.
+Checks that both collections end identical and reports the size of every exchange,
+the second sync goes through the stand-in HTTP server.
+
+    python -m benchmarks.sync_delta --notes 100000 --reviews 300
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import sqlalchemy as sql
+
+from data import dbmodel as dbm
+from logic.sync import LocalCollection, HttpCollection, syncCollections
+from logic.syncserver import SyncServer
+
+
+def createCollection(path: str, notes: int) -> sql.engine.Engine:
+    engine = dbm.createEngine(f"sqlite:///{path}")
+    dbm.prepareDatabase(engine)
+    if notes:
+        with engine.begin() as connection:
+            connection.execute(dbm.Card.__table__.insert(), {"c_name": "Basic", "c_fields": json.dumps(["Front", "Back"])})
+            connection.execute(dbm.Deck.__table__.insert(), {"d_name": "Deck", "c_id": 1})
+            connection.execute(dbm.Note.__table__.insert(), [
+                {"n_data": json.dumps([f"front {n}", f"back {n}"]), "n_last_r": 0, "n_next_r": 0, "d_id": 1}
+                for n in range(notes)])
+    return engine
+
+
+def review(engine: sql.engine.Engine, count: int, now: int) -> None:
+    """Rates random notes the way the controller does, one transaction per rating"""
+    with engine.connect() as connection:
+        ids = [row[0] for row in connection.exec_driver_sql("SELECT n_id FROM notes")]
+    for n_id in random.sample(ids, count):
+        with engine.begin() as connection:
+            connection.execute(sql.text("UPDATE notes SET n_last_r = :now, n_next_r = :next WHERE n_id = :id"),
+                               {"now": now, "next": now + random.randint(1, 10) * 86400, "id": n_id})
+            connection.execute(sql.text("INSERT INTO reviews (r_ease, n_id) VALUES (3, :id)"), {"id": n_id})
+
+
+def edit(engine: sql.engine.Engine, count: int, tag: str) -> None:
+    with engine.begin() as connection:
+        connection.execute(sql.text(
+            "UPDATE notes SET n_data = json_set(n_data, '$[1]', :tag) WHERE n_id IN "
+            "(SELECT n_id FROM notes ORDER BY random() LIMIT :count)"), {"tag": tag, "count": count})
+        connection.exec_driver_sql("DELETE FROM notes WHERE n_id IN (SELECT n_id FROM notes ORDER BY random() LIMIT 5)")
+        connection.execute(dbm.Note.__table__.insert(), [
+            {"n_data": json.dumps([f"new {tag} {n}", "back"]), "n_last_r": 0, "n_next_r": 0, "d_id": 1}
+            for n in range(10)])
+
+
+def snapshot(engine: sql.engine.Engine) -> list:
+    with engine.connect() as connection:
+        notes = connection.exec_driver_sql(
+            "SELECT n_guid, n_mtime, n_data, n_last_r, n_next_r, d_guid FROM notes JOIN decks USING (d_id) ORDER BY n_guid"
+        ).fetchall()
+        reviews = connection.exec_driver_sql(
+            "SELECT r_guid, r_mtime, r_ease, n_guid FROM reviews JOIN notes USING (n_id) ORDER BY r_guid").fetchall()
+    return notes + reviews
+
+
+def timedSync(label: str, local: LocalCollection, remote) -> None:
+    start = time.perf_counter()
+    result = syncCollections(local, remote)
+    print(f"{label}: sent {result.sent} rows ({result.sentBytes / 1024:.1f} KiB), "
+          f"received {result.received} rows ({result.receivedBytes / 1024:.1f} KiB) "
+          f"in {time.perf_counter() - start:.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=100000)
+    parser.add_argument("--reviews", type=int, default=300)
+    args = parser.parse_args()
+    dbm.Engine.echo = dbm.ReaderEngine.echo = False
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as directory:
+        desktop = createCollection(os.path.join(directory, "desktop.db"), args.notes)
+        server = createCollection(os.path.join(directory, "server.db"), 0)
+        local, remote = LocalCollection(desktop, ownsEngine=True), LocalCollection(server, ownsEngine=True)
+        try:
+            timedSync("first sync", local, remote)
+
+            now = int(time.time())
+            review(desktop, args.reviews, now)
+            review(server, args.reviews // 3, now + 60)  # reviews done on another device
+            edit(desktop, 20, "desktop")
+            edit(server, 20, "server")
+            httpServer = SyncServer(remote, port=0)
+            thread = threading.Thread(target=httpServer.serve_forever, daemon=True)
+            thread.start()
+            try:
+                timedSync("day of reviews over HTTP", local,
+                          HttpCollection(f"http://localhost:{httpServer.server_port}"))
+            finally:
+                httpServer.shutdown()
+                httpServer.server_close()
+            timedSync("nothing changed", local, remote)
+
+            identical = snapshot(desktop) == snapshot(server)
+            print(f"collections identical: {identical}")
+        finally:
+            local.close()
+            remote.close()
+    sys.exit(0 if identical else 1)
+
+
+if __name__ == "__main__":
+    main()
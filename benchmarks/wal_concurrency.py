@@ -0,0 +1,125 @@
+"""
+Checks of the connection layer: one writer connection and a pool of read-only connections in WAL mode.
+
+Snapshot consistency: the writer keeps moving review time between notes and logging reviews,
+every transaction keeps sum(n_next_r) constant and count(reviews) equal to sum(n_last_r).
+Readers check both invariants with separate queries inside one read transaction.
+
+Throughput: ratings are committed alone and then while reader threads scan the deck.
+
+    python -m benchmarks.wal_concurrency --notes 50000 --readers 4 --seconds 3
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import func
+from sqlalchemy.orm import sessionmaker
+
+from data import dbmodel as dbm
+from data.dbmodel import Base, Card, Deck, Note, Review
+
+
+def createDatabase(path: str, notes: int, readers: int):
+    writer = dbm.createEngine(f"sqlite:///{path}")
+    reader = dbm.createEngine(f"sqlite:///{path}", readOnly=True, poolSize=readers)
+    Base.metadata.create_all(writer)
+    writeFactory = sessionmaker(bind=writer, expire_on_commit=False)
+    with dbm.sessionScope(writeFactory) as session:
+        session.add(Card(c_id=1, c_name="Basic", c_fields=json.dumps(["Front", "Back"])))
+        session.add(Deck(d_id=1, d_name="Deck", c_id=1))
+        session.flush()  # bulk inserts skip the unit of work, the deck has to exist before its notes
+        session.bulk_insert_mappings(Note, [
+            {"n_data": json.dumps([f"front {n}", f"back {n}"]), "n_last_r": 0, "n_next_r": 1000, "d_id": 1}
+            for n in range(notes)
+        ])
+    return writeFactory, sessionmaker(bind=reader, expire_on_commit=False)
+
+
+def writeTransfer(writeFactory, notes: int) -> None:
+    a, b = random.sample(range(1, notes + 1), 2)
+    amount = random.randint(1, 100)
+    with dbm.sessionScope(writeFactory) as session:
+        session.query(Note).filter(Note.n_id == a) \
+            .update({Note.n_next_r: Note.n_next_r - amount, Note.n_last_r: Note.n_last_r + 1}, synchronize_session=False)
+        session.query(Note).filter(Note.n_id == b) \
+            .update({Note.n_next_r: Note.n_next_r + amount}, synchronize_session=False)
+        session.add(Review(r_ease=3, n_id=a))
+
+
+def checkSnapshot(readFactory, expectedSum: int) -> bool:
+    with dbm.sessionScope(readFactory) as session:
+        reviews = session.query(func.count(Review.r_id)).scalar()
+        time.sleep(0.001)  # give the writer a chance to commit in between
+        nextSum, lastSum = session.query(func.sum(Note.n_next_r), func.sum(Note.n_last_r)).one()
+    return nextSum == expectedSum and lastSum == reviews
+
+
+def readStats(readFactory) -> None:
+    """Scan of the whole deck, done by SQLite so the reader threads don't compete for the GIL"""
+    with dbm.sessionScope(readFactory) as session:
+        session.query(func.count(Note.n_id), func.sum(Note.n_next_r - Note.n_last_r), func.max(Note.n_next_r)) \
+            .filter(Note.d_id == 1).group_by(Note.n_last_r > 0).all()
+
+
+def runWriter(writeFactory, notes: int, seconds: float) -> int:
+    written, end = 0, time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        writeTransfer(writeFactory, notes)
+        written += 1
+    return written
+
+
+def runReaders(count: int, function, stop: threading.Event, results: list) -> list:
+    def loop():
+        while not stop.is_set():
+            results.append(function())
+    threads = [threading.Thread(target=loop) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=50000)
+    parser.add_argument("--readers", type=int, default=dbm.READER_POOL_SIZE)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+    dbm.Engine.echo = dbm.ReaderEngine.echo = False
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as directory:
+        writeFactory, readFactory = createDatabase(os.path.join(directory, "bench.db"), args.notes, args.readers)
+        expectedSum = 1000 * args.notes
+
+        # snapshot consistency
+        stop, checks = threading.Event(), []
+        threads = runReaders(args.readers, lambda: checkSnapshot(readFactory, expectedSum), stop, checks)
+        written = runWriter(writeFactory, args.notes, args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        failed = checks.count(False)
+        print(f"snapshot: {len(checks)} checks during {written} writes, {failed} inconsistent")
+
+        # throughput
+        alone = runWriter(writeFactory, args.notes, args.seconds)
+        stop, reads = threading.Event(), []
+        threads = runReaders(args.readers, lambda: readStats(readFactory), stop, reads)
+        concurrent = runWriter(writeFactory, args.notes, args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        print(f"writes alone: {alone / args.seconds:.0f}/s, "
+              f"with {args.readers} readers: {concurrent / args.seconds:.0f}/s, "
+              f"stats reads: {len(reads) / args.seconds:.1f}/s")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,111 @@
+import os
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
 import sqlalchemy as sql
-from sqlalchemy import Column, Integer, String, Text, Index
+import sqlalchemy.orm
+from sqlalchemy import Column, Integer, String, Text, Index, ForeignKey, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
+from data import integrity, migrations
+from data.migrations import Backfill, Migration
+
+
+def createEngine(url: str, readOnly: bool = False, poolSize: int = 1, **kwargs) -> sql.engine.Engine:
+    """
+    Creates SQLite engine with foreign keys enforced on every connection.
+    pysqlite's own transaction handling is disabled, so BEGIN is emitted by SQLAlchemy
+    and every transaction, including DDL and reads, is really atomic.
+    The database runs in WAL mode, so a read transaction sees one snapshot and doesn't block the writer.
+    Pool holds poolSize connections, they may be used by any thread but by one at a time.
+    """
+    engine = sql.create_engine(url, poolclass=sql.pool.QueuePool, pool_size=poolSize, max_overflow=0,
+                               connect_args={"check_same_thread": False}, **kwargs)
+
+    @event.listens_for(engine, "connect")
+    def _onConnect(dbapiConnection, _):
+        dbapiConnection.isolation_level = None
+        dbapiConnection.execute("PRAGMA foreign_keys=ON")
+        if readOnly:
+            dbapiConnection.execute("PRAGMA query_only=ON")
+            return
+        # only takes effect for new databases, existing ones are converted by logic.maintenance
+        dbapiConnection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        dbapiConnection.execute("PRAGMA journal_mode=WAL")
+        # in WAL mode a commit is durable after the next checkpoint, the database can't be corrupted
+        dbapiConnection.execute("PRAGMA synchronous=NORMAL")
 
-Engine = sql.create_engine('sqlite:///appdata.db', echo=True)
+    @event.listens_for(engine, "begin")
+    def _onBegin(connection):
+        connection.exec_driver_sql("BEGIN")
+
+    return engine
+
+
+DATABASE_PATH = "appdata.db"
+MEDIA_PATH = os.path.join(os.path.dirname(os.path.abspath(DATABASE_PATH)), "media")  # media store lives next to it
+READER_POOL_SIZE = 4
+# all writes go through the single writer connection, read-heavy features use the read-only pool
+Engine = createEngine(f"sqlite:///{DATABASE_PATH}", echo=True)
+ReaderEngine = createEngine(f"sqlite:///{DATABASE_PATH}", readOnly=True, poolSize=READER_POOL_SIZE, echo=True)
 Base = declarative_base()
-Session = sessionmaker(bind=Engine)
+# objects outlive the unit of work which loaded them, so they must stay readable after commit
+Session = sessionmaker(bind=Engine, expire_on_commit=False)
+ReadSession = sessionmaker(bind=ReaderEngine, expire_on_commit=False)
+
+
+class SessionStats:
+    """
+    Class collects the statistics of units of work opened with sessionScope
+    opened              - number of units of work opened so far
+    active              - number of units of work currently open
+    lastIdentityMap     - size of the identity map of the last closed unit of work
+    maxIdentityMap      - largest identity map of any closed unit of work
+    """
+    def __init__(self):
+        self.opened = 0
+        self.active = 0
+        self.lastIdentityMap = 0
+        self.maxIdentityMap = 0
+        self.lock = threading.Lock()  # units of work are also opened by worker threads
+
+    def onOpen(self) -> None:
+        with self.lock:
+            self.opened += 1
+            self.active += 1
+
+    def onClose(self, identityMapSize: int) -> None:
+        with self.lock:
+            self.lastIdentityMap = identityMapSize
+            self.maxIdentityMap = max(self.maxIdentityMap, identityMapSize)
+            self.active -= 1
+
+    def __repr__(self):
+        return f"<SessionStats opened:{self.opened} active:{self.active} lastIdentityMap:{self.lastIdentityMap}>"
+
+
+sessionStats = SessionStats()
+
+
+@contextmanager
+def sessionScope(factory: sessionmaker = Session) -> Iterator[sqlalchemy.orm.Session]:
+    """
+    Provides a short-lived unit of work, commits it when the block succeeds,
+    rolls it back on error and always releases the session with its identity map
+    """
+    session = factory()
+    sessionStats.onOpen()
+    try:
+        yield session
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        sessionStats.onClose(len(session.identity_map))
+        session.close()
 
 
 class Card(Base):
@@ -17,6 +116,9 @@ class Card(Base):
     c_fields    - name of the fields on a card
     c_layout_f  - front layout of the card
     c_layout_b  - back layout of the card
+    c_guid      - ID of the card shared by all synced collections
+    c_mod       - change sequence number of the last modification
+    c_mtime     - time of the last modification
     """
     __tablename__ = 'cards'
     c_id = Column(Integer, primary_key=True)
@@ -24,9 +126,14 @@ class Card(Base):
     c_fields = Column(String(255), nullable=False)
     c_layout_f = Column(Text(1000))
     c_layout_b = Column(Text(1000))
+    c_guid = Column(String(32))
+    c_mod = Column(Integer, nullable=False, default=0, server_default="0")
+    c_mtime = Column(Integer, nullable=False, default=0, server_default="0")
 
     __table_args__ = (
         Index("ix_c_name", "c_name"),
+        Index("ix_c_guid", "c_guid", unique=True),
+        Index("ix_c_mod", "c_mod"),
     )
 
     def __repr__(self):
@@ -39,14 +146,22 @@ class Deck(Base):
     d_id        - ID of teh deck
     d_name      - name of the deck
     c_id        - ID of the card used by deck
+    d_guid      - ID of the deck shared by all synced collections
+    d_mod       - change sequence number of the last modification
+    d_mtime     - time of the last modification
     """
     __tablename__ = 'decks'
     d_id = Column(Integer, primary_key=True)
     d_name = Column(String(20), nullable=False, unique=True)
-    c_id = Column(Integer, nullable=False)
+    c_id = Column(Integer, ForeignKey("cards.c_id", ondelete="RESTRICT"), nullable=False)
+    d_guid = Column(String(32))
+    d_mod = Column(Integer, nullable=False, default=0, server_default="0")
+    d_mtime = Column(Integer, nullable=False, default=0, server_default="0")
 
     __table_args__ = (
         Index("ix_d_name", "d_name"),
+        Index("ix_d_guid", "d_guid", unique=True),
+        Index("ix_d_mod", "d_mod"),
     )
 
     def __repr__(self):
@@ -61,13 +176,26 @@ class Note(Base):
     n_last_r    - time of the last review of the note
     n_next_r    - time of the next review
     d_id        - ID of the deck used by this note
+    n_guid      - ID of the note shared by all synced collections
+    n_mod       - change sequence number of the last modification
+    n_mtime     - time of the last modification
     """
     __tablename__ = 'notes'
     n_id = Column(Integer, primary_key=True)
     n_data = Column(String(255), nullable=False)
     n_last_r = Column(Integer, nullable=False, default=0)
     n_next_r = Column(Integer, nullable=False, default=0)
-    d_id = Column(Integer, nullable=False)
+    d_id = Column(Integer, ForeignKey("decks.d_id", ondelete="CASCADE"), nullable=False)
+    n_guid = Column(String(32))
+    n_mod = Column(Integer, nullable=False, default=0, server_default="0")
+    n_mtime = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        # serves the due queue scan of a deck as well as the cascade from decks
+        Index("ix_n_d_id_next_r", "d_id", "n_next_r"),
+        Index("ix_n_guid", "n_guid", unique=True),
+        Index("ix_n_mod", "n_mod"),
+    )
 
     def __repr__(self):
         return f"<Note n_id:{self.n_id}>"
@@ -79,14 +207,240 @@ class Review(Base):
     r_id        - ID of the review
     r_ease      - review rating
     n_id        - ID of the note to which the review belongs
+    r_guid      - ID of the review shared by all synced collections
+    r_mod       - change sequence number of the last modification
+    r_mtime     - time of the last modification
     """
     __tablename__ = 'reviews'
     r_id = Column(Integer, primary_key=True)
     r_ease = Column(Integer, nullable=False)
-    n_id = Column(Integer, nullable=False)
+    n_id = Column(Integer, ForeignKey("notes.n_id", ondelete="CASCADE"), nullable=False)
+    r_guid = Column(String(32))
+    r_mod = Column(Integer, nullable=False, default=0, server_default="0")
+    r_mtime = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        Index("ix_r_n_id", "n_id"),
+        Index("ix_r_guid", "r_guid", unique=True),
+        Index("ix_r_mod", "r_mod"),
+    )
 
     def __repr__(self):
         return f"<Review r_id:{self.r_id}>"
 
 
-Base.metadata.create_all(Engine)
+class MetadataVersion(Base):
+    """
+    Single row counter bumped by triggers on every change of cards or decks,
+    caches of them compare it to know when they are stale
+    id          - always 1
+    version     - number of changes so far
+    """
+    __tablename__ = 'metadata_version'
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+VERSIONED_TABLES = ["cards", "decks"]
+
+
+def createVersionTriggers(engine: sql.engine.Engine) -> None:
+    """Creates the triggers counting changes, a migration rebuilding these tables has to run it again"""
+    with engine.begin() as connection:
+        connection.exec_driver_sql("INSERT OR IGNORE INTO metadata_version (id, version) VALUES (1, 0)")
+        for table in VERSIONED_TABLES:
+            for operation in ("INSERT", "UPDATE", "DELETE"):
+                connection.exec_driver_sql(
+                    f"CREATE TRIGGER IF NOT EXISTS tr_{table}_{operation.lower()}_version AFTER {operation} ON {table} "
+                    f"BEGIN UPDATE metadata_version SET version = version + 1 WHERE id = 1; END"
+                )
+
+
+class SchemaVersion(Base):
+    """
+    Single row with the version of the last migration applied to the database, see data.migrations
+    id          - always 1
+    version     - version of the migration
+    """
+    __tablename__ = 'schema_version'
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class BackfillProgress(Base):
+    """
+    Class maps the backfill_progress table, progress of data migrations running in the background
+    name        - name of the backfill
+    version     - version of the migration which registered it
+    last_key    - rows with a primary key up to this one are done
+    end_key     - last primary key when it was registered, later rows don't need it
+    done        - 1 once finished
+    """
+    __tablename__ = 'backfill_progress'
+    name = Column(String(64), primary_key=True)
+    version = Column(Integer, nullable=False)
+    last_key = Column(Integer, nullable=False, default=0)
+    end_key = Column(Integer, nullable=False)
+    done = Column(Integer, nullable=False, default=0)
+
+
+class SyncState(Base):
+    """
+    Single row with the identity of the collection and its change sequence
+    id              - always 1
+    collection_id   - random ID of this collection
+    seq             - change sequence number given to rows modified now, bumped by every sync
+    """
+    __tablename__ = 'sync_state'
+    id = Column(Integer, primary_key=True)
+    collection_id = Column(String(32), nullable=False)
+    seq = Column(Integer, nullable=False, default=0)
+
+
+class SyncPeer(Base):
+    """
+    Class maps the sync_peers table, progress of syncing with another collection
+    peer_id         - collection_id of the other collection
+    local_mark      - changes of this collection up to this sequence number were sent
+    remote_mark     - changes of the other collection up to this sequence number were received
+    last_sync       - time of the last finished sync
+    """
+    __tablename__ = 'sync_peers'
+    peer_id = Column(String(32), primary_key=True)
+    local_mark = Column(Integer, nullable=False, default=-1)
+    remote_mark = Column(Integer, nullable=False, default=-1)
+    last_sync = Column(Integer, nullable=False, default=0)
+
+
+class Grave(Base):
+    """
+    Class maps the graves table, tombstones of deleted rows written by triggers
+    g_id        - ID of the tombstone
+    g_table     - table of the deleted row
+    g_guid      - guid of the deleted row
+    g_mod       - change sequence number of the deletion
+    g_mtime     - time of the deletion
+    """
+    __tablename__ = 'graves'
+    g_id = Column(Integer, primary_key=True)
+    g_table = Column(String(20), nullable=False)
+    g_guid = Column(String(32), nullable=False)
+    g_mod = Column(Integer, nullable=False)
+    g_mtime = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("ix_g_mod", "g_mod"),
+    )
+
+
+# (table, primary key, column prefix, columns whose change is synced)
+SYNCED_TABLES = [
+    ("cards", "c_id", "c", ["c_name", "c_fields", "c_layout_f", "c_layout_b"]),
+    ("decks", "d_id", "d", ["d_name", "c_id"]),
+    ("notes", "n_id", "n", ["n_data", "n_last_r", "n_next_r", "d_id"]),
+    ("reviews", "r_id", "r", ["r_ease", "n_id"]),
+]
+_CURRENT_SEQ = "(SELECT seq FROM sync_state WHERE id = 1)"
+_NOW = "CAST(strftime('%s', 'now') AS INTEGER)"
+
+
+def createChangeLogTriggers(engine: sql.engine.Engine) -> None:
+    """
+    Creates the triggers stamping modified rows with the current change sequence number and time
+    and writing tombstones of deleted rows. Rows inserted without a guid get a random one.
+    The sequence number is bumped by sync only, so a trigger costs one lookup of the single row.
+    Writes carrying their own mtime, like rows received by sync, keep it.
+    Existing triggers are replaced, so this also upgrades triggers created by older versions.
+    """
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "INSERT OR IGNORE INTO sync_state (id, collection_id, seq) VALUES (1, lower(hex(randomblob(16))), 0)")
+        for table, key, prefix, columns in SYNCED_TABLES:
+            for operation in ("insert", "update", "delete"):
+                connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS tr_{table}_{operation}_log")
+            connection.exec_driver_sql(
+                f"CREATE TRIGGER tr_{table}_insert_log AFTER INSERT ON {table} BEGIN "
+                f"UPDATE {table} SET {prefix}_mod = {_CURRENT_SEQ}, "
+                f"{prefix}_mtime = CASE WHEN NEW.{prefix}_mtime > 0 THEN NEW.{prefix}_mtime ELSE {_NOW} END, "
+                f"{prefix}_guid = coalesce(NEW.{prefix}_guid, lower(hex(randomblob(16)))) "
+                f"WHERE {key} = NEW.{key}; END"
+            )
+            connection.exec_driver_sql(
+                f"CREATE TRIGGER tr_{table}_update_log AFTER UPDATE OF {', '.join(columns)} ON {table} "
+                f"BEGIN UPDATE {table} SET {prefix}_mod = {_CURRENT_SEQ}, "
+                f"{prefix}_mtime = CASE WHEN NEW.{prefix}_mtime != OLD.{prefix}_mtime "
+                f"THEN NEW.{prefix}_mtime ELSE {_NOW} END "
+                f"WHERE {key} = NEW.{key}; END"
+            )
+            # a row deleted before the guid backfill reached it was never synced, its tombstone still tells
+            # the stats snapshot that rows are gone
+            connection.exec_driver_sql(
+                f"CREATE TRIGGER tr_{table}_delete_log AFTER DELETE ON {table} BEGIN "
+                f"INSERT INTO graves (g_table, g_guid, g_mod, g_mtime) "
+                f"VALUES ('{table}', coalesce(OLD.{prefix}_guid, lower(hex(randomblob(16)))), {_CURRENT_SEQ}, {_NOW}); END"
+            )
+
+
+def _upgradeIndexes(engine: sql.engine.Engine) -> None:
+    integrity.createMissingIndexes(engine, Base.metadata)
+    with engine.begin() as connection:
+        # replaced by ix_n_d_id_next_r, which serves the same lookups, a notes table waiting for its rebuilt
+        # twin keeps it until the swap drops it with the table
+        if "notes" not in integrity.pendingRebuilds(connection):
+            connection.exec_driver_sql("DROP INDEX IF EXISTS ix_n_d_id")
+
+
+def _finishRebuild(table: str) -> Callable[[sql.engine.Engine], None]:
+    def finish(engine: sql.engine.Engine) -> None:
+        integrity.swapInRebuiltTable(engine, Base.metadata.tables[table])
+        # triggers went away with the old table
+        createChangeLogTriggers(engine)
+    return finish
+
+
+# large tables get their foreign keys by a copy into a rebuilt twin, parents before children
+REBUILD_BACKFILLS = tuple(
+    Backfill(f"{table}_rebuild", table, integrity.COPIED_TABLES[table][0],
+             integrity.copyStatement(Base.metadata.tables[table]), f"{table}{integrity.REBUILT_SUFFIX}",
+             _finishRebuild(table))
+    for table in integrity.COPIED_TABLES
+)
+
+
+# rows existing before the change log get their guid, rows inserted since get it from the insert trigger
+GUID_BACKFILLS = tuple(
+    Backfill(f"{table}_guid", table, key,
+             f"UPDATE {table} SET {prefix}_guid = lower(hex(randomblob(16))) "
+             f"WHERE {key} > :start AND {key} <= :end AND {prefix}_guid IS NULL")
+    for table, key, prefix, _ in SYNCED_TABLES
+)
+
+# never change or reorder released migrations, add new ones at the end
+MIGRATIONS = [
+    # columns declared after the first release, from before migrations were versioned
+    Migration(1, "add missing columns", lambda engine: integrity.addMissingColumns(engine, Base.metadata)),
+    Migration(2, "add foreign keys", lambda engine: integrity.upgradeForeignKeys(engine, Base.metadata),
+              REBUILD_BACKFILLS),
+    Migration(3, "create declared indexes, drop ix_n_d_id", _upgradeIndexes),
+    Migration(4, "metadata version triggers", createVersionTriggers),
+    Migration(5, "change log triggers", createChangeLogTriggers, GUID_BACKFILLS),
+]
+
+
+# column sets used by read paths, rows returned by them are plain tuples which don't enter the identity map
+CARD_COLUMNS = (Card.c_id, Card.c_name, Card.c_fields, Card.c_layout_f, Card.c_layout_b)
+DECK_COLUMNS = (Deck.d_id, Deck.d_name, Deck.c_id)
+NOTE_COLUMNS = (Note.n_id, Note.n_data, Note.n_last_r, Note.n_next_r, Note.d_id)
+# study queues hold only IDs and times, content is fetched for the shown note
+QUEUE_COLUMNS = (Note.n_id, Note.n_last_r, Note.n_next_r, Note.d_id)
+
+
+def prepareDatabase(engine: sql.engine.Engine) -> None:
+    """
+    Creates missing tables and applies pending migrations, backfills are left to a migrations.BackfillRunner
+    """
+    Base.metadata.create_all(engine)
+    migrations.migrate(engine, MIGRATIONS)
+
+
+prepareDatabase(Engine)
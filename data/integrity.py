@@ -0,0 +1,158 @@
+import logging
+
+import sqlalchemy as sql
+from sqlalchemy.schema import CreateTable
+
+
+logger = logging.getLogger(__name__)
+
+REBUILT_TABLES = ["decks", "notes", "reviews"]
+# large tables are copied into their rebuilt twin in the background, see copyStatement
+COPIED_TABLES = {"notes": ("n_id", "d_id", "decks", "d_id"), "reviews": ("r_id", "n_id", "notes", "n_id")}
+REBUILT_SUFFIX = "_rebuilt"
+
+
+def hasForeignKeys(connection: sql.engine.Connection, table: str) -> bool:
+    """Checks whether the table was created with foreign key constraints"""
+    return len(connection.exec_driver_sql(f"PRAGMA foreign_key_list({table})").fetchall()) > 0
+
+
+def upgradeForeignKeys(engine: sql.engine.Engine, metadata: sql.MetaData) -> None:
+    """
+    One-time upgrade of databases created before foreign keys were declared.
+    SQLite can't add constraints to existing tables, so tables are rebuilt from their current definition
+    in metadata. Small tables are rebuilt right away. Large ones only get an empty twin kept up to date
+    by triggers, rows are copied into it in chunks by a backfill and swapInRebuiltTable finishes the upgrade.
+    """
+    with engine.connect() as connection:
+        outdated = [table for table in REBUILT_TABLES if not hasForeignKeys(connection, table)]
+    if not outdated:
+        return
+    with engine.connect() as connection:
+        # constraints can't be checked while the tables are being swapped
+        connection.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        try:
+            with connection.begin():
+                for name in outdated:
+                    if name in COPIED_TABLES:
+                        createRebuiltTable(connection, metadata.tables[name])
+                    else:
+                        rebuildTable(connection, metadata.tables[name])
+        finally:
+            connection.exec_driver_sql("PRAGMA foreign_keys=ON")
+    logger.info("Adding foreign keys to tables %s", ", ".join(outdated))
+
+
+def rebuildTable(connection: sql.engine.Connection, table: sql.Table) -> None:
+    """Recreates the table with its declared schema, keeping all rows"""
+    temporary = f"{table.name}{REBUILT_SUFFIX}"
+    ddl = str(CreateTable(table).compile(dialect=connection.dialect))
+    connection.exec_driver_sql(ddl.replace(f"CREATE TABLE {table.name} ", f"CREATE TABLE {temporary} ", 1))
+    columns = ", ".join(column.name for column in table.columns)
+    connection.exec_driver_sql(f"INSERT INTO {temporary} ({columns}) SELECT {columns} FROM {table.name}")
+    connection.exec_driver_sql(f"DROP TABLE {table.name}")
+    connection.exec_driver_sql(f"ALTER TABLE {temporary} RENAME TO {table.name}")
+    for index in table.indexes:
+        index.create(connection)
+
+
+def pendingRebuilds(connection: sql.engine.Connection) -> set:
+    """Tables whose rebuilt twin is still being filled"""
+    names = {row[0] for row in connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    return {name for name in REBUILT_TABLES if f"{name}{REBUILT_SUFFIX}" in names}
+
+
+def createRebuiltTable(connection: sql.engine.Connection, table: sql.Table) -> None:
+    """
+    Creates the empty twin of a large table with its declared schema. Triggers copy every row the app writes
+    meanwhile, they read the row back so they also see changes made by the change log triggers.
+    """
+    temporary = f"{table.name}{REBUILT_SUFFIX}"
+    if table.name in pendingRebuilds(connection):
+        return
+    ddl = str(CreateTable(table).compile(dialect=connection.dialect))
+    connection.exec_driver_sql(ddl.replace(f"CREATE TABLE {table.name} ", f"CREATE TABLE {temporary} ", 1))
+    taken = {row[0] for row in connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    for index in table.indexes:
+        # names of indexes are global, the ones the old table still has are created by the swap
+        if index.name not in taken:
+            columns = ", ".join(column.name for column in index.columns)
+            connection.exec_driver_sql(f"CREATE {'UNIQUE ' if index.unique else ''}INDEX {index.name} "
+                                       f"ON {temporary} ({columns})")
+    key, foreignKey, parent, parentKey = COPIED_TABLES[table.name]
+    columns = ", ".join(column.name for column in table.columns)
+    copy = f"INSERT OR REPLACE INTO {temporary} ({columns}) SELECT {columns} FROM {table.name} WHERE {key} = NEW.{key}"
+    # orphans are skipped, a parent copied itself can't be named here, SQLite refuses the rename of its swap
+    # while a trigger references the dropped table, the foreign key of the twin checks the parent instead
+    if parent not in COPIED_TABLES:
+        copy += f" AND EXISTS (SELECT 1 FROM {parent} WHERE {parent}.{parentKey} = {table.name}.{foreignKey})"
+    for operation in ("INSERT", "UPDATE"):
+        connection.exec_driver_sql(f"CREATE TRIGGER tr_{table.name}_{operation.lower()}_rebuilt "
+                                   f"AFTER {operation} ON {table.name} BEGIN {copy}; END")
+    connection.exec_driver_sql(f"CREATE TRIGGER tr_{table.name}_delete_rebuilt AFTER DELETE ON {table.name} "
+                               f"BEGIN DELETE FROM {temporary} WHERE {key} = OLD.{key}; END")
+
+
+def copyStatement(table: sql.Table) -> str:
+    """
+    Backfill statement copying a key range into the rebuilt twin. Rows without a parent are left behind,
+    which purges the orphans. Rows the triggers copied already are newer and kept.
+    """
+    key, foreignKey, parent, parentKey = COPIED_TABLES[table.name]
+    columns = ", ".join(column.name for column in table.columns)
+    return (f"INSERT OR IGNORE INTO {table.name}{REBUILT_SUFFIX} ({columns}) SELECT {columns} FROM {table.name} "
+            f"WHERE {key} > :start AND {key} <= :end "
+            f"AND EXISTS (SELECT 1 FROM {parent} WHERE {parent}.{parentKey} = {table.name}.{foreignKey})")
+
+
+def swapInRebuiltTable(engine: sql.engine.Engine, table: sql.Table) -> None:
+    """Replaces the table by its filled twin, does nothing when it was swapped already"""
+    with engine.connect() as connection:
+        # with foreign keys on, dropping the old table would cascade into the rebuilt children
+        connection.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        try:
+            with connection.begin():
+                if table.name not in pendingRebuilds(connection):
+                    return
+                connection.exec_driver_sql(f"DROP TABLE {table.name}")
+                connection.exec_driver_sql(f"ALTER TABLE {table.name}{REBUILT_SUFFIX} RENAME TO {table.name}")
+                # no foreign_key_check, rows were copied only with their parent and the twin enforced its keys
+                for index in table.indexes:
+                    index.create(connection, checkfirst=True)
+        finally:
+            connection.exec_driver_sql("PRAGMA foreign_keys=ON")
+    logger.info("Added foreign keys to table %s", table.name)
+
+
+def createMissingIndexes(engine: sql.engine.Engine, metadata: sql.MetaData) -> None:
+    """
+    create_all skips existing tables, so indexes declared later are added here.
+    Tables waiting for their rebuilt twin get them with the twin.
+    """
+    with engine.begin() as connection:
+        pending = pendingRebuilds(connection)
+        for table in metadata.sorted_tables:
+            if table.name in pending:
+                continue
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+
+
+def addMissingColumns(engine: sql.engine.Engine, metadata: sql.MetaData) -> None:
+    """
+    create_all skips existing tables, so columns declared later are added here.
+    Such columns must be nullable or have a server default, which fills the existing rows.
+    """
+    with engine.begin() as connection:
+        for table in metadata.sorted_tables:
+            existing = {row[1] for row in connection.exec_driver_sql(f"PRAGMA table_info({table.name})")}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(connection.dialect)}"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+                if column.server_default is not None:
+                    ddl += f" DEFAULT {column.server_default.arg}"
+                connection.exec_driver_sql(ddl)
+                logger.info("Added column %s.%s", table.name, column.name)
@@ -0,0 +1,58 @@
+import hashlib
+import os
+import re
+import tempfile
+from typing import Optional
+
+
+MEDIA_SCHEME = "media"
+MEDIA_NAME = re.compile(r"^[0-9a-f]{64}(\.[A-Za-z0-9]{1,8})?$")
+
+
+class MediaStore:
+    """
+    MediaStore keeps media files in a directory next to the database.
+    Files are named by the SHA-256 hash of their content, so every file is stored once
+    no matter how many notes use it, and names can be shared safely between collections.
+    """
+    def __init__(self, root: str):
+        self._root = root
+
+    def add(self, path: str) -> str:
+        """Adds a file to the store, returns its media name"""
+        with open(path, "rb") as file:
+            data = file.read()
+        return self.addBytes(data, os.path.splitext(path)[1])
+
+    def addBytes(self, data: bytes, extension: str = "") -> str:
+        """Adds content to the store, returns its media name"""
+        name = hashlib.sha256(data).hexdigest() + extension.lower()
+        if not MEDIA_NAME.match(name):
+            name = hashlib.sha256(data).hexdigest()
+        target = os.path.join(self._root, name)
+        if not os.path.exists(target):
+            os.makedirs(self._root, exist_ok=True)
+            # written under a temporary name first, so the store never contains partial files
+            descriptor, temporary = tempfile.mkstemp(dir=self._root)
+            with os.fdopen(descriptor, "wb") as file:
+                file.write(data)
+            os.replace(temporary, target)
+        return name
+
+    def path(self, name: str) -> Optional[str]:
+        """Returns path of a stored file, None for names which aren't in the store"""
+        if not MEDIA_NAME.match(name):
+            return None
+        target = os.path.join(self._root, name)
+        return target if os.path.exists(target) else None
+
+    def read(self, name: str) -> Optional[bytes]:
+        path = self.path(name)
+        if path is None:
+            return None
+        with open(path, "rb") as file:
+            return file.read()
+
+    def verify(self, name: str, data: bytes) -> bool:
+        """Checks that content matches its media name"""
+        return MEDIA_NAME.match(name) is not None and name.split(".")[0] == hashlib.sha256(data).hexdigest()
@@ -0,0 +1,185 @@
+"""
+Versioned schema migrations of collection databases.
+create_all only creates missing tables, every change of an existing table is a migration with a version number.
+A database remembers the last version applied in schema_version, newer migrations run in order at startup.
+
+A migration has a schema step, which runs at startup and has to be quick, and optional backfills.
+A backfill fills data of a large table in primary key ranges, every range is a short transaction of its own,
+and its progress is kept in backfill_progress, so it continues where it stopped after a restart.
+Backfills run in the background once the app is up, code reading the backfilled data has to cope
+with rows not reached yet, or wait for BackfillRunner.complete().
+
+Steps of a migration check the database before they change it, a step interrupted before its version was
+recorded runs again on the next start.
+
+    python -m data.migrations appdata.db
+"""
+import argparse
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import sqlalchemy as sql
+
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_CHUNK = 2000  # primary keys per backfill transaction
+BACKFILL_PAUSE = 0.01  # seconds between transactions, leaves the writer connection to the app
+
+
+class Backfill(NamedTuple):
+    """
+    Data migration of one table
+    name        - unique name, progress is stored under it
+    table       - table the statement goes through
+    key         - integer primary key of the table, ranges of it are processed in order
+    statement   - SQL changing rows with start < key <= end, given as :start and :end
+    target      - table the statement writes to when the schema step may not have created it,
+                  the backfill is registered only when it exists
+    finish      - runs once every range is done, before the backfill is recorded as done,
+                  so it has to cope with running again after an interruption
+    """
+    name: str
+    table: str
+    key: str
+    statement: str
+    target: Optional[str] = None
+    finish: Optional[Callable[[sql.engine.Engine], None]] = None
+
+
+class Migration(NamedTuple):
+    """
+    version     - number recorded once the schema step is done, migrations run in increasing order
+    name        - short description for logs
+    upgrade     - schema step, gets the engine and runs its own transactions
+    backfills   - data steps registered after the schema step and run in the background
+    """
+    version: int
+    name: str
+    upgrade: Callable[[sql.engine.Engine], None]
+    backfills: Tuple[Backfill, ...] = ()
+
+
+def currentVersion(connection: sql.engine.Connection) -> int:
+    return connection.exec_driver_sql("SELECT version FROM schema_version WHERE id = 1").scalar() or 0
+
+
+def migrate(engine: sql.engine.Engine, migrations: List[Migration]) -> int:
+    """Applies migrations newer than the database, returns the number applied"""
+    versions = [migration.version for migration in migrations]
+    if versions != sorted(set(versions)):
+        raise ValueError("migration versions must be unique and in increasing order")
+    with engine.begin() as connection:
+        connection.exec_driver_sql("INSERT OR IGNORE INTO schema_version (id, version) VALUES (1, 0)")
+        version = currentVersion(connection)
+    if versions and version > versions[-1]:
+        raise RuntimeError(f"Database schema version {version} is newer than the supported version {versions[-1]}")
+    applied = 0
+    for migration in migrations:
+        if migration.version <= version:
+            continue
+        start = time.monotonic()
+        migration.upgrade(engine)
+        with engine.begin() as connection:
+            tables = {row[0] for row in connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            for backfill in migration.backfills:
+                if backfill.target is not None and backfill.target not in tables:
+                    continue
+                end = connection.exec_driver_sql(f"SELECT MAX({backfill.key}) FROM {backfill.table}").scalar() or 0
+                connection.execute(sql.text(
+                    "INSERT OR IGNORE INTO backfill_progress (name, version, last_key, end_key, done) "
+                    "VALUES (:name, :version, 0, :end, 0)"
+                ), {"name": backfill.name, "version": migration.version, "end": end})
+            connection.execute(sql.text("UPDATE schema_version SET version = :version WHERE id = 1"),
+                               {"version": migration.version})
+        applied += 1
+        logger.info("Applied migration %d %s in %.2fs", migration.version, migration.name, time.monotonic() - start)
+    return applied
+
+
+class BackfillRunner:
+    """Runs pending backfills of the database chunk by chunk, from any thread"""
+
+    def __init__(self, engine: sql.engine.Engine, migrations: List[Migration], chunk: int = BACKFILL_CHUNK,
+                 pause: float = BACKFILL_PAUSE):
+        self._engine = engine
+        self._backfills: Dict[str, Backfill] = {backfill.name: backfill for migration in migrations
+                                                for backfill in migration.backfills}
+        self._chunk = chunk
+        self._pause = pause
+        self._lock = threading.Lock()  # the app and sync may both push backfills forward
+        self._stop = threading.Event()
+        self._pending: Optional[bool] = None
+
+    def progress(self) -> List[Tuple[str, int, int, bool]]:
+        """Returns (name, last key done, last key to do, done) of every backfill the database registered"""
+        with self._engine.connect() as connection:
+            return [tuple(row) for row in connection.exec_driver_sql(
+                "SELECT name, last_key, end_key, done FROM backfill_progress ORDER BY version, name")]
+
+    def isPending(self) -> bool:
+        if self._pending is None:
+            self._pending = any(not done for *_, done in self.progress())
+        return self._pending
+
+    def step(self) -> bool:
+        """Processes one chunk of the first unfinished backfill, returns whether any work is left"""
+        with self._lock:
+            with self._engine.begin() as connection:
+                row = connection.exec_driver_sql(
+                    "SELECT name, last_key, end_key FROM backfill_progress WHERE done = 0 ORDER BY version, name LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    self._pending = False
+                    return False
+                name, start, end = row
+                backfill = self._backfills.get(name)
+                if backfill is None:
+                    raise RuntimeError(f"Backfill {name} of the database isn't known to this version of the app")
+                stop = min(start + self._chunk, end)
+                if stop > start:
+                    connection.execute(sql.text(backfill.statement), {"start": start, "end": stop})
+                finished = stop >= end
+                connection.execute(sql.text("UPDATE backfill_progress SET last_key = :stop, done = :done WHERE name = :name"),
+                                   {"stop": stop, "done": int(finished and backfill.finish is None), "name": name})
+            if finished and backfill.finish is not None:
+                backfill.finish(self._engine)
+                with self._engine.begin() as connection:
+                    connection.execute(sql.text("UPDATE backfill_progress SET done = 1 WHERE name = :name"), {"name": name})
+        if finished:
+            logger.info("Backfill %s done", name)
+        elif (stop // self._chunk) % 20 == 0:
+            logger.info("Backfill %s at %d of %d", name, stop, end)
+        return True
+
+    def complete(self) -> None:
+        """Runs all pending backfills, returns early when stop() is called"""
+        self._stop.clear()
+        while not self._stop.is_set() and self.step():
+            time.sleep(self._pause)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def main():
+    from data import dbmodel as dbm  # opens the default database too, so only when run as a script
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("database", help="collection to migrate")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    dbm.Engine.echo = dbm.ReaderEngine.echo = False
+    engine = dbm.createEngine(f"sqlite:///{args.database}")
+    dbm.prepareDatabase(engine)
+    runner = BackfillRunner(engine, dbm.MIGRATIONS, pause=0)
+    runner.complete()
+    for name, last, end, done in runner.progress():
+        print(f"{name:<32}{'done' if done else f'{last} of {end}'}")
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
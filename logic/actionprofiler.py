@@ -0,0 +1,196 @@
+"""
+Profiler of controller actions, switched on from the Developer menu.
+While it runs, every action decorated with profiledAction is profiled by cProfile, and a sampling thread
+records the Python stack of the thread running the action. Every run of an action is saved as
+<time>-<action>.pstats and <time>-<action>.collapsed (one "frame;frame;frame count" line per stack,
+the input format of flame graph tools), and a line in captures.jsonl.
+Only the thread running the action is profiled, work handed to the background runner is not.
+
+    python -m logic.actionprofiler [directory] --top 20 --action prepareStudySession
+"""
+import argparse
+import cProfile
+import functools
+import json
+import os
+import pstats
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Callable, List, Optional
+
+CAPTURES_PATH = "perf_captures"
+SAMPLE_INTERVAL = 0.002  # seconds between stack samples
+
+
+class _Capture:
+    """One running action: its cProfile, stack samples and the frame of the wrapper the stacks are rooted at"""
+    def __init__(self, name: str, frame):
+        self.name = name
+        self.frame = frame
+        self.profile = cProfile.Profile()
+        self.samples: Counter = Counter()
+        self.started = time.time()
+        self.start = time.perf_counter()
+
+
+class ActionProfiler:
+    """
+    Profiles controller actions while it is running. Actions may nest, a nested action pauses the cProfile
+    of the outer one and takes its stack samples, so time is attributed to the innermost action only.
+    """
+    def __init__(self):
+        self._directory: Optional[str] = None
+        self._captures: List[_Capture] = []
+        self._thread: Optional[int] = None  # ident of the thread running the actions
+        self._sampler: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.saved = 0
+
+    def isRunning(self) -> bool:
+        return self._directory is not None
+
+    def start(self, directory: str = CAPTURES_PATH) -> None:
+        if self.isRunning():
+            return
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self.saved = 0
+        self._stop.clear()
+        self._sampler = threading.Thread(target=self._sample, name="action-sampler", daemon=True)
+        self._sampler.start()
+
+    def stop(self) -> int:
+        """Stops profiling, actions running right now are still saved when they finish, returns saved captures"""
+        if not self.isRunning():
+            return self.saved
+        self._stop.set()
+        self._sampler.join()
+        self._sampler = None
+        self._directory = None
+        return self.saved
+
+    def run(self, name: str, function: Callable, *args, **kwargs):
+        """Runs the action, profiled when the profiler is running"""
+        if not self.isRunning() or (self._captures and threading.get_ident() != self._thread):
+            return function(*args, **kwargs)
+        directory = self._directory
+        capture = _Capture(name, sys._getframe())
+        with self._lock:
+            if self._captures:
+                self._captures[-1].profile.disable()
+            self._thread = threading.get_ident()
+            self._captures.append(capture)
+        capture.profile.enable()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            capture.profile.disable()
+            # saved while the capture is still on top, so the outer action isn't charged for it
+            self._save(directory, capture, time.perf_counter() - capture.start)
+            with self._lock:
+                self._captures.pop()
+                if self._captures:
+                    self._captures[-1].profile.enable()
+
+    def _sample(self) -> None:
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            with self._lock:
+                if not self._captures:
+                    continue
+                capture = self._captures[-1]
+                frame = sys._current_frames().get(self._thread)
+                stack = []
+                while frame is not None and frame is not capture.frame:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                if frame is not None:  # the stack is still inside the action
+                    stack.append(capture.name)
+                    capture.samples[";".join(reversed(stack))] += 1
+
+    def _save(self, directory: str, capture: _Capture, elapsed: float) -> None:
+        started = time.strftime('%Y%m%d-%H%M%S', time.localtime(capture.started))
+        stem = os.path.join(directory, f"{started}-{self.saved:04d}-{capture.name}")
+        capture.profile.dump_stats(f"{stem}.pstats")
+        with self._lock:
+            samples = capture.samples.most_common()
+        with open(f"{stem}.collapsed", "w") as file:
+            for stack, count in samples:
+                file.write(f"{stack} {count}\n")
+        with open(os.path.join(directory, "captures.jsonl"), "a") as file:
+            file.write(json.dumps({"action": capture.name, "started": capture.started, "elapsed": elapsed,
+                                   "samples": sum(count for _, count in samples), "file": os.path.basename(stem)}) + "\n")
+        self.saved += 1
+
+
+actionProfiler = ActionProfiler()
+
+
+def profiledAction(function: Callable) -> Callable:
+    """
+    Profiles the decorated controller method under its name while the profiler runs.
+    The wrapper takes any arguments, so it must not be connected directly to signals which pass arguments
+    the method doesn't take, like clicked(bool), connect through a lambda instead.
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        return actionProfiler.run(function.__name__, function, *args, **kwargs)
+    return wrapper
+
+
+def summarize(directory: str, top: int = 20, action: Optional[str] = None) -> None:
+    """Prints timings of the actions and the hotspots merged over all their captures"""
+    captures = []
+    if os.path.exists(os.path.join(directory, "captures.jsonl")):
+        with open(os.path.join(directory, "captures.jsonl"), "r") as file:
+            captures = [json.loads(line) for line in file if line.strip()]
+    captures = [capture for capture in captures if action is None or capture["action"] == action]
+    if not captures:
+        print(f"no captures in {directory}")
+        return
+    print(f"{'action':<32}{'runs':>6}{'median ms':>12}{'max ms':>10}")
+    for name in sorted({capture["action"] for capture in captures}):
+        elapsed = [capture["elapsed"] * 1000 for capture in captures if capture["action"] == name]
+        print(f"{name:<32}{len(elapsed):>6}{statistics.median(elapsed):>12.1f}{max(elapsed):>10.1f}")
+
+    stems = [os.path.join(directory, capture["file"]) for capture in captures]
+    # leaf frames of the samples are where the time was spent, wherever they were called from
+    selfSamples, totalSamples = Counter(), Counter()
+    for stem in stems:
+        if not os.path.exists(f"{stem}.collapsed"):
+            continue
+        with open(f"{stem}.collapsed", "r") as file:
+            for line in file:
+                stack, _, count = line.rstrip("\n").rpartition(" ")
+                frames = stack.split(";")
+                selfSamples[frames[-1]] += int(count)
+                for frame in set(frames[1:]):
+                    totalSamples[frame] += int(count)
+    samples = sum(selfSamples.values())
+    if samples:
+        print(f"\ntop sampled frames ({samples} samples, {SAMPLE_INTERVAL * 1000:.0f} ms apart)")
+        print(f"{'self %':>8}{'total %':>9}  frame")
+        for frame, count in selfSamples.most_common(top):
+            print(f"{count * 100 / samples:>8.1f}{totalSamples[frame] * 100 / samples:>9.1f}  {frame}")
+
+    profiles = [f"{stem}.pstats" for stem in stems if os.path.exists(f"{stem}.pstats")]
+    if profiles:
+        print(f"\ntop functions by own time over {len(profiles)} cProfile captures")
+        pstats.Stats(*profiles).strip_dirs().sort_stats("tottime").print_stats(top)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize hotspots of profiled controller actions")
+    parser.add_argument("directory", nargs="?", default=CAPTURES_PATH)
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--action", default=None, help="only captures of this action")
+    args = parser.parse_args()
+    summarize(args.directory, args.top, args.action)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,12 @@
+import base64
+import binascii
 import json
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 
 from data.dbmodel import Card, Deck, Note
 
 
-def convertToJson(card: Card, deck: Deck, notes: List[Note]) -> str:
+def convertToJson(card: Card, deck: Deck, notes: List[Note], media: Optional[Dict[str, bytes]] = None) -> str:
     if not deck.c_id == card.c_id:
         return ""
     fieldCount = len(json.loads(card.c_fields))
@@ -29,10 +31,11 @@ def convertToJson(card: Card, deck: Deck, notes: List[Note]) -> str:
         }
         noteList.append(noteDict)
     outputDict["notes"] = noteList
+    outputDict["media"] = {name: base64.b64encode(data).decode("ascii") for name, data in (media or {}).items()}
     return json.dumps(outputDict)
 
 
-def convertFromJson(jsonData: str) -> Optional[Tuple[Card, Deck, List[Note]]]:
+def convertFromJson(jsonData: str) -> Optional[Tuple[Card, Deck, List[Note], Dict[str, bytes]]]:
     data = json.loads(jsonData)
 
     if "card" not in data or "deck" not in data or "notes" not in data:
@@ -58,4 +61,11 @@ def convertFromJson(jsonData: str) -> Optional[Tuple[Card, Deck, List[Note]]]:
         note = Note(n_data=nData["n_data"])
         notes.append(note)
 
-    return card, deck, notes
\ No newline at end of file
+    media: Dict[str, bytes] = {}
+    for name, encoded in data.get("media", {}).items():  # files exported before media support have none
+        try:
+            media[name] = base64.b64decode(encoded, validate=True)
+        except (binascii.Error, TypeError):
+            return None
+
+    return card, deck, notes, media
\ No newline at end of file
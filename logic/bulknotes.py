@@ -0,0 +1,62 @@
+"""
+Operations on many notes at once, each of them one UPDATE or DELETE per chunk of IDs,
+chunks stay well below the limit of bound parameters of SQLite.
+Functions run in the session of the caller and return the number of notes changed.
+"""
+from typing import Dict, Iterator, List, Tuple
+
+import sqlalchemy as sql
+import sqlalchemy.orm
+
+from data.dbmodel import Note
+
+
+BULK_CHUNK = 500  # IDs bound per statement
+
+
+def _chunks(ids: List[int], size: int = BULK_CHUNK) -> Iterator[List[int]]:
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def _update(session: sqlalchemy.orm.Session, ids: List[int], values: dict) -> int:
+    changed = 0
+    for chunk in _chunks(ids):
+        changed += session.execute(sql.update(Note).where(Note.n_id.in_(chunk)).values(values)).rowcount
+    return changed
+
+
+def deleteNotes(session: sqlalchemy.orm.Session, ids: List[int]) -> int:
+    """Deletes the notes, their reviews go with them"""
+    deleted = 0
+    for chunk in _chunks(ids):
+        deleted += session.execute(sql.delete(Note).where(Note.n_id.in_(chunk))).rowcount
+    return deleted
+
+
+def moveNotes(session: sqlalchemy.orm.Session, ids: List[int], d_id: int) -> int:
+    """Moves the notes to another deck, the caller makes sure its card has the same fields"""
+    return _update(session, ids, {Note.d_id: d_id})
+
+
+def resetNotes(session: sqlalchemy.orm.Session, ids: List[int]) -> int:
+    """Forgets the schedule of the notes, they are studied as new ones"""
+    return _update(session, ids, {Note.n_last_r: 0, Note.n_next_r: 0})
+
+
+def rescheduleNotes(session: sqlalchemy.orm.Session, ids: List[int], timestamp: int) -> int:
+    """
+    Makes the notes due at the timestamp, the last review is moved back if it was later,
+    so the interval used by the next rating never goes negative
+    """
+    return _update(session, ids, {Note.n_next_r: timestamp,
+                                  Note.n_last_r: sql.func.min(Note.n_last_r, timestamp)})
+
+
+def noteSchedules(session: sqlalchemy.orm.Session, ids: List[int]) -> Dict[int, Tuple[int, int]]:
+    """Reads (n_next_r, n_last_r) of the notes after a change of their schedule, keyed by n_id"""
+    schedules = {}
+    for chunk in _chunks(ids):
+        rows = session.execute(sql.select(Note.n_id, Note.n_next_r, Note.n_last_r).where(Note.n_id.in_(chunk)))
+        schedules.update((n_id, (n_next_r, n_last_r)) for n_id, n_next_r, n_last_r in rows)
+    return schedules
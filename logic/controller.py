@@ -1,33 +1,85 @@
+import csv
 import json
+import os
+import sys
 import time
+from typing import Optional, Tuple, Dict, List
 
+import sqlalchemy.exc
 import sqlalchemy.orm
 from sqlalchemy import and_
 
 from data.consts import CARD_FRONT_TEMPLATE, CARD_BACK_TEMPLATE
-from logic import batchutils
-from logic.statutils import prepareDeckDataPie, prepareDeckDataBar, prepareNoteDataPie
+from logic import batchutils, bulknotes
+from logic.actionprofiler import CAPTURES_PATH, actionProfiler, profiledAction
+from logic.delimited import parseNotes, importNotes, exportNotes
+from logic.duecounts import DueCountTracker
+from logic.duequeue import mergeDueNotes, scanDueNotes
+from logic.fieldmapping import inferFieldMapping, isIdentityMapping, droppedFields, remapNotes
+from logic.forecast import normalizeEaseCounts, simulateWorkload
+from logic.maintenance import DatabaseMaintenance
+from logic.media import extractImageSources, extractMediaNames, internMedia
+from logic.memutils import currentRss
+from logic.metacache import MetadataCache, CardInfo
+from logic.notequery import SortIndexes, createSortIndex, fetchNotePage
+from logic.rendering import renderCard
+from logic.scheduling import recordRatings
+from logic.stallmonitor import StallMonitor
+from logic.snapshot import CollectionSnapshot
+from logic.statutils import FORECAST_DAYS, prepareDeckDataColumns, prepareNoteDataColumns, updateDeckData
+from logic.profiles import ProfileData, ProfileManager, ProfileRegistry
+from logic.studyqueue import QueuedNote
 from logic.studysession import StudySession
-from data.dbmodel import Card, Deck, Note, Review
-from views.views import CardFormView, MainWindowView, CardListView, ErrorMessage, InfoMessage, LayoutEditorView, \
-    NoteFormView, DeckListView, DeckFormView, NoteBrowserView, ExportFormView, ImportFormView, DeckStatsView, \
-    NoteStatsView
+from logic.sync import LocalCollection, SyncResult, openCollection, syncCollections
+from data.dbmodel import Card, Deck, Note
+from views.views import CardFormView, MainWindowView, CardListView, ErrorMessage, InfoMessage, ConfirmMessage, \
+    LayoutEditorView, NoteFormView, DeckListView, DeckFormView, NoteBrowserView, ExportFormView, ImportFormView, \
+    DeckStatsView, NoteStatsView, DelimitedImportView
+from views.classes.background import BackgroundRunner
+from views.classes.boundary_timer import BoundaryTimer
+from views.classes.idle_timer import IdleTimer
+from views.classes.stall_watchdog import StallWatchdog
+from views.classes.media_browser import imageCache
 from data import dbmodel as dbm
+from data.mediastore import MediaStore
+from data.migrations import BackfillRunner
+
+
+PREVIEW_SAMPLES = 5  # notes offered in the layout preview
+IMPORT_ERRORS_SHOWN = 10  # rejected rows listed after an import
+RELEARN_RATE = 1  # notes rated Hard are shown again later in the same session
 
 
 class Controller:
     """
     Controller manages the windows used by the app.
+    Every action opens its own short-lived unit of work, so no ORM objects outlive it.
     """
     def __init__(self):
         self._mainWindow = MainWindowView()
-        self._session: sqlalchemy.orm.Session = dbm.Session()
+        self._dueTimer = BoundaryTimer()  # armed for the moment the next note of any deck becomes due
+        self._profiles = ProfileManager(ProfileRegistry())
+        self._profile: ProfileData = self._profiles.open(self._profiles.registry.current())
+        self._useProfile(self._profile)
+        self._background = BackgroundRunner()
+        self._writerBackground = BackgroundRunner(maxThreads=1)  # long writes, queued behind each other
+        self._backfillBackground = BackgroundRunner(maxThreads=1)  # backfills take minutes, others don't wait for them
+        self._startBackfills()
         self._studySession: StudySession = StudySession()
+        self._deckStatsView: Optional[DeckStatsView] = None
+        self._noteStatsView: Optional[NoteStatsView] = None
+        self._liveDeckStats: Tuple[int, Dict[str, int], List[int]] = (-1, {}, [])
+        self._idleTimer = IdleTimer()
+        self._stallWatchdog = StallWatchdog(StallMonitor())
+        sys.excepthook = self._onUncaughtError
         # signals
+        self._idleTimer.signalIdle.connect(self._onIdle)
+        self._dueTimer.signalReached.connect(self._refreshDueCounts)
         self._mainWindow.signalManageCards.connect(self.openCardList)
         self._mainWindow.signalManageDecks.connect(self.openDeckList)
         self._mainWindow.signalOpenDeck.connect(self._onDeckClicked)
-        self._mainWindow.signalDetailsCancel.connect(self.openMainDeckList)
+        self._mainWindow.signalOpenAllDecks.connect(self.openMainMergedDetails)
+        self._mainWindow.signalDetailsCancel.connect(lambda: self.openMainDeckList())
         self._mainWindow.signalDetailsStats.connect(self._onDetailsStats)
         self._mainWindow.signalDetailsQuickAdd.connect(self._onDetailsQuickAdd)
         self._mainWindow.signalDetailsStudy.connect(lambda: self.openMainFlashcard(displayFront=True))
@@ -39,17 +91,141 @@ class Controller:
         self._mainWindow.signalFlashcardHard.connect(lambda: self._onFlashcardRate(rate=1))
         self._mainWindow.signalBatchImport.connect(self._onBatchImport)
         self._mainWindow.signalBatchExport.connect(self._onBatchExport)
+        self._mainWindow.signalSync.connect(self._onSync)
+        self._mainWindow.signalSwitchProfile.connect(self.switchProfile)
+        self._mainWindow.signalAddProfile.connect(self._onAddProfile)
+        self._mainWindow.signalToggleProfiling.connect(self._onToggleProfiling)
+        self._mainWindow.signalStallReport.connect(self._onStallReport)
         # init
+        self._mainWindow.updateProfiles(self._profiles.registry.names(), self._profiles.registry.current())
         self.openMainDeckList()
 
+    def _useProfile(self, profile: ProfileData):
+        """Points the data layer of the controller to the profile"""
+        self._profile = profile
+        self._engine = profile.engine
+        self._sessionFactory: sqlalchemy.orm.sessionmaker = profile.session
+        self._readSessionFactory: sqlalchemy.orm.sessionmaker = profile.readSession
+        self._metadata: MetadataCache = profile.metadata
+        self._dueCounts: DueCountTracker = profile.dueCounts
+        self._snapshot: CollectionSnapshot = profile.snapshot
+        self._sortIndexes = SortIndexes()  # sort counts are kept per database, so are the indexes
+        self._maintenance: DatabaseMaintenance = profile.maintenance
+        self._backfills: BackfillRunner = profile.backfills
+        self._mediaStore: MediaStore = profile.mediaStore
+        imageCache.setResolver(self._mediaStore.path)
+
+    def _unitOfWork(self):
+        """Opens a unit of work for a single action, it has to be closed before any dialog is shown"""
+        return dbm.sessionScope(self._sessionFactory)
+
+    def _readUnitOfWork(self):
+        """Opens a read-only unit of work on a reader connection, it sees one snapshot of the database"""
+        return dbm.sessionScope(self._readSessionFactory)
+
+    def _startBackfills(self):
+        """Continues data migrations of the profile on a worker thread, the app stays usable meanwhile"""
+        if self._backfills.isPending():
+            self._backfillBackground.run(self._backfills.complete, lambda _: None, self._onBackgroundError)
+
+    def _onIdle(self):
+        """Runs a slice of database maintenance, its long steps go to a worker thread"""
+        maintenance = self._maintenance  # the step reports back to this profile even after a switch
+        maintenance.runSlice()
+        step = maintenance.takeBackgroundStep()
+        if step is not None:
+            def onFailed(exception: Exception):
+                maintenance.backgroundStepDone()
+                self._onBackgroundError(exception)
+            self._writerBackground.run(step, maintenance.backgroundStepDone, onFailed)
+
+    def _onBackgroundError(self, exception: Exception):
+        error = ErrorMessage(f"Operation failed: {exception}")
+        error.exec()
+
+    def _onUncaughtError(self, excType, exception, traceback):
+        """
+        Exceptions escaping slots end here. A write waits for the writer connection while sync or a backfill
+        holds it between their chunks, one which still timed out is reported instead of dumped to the console.
+        """
+        if issubclass(excType, sqlalchemy.exc.TimeoutError):
+            error = ErrorMessage("The collection is busy, try again in a moment")
+            error.exec()
+            return
+        sys.__excepthook__(excType, exception, traceback)
+
+    def getMemoryStats(self) -> dict:
+        """Returns memory usage of the process and identity map statistics of the units of work"""
+        return {
+            "rss": currentRss(),
+            "unitsOfWork": dbm.sessionStats.opened,
+            "openUnitsOfWork": dbm.sessionStats.active,
+            "lastIdentityMap": dbm.sessionStats.lastIdentityMap,
+            "maxIdentityMap": dbm.sessionStats.maxIdentityMap,
+        }
+
+    # PROFILES
+
+    @profiledAction
+    def switchProfile(self, name: str):
+        """Swaps the data layer for the one of another profile, recently used profiles are still open"""
+        if name == self._profiles.registry.current():
+            return
+        self._studySession.reset()
+        self._liveDeckStats = (-1, {}, [])
+        if self._deckStatsView is not None:
+            self._deckStatsView.close()
+        previous = self._profile
+        previous.backfills.stop()  # continued when the profile is used again
+        self._useProfile(self._profiles.open(name))
+        previous.release()
+        self._startBackfills()
+        self._profiles.registry.setCurrent(name)
+        self._mainWindow.updateProfiles(self._profiles.registry.names(), name)
+        self.openMainDeckList()
+
+    def _onAddProfile(self):
+        """Triggered when user wants to create a new profile"""
+        name = self._mainWindow.askProfileName()
+        if not name:
+            return
+        try:
+            self._profiles.registry.add(name)
+        except ValueError as exception:
+            error = ErrorMessage(str(exception))
+            error.exec()
+            return
+        self.switchProfile(name.strip())
+
     # MAIN WINDOW
 
+    @profiledAction
     def openMainDeckList(self):
         """Updates deck list and opens it"""
         self._studySession.reset()
         self._mainWindow.setPage(0)
-        self._mainWindow.updateDecksList([(deck.d_id, deck.d_name) for deck in self._session.query(Deck).all()])
+        self._dueCounts.advance()
+        self._mainWindow.updateDecksList(self._deckNames(), self._dueCounts.counts())
+        self._armDueTimer()
+
+    def _deckNames(self) -> List[Tuple[int, str]]:
+        return [(deck.d_id, deck.d_name) for deck in self._metadata.decks()]
+
+    def _refreshDueCounts(self):
+        """Triggered when a note becomes due, only the decks whose boundary passed are queried"""
+        if self._dueCounts.advance():
+            self._mainWindow.updateDueCounts(self._dueCounts.counts())
+        self._armDueTimer()
+
+    def _armDueTimer(self):
+        self._dueTimer.armAt(self._dueCounts.nextBoundary())
 
+    def _onDueCountsChanged(self):
+        """Called after the controller changed schedules itself, the tracker was already updated"""
+        self._mainWindow.updateDueCounts(self._dueCounts.counts())
+        self._armDueTimer()
+
+    @profiledAction
     def openMainDetails(self, d_id: int):
         """Updates detail page and opens it"""
         self.prepareStudySession(d_id)
@@ -57,44 +233,110 @@ class Controller:
             self.openMainDeckList()
         else:
             deck = self._studySession.getDeck()
-            notesTotalCount = self._session.query(Note).filter_by(d_id=deck.d_id).count()  # type: ignore
+            with self._unitOfWork() as session:
+                notesTotalCount = session.query(Note.n_id).filter(Note.d_id == deck.d_id).count()  # type: ignore
             self._mainWindow.updateDeckDetails(deck.d_name, notesTotalCount, self._studySession.getLen())  # type: ignore
             self._mainWindow.setPage(1)
 
+    def openMainMergedDetails(self):
+        """Updates detail page for the session over all decks and opens it"""
+        self.prepareMergedStudySession()
+        if not self._studySession.isActive():
+            self.openMainDeckList()
+            return
+        with self._unitOfWork() as session:
+            notesTotalCount = session.query(Note.n_id).count()
+        self._mainWindow.updateDeckDetails("All decks", notesTotalCount, self._studySession.getLen(), singleDeck=False)
+        self._mainWindow.setPage(1)
+
+    def _reopenDetails(self):
+        """Returns to the detail page of the current study session"""
+        if self._studySession.isMerged():
+            self.openMainMergedDetails()
+        else:
+            self.openMainDetails(self._studySession.getDeck().d_id)  # type: ignore
+
+    @profiledAction
     def openMainFlashcard(self, displayFront: bool):
         """Opens flashcard page and updates it"""
-        if not self._studySession.isFinished():
-            deck = self._studySession.getDeck()
-            card = self._studySession.getCard()
+        values = None
+        while not self._studySession.isFinished():
             note = self._studySession.peekNextNote()
-            fields, values = json.loads(card.c_fields), json.loads(note.n_data)  # type: ignore
+            values = self._noteValues(note)
+            if values is not None:
+                break
+            # deleted since the session started, a loop because bulk deletes and sync can remove many queued notes
+            self._studySession.popNextNote()
+            displayFront = True
+        if values is not None:
+            deck = self._studySession.getNoteDeck(note)
+            card = self._studySession.getNoteCard(note)
+            fields = card.fields
             # noinspection PyTypeChecker
             self._mainWindow.updateFlashcard(deck.d_name, card.c_layout_f, card.c_layout_b, list(zip(fields, values)), displayFront)  # type: ignore
             self._mainWindow.setPage(2)
+            self._prefetchMedia(displayFront)
         elif self._studySession.isActive():
-            self.openMainDetails(self._studySession.getDeck().d_id)  # type: ignore
+            self._reopenDetails()
         else:
             self.openMainDeckList()
 
+    def _prefetchMedia(self, displayFront: bool):
+        """Prefetches images of the back of the current card, or of the next card when it's already shown"""
+        note = self._studySession.peekNextNote() if displayFront else self._studySession.peekFollowingNote()
+        if note is None:
+            return
+        values = self._noteValues(note)
+        if values is None:
+            return
+        card = self._studySession.getNoteCard(note)
+        fields = list(zip(card.fields, values))
+        sources = extractImageSources(renderCard(card.c_layout_f, card.c_layout_b, fields, not displayFront))
+        self._mainWindow.prefetchImages(sources)
+
+    def _noteValues(self, note: QueuedNote) -> Optional[List[str]]:
+        """Returns field values of a queued note, fetching its content when it isn't cached yet"""
+        n_data = self._studySession.getContent(note.n_id)
+        if n_data is None:
+            with self._readUnitOfWork() as session:
+                n_data = session.query(Note.n_data).filter(Note.n_id == note.n_id).scalar()
+            if n_data is None:
+                return None
+            self._studySession.setContent(note.n_id, n_data)
+        return json.loads(n_data)
+
+    @profiledAction
     def prepareStudySession(self, d_id: int):
         """Prepares study session by loading deck data"""
-        deck = self._session.query(Deck).filter_by(d_id=d_id).first()
-        if not deck:
+        deck, card = self._metadata.deck(d_id), self._metadata.deckCard(d_id)
+        if not deck or not card:
             self._studySession.reset()
             return
-        card = self._session.query(Card).filter_by(c_id=deck.c_id).first()
-        if not card:
+        self._dueCounts.advance()
+        notes = scanDueNotes(self._readSessionFactory, d_id, int(time.time()))
+        self._studySession.fill(card, deck, notes, self._dueCounts.count(d_id))
+
+    @profiledAction
+    def prepareMergedStudySession(self, deckIds: Optional[List[int]] = None):
+        """
+        Prepares study session over several decks, all of them when deckIds isn't given.
+        The due count comes from the tracker, notes are merged lazily from per-deck scans.
+        """
+        decks = {deck.d_id: deck for deck in self._metadata.decks()
+                 if (deckIds is None or deck.d_id in deckIds) and self._metadata.card(deck.c_id)}
+        cards = {deck.c_id: self._metadata.card(deck.c_id) for deck in decks.values()}
+        if not decks:
             self._studySession.reset()
             return
-        timeNow = int(time.time())
-        notes = self._session.query(Note).filter(and_(Note.d_id == deck.d_id, Note.n_next_r <= timeNow)).all()
-        self._studySession.fill(card, deck, notes)
+        self._dueCounts.advance()
+        dueCount = sum(self._dueCounts.count(d_id) for d_id in decks)
+        notes = mergeDueNotes(self._readSessionFactory, list(decks), int(time.time()))
+        self._studySession.fillMerged(cards, decks, notes, dueCount)
 
     def _onDeckClicked(self, d_id: int):
         """Triggered when user select deck from the main window"""
-        deck = self._session.query(Deck).filter_by(d_id=d_id).first()
-        if deck:
-            self.openMainDetails(deck.d_id)
+        if self._metadata.deck(d_id):
+            self.openMainDetails(d_id)
 
     def _onDetailsStats(self):
         """Triggered when user opens stats on the main window"""
@@ -106,32 +348,33 @@ class Controller:
 
     def _onDetailsQuickAdd(self):
         """Triggered when user presses Quick Add button"""
-        if self._studySession.isActive():
+        if self._studySession.getDeck() is not None:
             self.addNote(self._studySession.getDeck().d_id)
 
     def _onFlashcardClose(self):
         """Triggered when user closes flashcard"""
         if self._studySession.isActive():
-            self.openMainDetails(self._studySession.getDeck().d_id)
+            self._reopenDetails()
 
     def _onFlashcardShow(self):
         """Triggered when user presses the Show button for flashcard"""
         self.openMainFlashcard(displayFront=False)
 
+    @profiledAction
     def _onFlashcardRate(self, rate: int):
         """Triggered when user rates a flashcard"""
         note = self._studySession.popNextNote()
-        review = Review(r_ease=rate, n_id=note.n_id)
-        self._session.add(review)
-        last_r, next_r = note.n_last_r, note.n_next_r
-        currentT = int(time.time())
-        if last_r == 0 or next_r == 0:  # this is the first review
-            note.n_last_r = max(currentT, 0)
-            note.n_next_r = max((currentT + int(60*60 * (rate/3))), 0)
-        else:
-            note.n_last_r = currentT
-            note.n_next_r = currentT + int((next_r-last_r) * (rate/3))
-        self._session.commit()
+        with self._unitOfWork() as session:
+            rated = recordRatings(session, [(note.n_id, rate, int(time.time()))])[0]
+        if rated is None:  # deleted since the session started
+            self.openMainFlashcard(displayFront=True)
+            return
+        n_last_r, n_next_r = rated.new
+        self._updateLiveDeckStats(rated.d_id, rated.old, rated.new)
+        self._dueCounts.noteChanged(rated.d_id, rated.old[1], n_next_r)
+        self._onDueCountsChanged()
+        if rate == RELEARN_RATE:
+            self._studySession.relearnNote(note, n_last_r, n_next_r)
         self.openMainFlashcard(displayFront=True)
 
     def _onFlashcardStats(self):
@@ -150,6 +393,7 @@ class Controller:
         importForm.signalImport.connect(lambda: self.batchImport(importForm))
         importForm.exec()
 
+    @profiledAction
     def batchImport(self, importForm: ImportFormView):
         """Handle import"""
         path = importForm.getData()
@@ -165,58 +409,121 @@ class Controller:
                 error = ErrorMessage("Malformed file")
                 error.exec()
                 return
-            if not result:
+            if not result or not all(self._mediaStore.verify(name, data) for name, data in result[3].items()):
                 error = ErrorMessage("Malformed file")
                 error.exec()
             else:
-                card, deck, notes = result
-                card.c_name = f"{card.c_name}_{int(time.time())}"
-                self._session.add(card)
-                self._session.commit()
-                deck.d_name = f"{deck.d_name}_{int(time.time())}"
-                deck.c_id = card.c_id
-                self._session.add(deck)
-                self._session.commit()
-                for note in notes:
-                    note.d_id = deck.d_id
-                    self._session.add(note)
-                self._session.commit()
-                self._mainWindow.updateDecksList([(deck.d_id, deck.d_name) for deck in self._session.query(Deck).all()])
+                card, deck, notes, media = result
+                for name, data in media.items():
+                    self._mediaStore.addBytes(data, os.path.splitext(name)[1])
+                with self._unitOfWork() as session:
+                    card.c_name = f"{card.c_name}_{int(time.time())}"
+                    session.add(card)
+                    session.flush()
+                    deck.d_name = f"{deck.d_name}_{int(time.time())}"
+                    deck.c_id = card.c_id
+                    session.add(deck)
+                    session.flush()
+                    for note in notes:
+                        note.d_id = deck.d_id
+                    session.add_all(notes)
+                self._metadata.invalidate()
+                self._dueCounts.reload()
+                self._mainWindow.updateDecksList(self._deckNames(), self._dueCounts.counts())
+                self._maintenance.requestPass()
 
     def _onBatchExport(self):
         """Triggered when user wants to export"""
-        decks = self._session.query(Deck.d_name).all()
-        exportForm = ExportFormView(list(map(lambda t: t[0], decks)))
+        exportForm = ExportFormView([deck.d_name for deck in self._metadata.decks()])
         exportForm.signalExport.connect(lambda: self.batchExport(exportForm))
         exportForm.exec()
 
+    @profiledAction
     def batchExport(self, exportForm: ExportFormView):
         """Handle export"""
         deckName, filePath = exportForm.getData()
         if not deckName or not filePath:
             return
-        deck = self._session.query(Deck).filter_by(d_name=deckName).first()
-        if not deck:
+        deck = self._metadata.deckByName(deckName)
+        card = self._metadata.deckCard(deck.d_id) if deck else None
+        if not deck or not card:
             return
-        card = self._session.query(Card).filter_by(c_id=deck.c_id).first()
-        if not card:
-            return
-        notes = self._session.query(Note).filter_by(d_id=deck.d_id).all()
-        jsonOut = batchutils.convertToJson(card, deck, notes)
-        if not jsonOut:
+
+        def export() -> bool:
+            with self._readUnitOfWork() as session:
+                notes = session.query(Note.n_data, Note.d_id).filter(Note.d_id == deck.d_id).all()
+            mediaNames = extractMediaNames([card.c_layout_f, card.c_layout_b] + [note.n_data for note in notes])
+            media = {name: self._mediaStore.read(name) for name in mediaNames if self._mediaStore.path(name)}
+            jsonOut = batchutils.convertToJson(card, deck, notes, media)
+            if jsonOut:
+                with open(filePath, "w") as file:
+                    file.write(jsonOut)
+            return bool(jsonOut)
+        self._background.run(export, self._onBatchExportDone, self._onBackgroundError)
+
+    def _onBatchExportDone(self, exported: bool):
+        if not exported:
             error = ErrorMessage("Data appears to be corrupted")
             error.exec()
         else:
-            with open(filePath, "w") as file:
-                file.write(jsonOut)
             info = InfoMessage("Exported deck to file successfully")
             info.exec()
 
+    # SYNC
+
+    def _onSync(self):
+        """Triggered when user wants to sync the collection with another one"""
+        target = self._mainWindow.askSyncTarget()
+        if not target:
+            return
+        if not target.startswith(("http://", "https://")) and not os.path.isfile(target):
+            error = ErrorMessage("Collection not found")
+            error.exec()
+            return
+        backfills, engine = self._backfills, self._engine
+
+        def sync() -> SyncResult:
+            backfills.complete()  # rows are matched by guid, all of them need one
+            remote = openCollection(target)
+            try:
+                return syncCollections(LocalCollection(engine), remote)
+            finally:
+                remote.close()
+        # the writer is held only while changes are collected and applied, not during the transfer
+        self._background.run(sync, self._onSyncDone, self._onBackgroundError)
+
+    def _onSyncDone(self, result: SyncResult):
+        self._metadata.invalidate()
+        self._dueCounts.reload()
+        self.openMainDeckList()
+        info = InfoMessage(f"Sent {result.sent} changes, received {result.received}")
+        info.exec()
+
+    # DEVELOPER
+
+    def _onToggleProfiling(self, enabled: bool):
+        """Triggered when user starts or stops profiling of the actions"""
+        if enabled:
+            actionProfiler.start()
+            return
+        saved = actionProfiler.stop()
+        info = InfoMessage(f"Saved {saved} profiled actions to {os.path.abspath(CAPTURES_PATH)}")
+        info.exec()
+
+    def _onStallReport(self):
+        """Triggered when user wants to see which actions blocked the window"""
+        monitor = self._stallWatchdog.monitor
+        stalls = monitor.stalls()
+        total = sum(stall.duration for stall in stalls)
+        info = InfoMessage(f"{len(stalls)} stalls longer than {monitor.threshold * 1000:.0f} ms, "
+                           f"{total:.1f} s in total", monitor.report())
+        info.exec()
+
     # TOOLBAR MANAGE CARDS
 
     def openCardList(self):
         """Open card list dialog"""
-        cards: list[Card] = self._session.query(Card)
+        cards = self._metadata.cards()
         cardList = CardListView([card.c_name for card in cards], [card.c_id for card in cards])
         cardList.signalAdd.connect(lambda: self.addCard(cardList))
         cardList.signalDelete.connect(lambda: self.deleteCard(cardList))
@@ -237,20 +544,24 @@ class Controller:
         if name == "" or "" in fields:
             error = ErrorMessage("Fields cannot be empty")
             error.exec()
+            return
         elif len(fields) != len(set(fields)):
             error = ErrorMessage("Field names must be unique")
             error.exec()
-        elif self._session.query(Card).filter_by(c_name=name).first():
+            return
+        with self._unitOfWork() as session:
+            nameTaken = session.query(Card.c_id).filter(Card.c_name == name).first() is not None
+            if not nameTaken:
+                newCard = Card(c_name=name, c_fields=json.dumps(fields), c_layout_f=CARD_FRONT_TEMPLATE, c_layout_b=CARD_BACK_TEMPLATE)
+                print(newCard.c_id)
+                session.add(newCard)
+        if nameTaken:
             error = ErrorMessage("Card name must be unique")
             error.exec()
         else:
-            newCard = Card(c_name=name, c_fields=json.dumps(fields), c_layout_f=CARD_FRONT_TEMPLATE, c_layout_b=CARD_BACK_TEMPLATE)
-            print(newCard.c_id)
-            self._session.add(newCard)
-            self._session.commit()
+            self._metadata.invalidate()
             info = InfoMessage("Added new card")
-            newCards = self._session.query(Card.c_id, Card.c_name).all()
-            cardList.refresh(list(map(lambda t: t[1], newCards)), list(map(lambda t: t[0], newCards)))
+            self._refreshCardList(cardList)
             info.exec()
 
     def deleteCard(self, cardList: CardListView):
@@ -259,15 +570,16 @@ class Controller:
             pass
         else:
             target = cardList.ids[cardList.selectedIdx]
-            if self._session.query(Deck).filter_by(c_id=target).first():
+            with self._unitOfWork() as session:
+                cardUsed = session.query(Deck.d_id).filter(Deck.c_id == target).first() is not None
+                if not cardUsed:
+                    session.query(Card).filter(Card.c_id == target).delete(synchronize_session=False)
+            if cardUsed:
                 error = ErrorMessage("Cannot delete a card that is currently used")
                 error.exec()
             else:
-                card = self._session.query(Card).filter_by(c_id=target).one()
-                self._session.delete(card)
-                self._session.commit()
-                newCards = self._session.query(Card.c_id, Card.c_name).all()
-                cardList.refresh(list(map(lambda t: t[1], newCards)), list(map(lambda t: t[0], newCards)))
+                self._metadata.invalidate()
+                self._refreshCardList(cardList)
                 info = InfoMessage("Deleted a card")
                 info.exec()
 
@@ -276,35 +588,64 @@ class Controller:
         if not cardList.selectedIdx > -1:
             pass
         else:
-            target = cardList.ids[cardList.selectedIdx]
-            canEditFields = True if self._session.query(Deck).filter_by(c_id=target).count() == 0 else False
-            card = self._session.query(Card).filter_by(c_id=target).one()
-            editForm = CardFormView(card.c_name, json.loads(card.c_fields), canEditFields)
+            card = self._metadata.card(cardList.ids[cardList.selectedIdx])
+            # notes of decks using the card are remapped to the new fields on save
+            editForm = CardFormView(card.c_name, card.fields, True)
             editForm.signalCancel.connect(editForm.close)
             editForm.signalSave.connect(lambda: self.editCardSave(card.c_id, cardList, editForm))
             editForm.exec()
 
+    @profiledAction
     def editCardSave(self, cid: int, cardList, cardForm):
         """Edit card from card, save card list"""
         name, fields = cardForm.getFields()
         if name == "" or "" in fields:
             error = ErrorMessage("Fields cannot be empty")
             error.exec()
+            return
         elif len(fields) != len(set(fields)):
             error = ErrorMessage("Field names must be unique")
             error.exec()
-        elif self._session.query(Card).filter(and_(Card.c_name == name, Card.c_id != cid)).first():
+            return
+        with self._unitOfWork() as session:
+            nameTaken = session.query(Card.c_id).filter(and_(Card.c_name == name, Card.c_id != cid)).first() is not None
+            oldFields = json.loads(session.query(Card.c_fields).filter(Card.c_id == cid).one().c_fields)
+            deckIds = [deck.d_id for deck in session.query(Deck.d_id).filter(Deck.c_id == cid).all()]
+        if nameTaken:
             error = ErrorMessage("Card name must be unique")
             error.exec()
-        else:
-            card = self._session.query(Card).filter_by(c_id=cid).one()
-            card.c_name = name
-            card.c_fields = json.dumps(fields)
-            self._session.commit()
-            info = InfoMessage("Edited a card")
-            newCards = self._session.query(Card.c_id, Card.c_name).all()
-            cardList.refresh(list(map(lambda t: t[1], newCards)), list(map(lambda t: t[0], newCards)))
-            info.exec()
+            return
+        mapping = inferFieldMapping(oldFields, fields)
+        if deckIds and not self._confirmFieldMapping(oldFields, mapping):
+            return
+        with self._unitOfWork() as session:
+            session.query(Card).filter(Card.c_id == cid) \
+                .update({Card.c_name: name, Card.c_fields: json.dumps(fields)}, synchronize_session=False)
+            if not isIdentityMapping(mapping, len(oldFields)):
+                remapNotes(session, deckIds, mapping)
+        self._metadata.invalidate()
+        self._reloadSessionTemplates()
+        info = InfoMessage("Edited a card")
+        self._refreshCardList(cardList)
+        info.exec()
+
+    def _reloadSessionTemplates(self):
+        """Gives the study session the edited cards and decks, notes it cached may have been remapped to new fields"""
+        decks = {deck.d_id: deck for deck in map(self._metadata.deck, self._studySession.getDeckIds()) if deck}
+        cards = {deck.c_id: self._metadata.card(deck.c_id) for deck in decks.values()}
+        self._studySession.updateTemplates(cards, decks)
+
+    def _refreshCardList(self, cardList: CardListView):
+        cards = self._metadata.cards()
+        cardList.refresh([card.c_name for card in cards], [card.c_id for card in cards])
+
+    def _confirmFieldMapping(self, oldFields, mapping) -> bool:
+        """Asks user before field values are dropped from notes"""
+        dropped = droppedFields(oldFields, mapping)
+        if not dropped:
+            return True
+        confirm = ConfirmMessage(f"Values of fields {', '.join(dropped)} will be removed from all affected notes.")
+        return confirm.exec()
 
     def editLayout(self, cardList: CardListView):
         """Edit layout of a card from card list"""
@@ -312,20 +653,26 @@ class Controller:
             pass
         else:
             target = cardList.ids[cardList.selectedIdx]
-            card = self._session.query(Card).filter_by(c_id=target).one()
+            card = self._metadata.card(target)
+            with self._unitOfWork() as session:
+                samples = session.query(Note.n_data).join(Deck, Deck.d_id == Note.d_id) \
+                    .filter(Deck.c_id == target).limit(PREVIEW_SAMPLES).all()
             layoutFront = card.c_layout_f if card.c_layout_f else ""
             layoutBack = card.c_layout_b if card.c_layout_b else ""
             editForm = LayoutEditorView()
             editForm.setContents(layoutFront, layoutBack)
+            editForm.setSamples(card.fields, [json.loads(sample.n_data) for sample in samples])
             editForm.cancelSignal.connect(editForm.close)
             editForm.saveSignal.connect(lambda: self.editLayoutSave(editForm, target))
             editForm.exec()
 
     def editLayoutSave(self, layoutEditor: LayoutEditorView, cid: int):
         """Edit layout of a card from card list, save layout"""
-        card = self._session.query(Card).filter_by(c_id=cid).one()
-        card.c_layout_f, card.c_layout_b = layoutEditor.getContents()
-        self._session.commit()
+        layoutFront, layoutBack = map(lambda layout: internMedia(layout, self._mediaStore), layoutEditor.getContents())
+        with self._unitOfWork() as session:
+            session.query(Card).filter(Card.c_id == cid) \
+                .update({Card.c_layout_f: layoutFront, Card.c_layout_b: layoutBack}, synchronize_session=False)
+        self._metadata.invalidate()
         info = InfoMessage("Saved layout")
         info.exec()
 
@@ -333,7 +680,7 @@ class Controller:
 
     def openDeckList(self):
         """Open deck list dialog"""
-        decks: list[Deck] = self._session.query(Deck)
+        decks = self._metadata.decks()
         deckList = DeckListView([deck.d_name for deck in decks], [deck.d_id for deck in decks])
         deckList.signalAdd.connect(lambda: self.addDeck(deckList))
         deckList.signalDelete.connect(lambda: self.deleteDeck(deckList))
@@ -343,7 +690,7 @@ class Controller:
 
     def addDeck(self, deckList: DeckListView):
         """Add deck new deck dialog"""
-        cards = [card.c_name for card in self._session.query(Card).all()]
+        cards = [card.c_name for card in self._metadata.cards()]
         if len(cards) == 0:
             error = ErrorMessage("Please add card templates first")
             error.exec()
@@ -356,24 +703,25 @@ class Controller:
     def addDeckSave(self, deckList: DeckListView, deckForm: DeckFormView):
         """Add new deck, refresh deck list"""
         deckName, cardName = deckForm.getData()
-        card = self._session.query(Card).filter_by(c_name=cardName).first()
         if deckName == "" or cardName == "":
             error = ErrorMessage("Fields cannot be empty")
             error.exec()
-        elif self._session.query(Deck).filter_by(d_name=deckName).first():
+            return
+        with self._unitOfWork() as session:
+            card = session.query(Card.c_id).filter(Card.c_name == cardName).first()
+            nameTaken = session.query(Deck.d_id).filter(Deck.d_name == deckName).first() is not None
+            if card and not nameTaken:
+                session.add(Deck(d_name=deckName, c_id=card.c_id))
+        if nameTaken:
             error = ErrorMessage("Deck name must be unique")
             error.exec()
         elif not card:
             error = ErrorMessage(f"Couldn't find card {cardName}")
             error.exec()
         else:
-            newDeck = Deck(d_name=deckName, c_id=card.c_id)
-            self._session.add(newDeck)
-            self._session.commit()
+            self._metadata.invalidate()
             info = InfoMessage("Added new deck")
-            newDecks = self._session.query(Deck.d_id, Deck.d_name).all()
-            deckList.refresh(list(map(lambda t: t[1], newDecks)), list(map(lambda t: t[0], newDecks)))
-            self._mainWindow.updateDecksList([(deck.d_id, deck.d_name) for deck in self._session.query(Deck).all()])
+            self._refreshDeckLists(deckList)
             info.exec()
 
     def editDeck(self, deckList: DeckListView):
@@ -381,109 +729,162 @@ class Controller:
         selected = deckList.getSelectedId()
         if selected == -1:
             return
-        deck = self._session.query(Deck).filter_by(d_id=selected).one()
-        cards = list(map(lambda t: t[0], self._session.query(Card.c_name).all()))
+        deck = self._metadata.deck(selected)
+        cards = [card.c_name for card in self._metadata.cards()]
         editForm = DeckFormView(deck.d_name, cards)
         editForm.signalCancel.connect(editForm.close)
         editForm.signalSave.connect(lambda: self.editDeckSave(deck.d_id, deckList, editForm))
         editForm.exec()
 
+    @profiledAction
     def editDeckSave(self, d_id: int, deckList: DeckListView, editForm: DeckFormView):
         """Edit deck from deck list, refresh decks in deck list"""
         deckName, cardName = editForm.getData()
-        nameCheck = self._session.query(Deck).filter(and_(Deck.d_name==deckName, Deck.d_id!=d_id)).first()
         if deckName == "" or cardName == "":
             error = ErrorMessage(f"Fields cannot be empty.")
             error.exec()
-        elif nameCheck:
+            return
+        with self._unitOfWork() as session:
+            nameCheck = session.query(Deck.d_id).filter(and_(Deck.d_name == deckName, Deck.d_id != d_id)).first()
+            deck = session.query(*dbm.DECK_COLUMNS).filter(Deck.d_id == d_id).one()
+            newCard = session.query(Card.c_id, Card.c_fields).filter(Card.c_name == cardName).one()
+            oldCard = session.query(Card.c_fields).filter(Card.c_id == deck.c_id).one()
+        if nameCheck:
             error = ErrorMessage(f"Deck with this name already exists.")
             error.exec()
-        else:
-            deck = self._session.query(Deck).filter_by(d_id=d_id).one()
-            newCard = self._session.query(Card.c_id, Card.c_fields).filter_by(c_name=cardName).one()
-            if deck.c_id != newCard.c_id:  # edited card
-                oldCard = self._session.query(Card.c_fields).filter_by(c_id=deck.c_id).one()
-                oldCardFieldsLen = len(json.loads(oldCard[0]))
-                newCardFieldsLen = len(json.loads(newCard[1]))
-                if oldCardFieldsLen != newCardFieldsLen:
-                    error = ErrorMessage(f"This card is incompatible, {newCardFieldsLen} fields instead of {oldCardFieldsLen}")
-                    error.exec()
-                    return
-                else:
-                    deck.c_id = newCard[0]
-            deck.d_name = deckName
-            self._session.commit()
-            info = InfoMessage("Saved new deck settings.")
-            newDecks = self._session.query(Deck.d_id, Deck.d_name).all()
-            deckList.refresh(list(map(lambda t: t[1], newDecks)), list(map(lambda t: t[0], newDecks)))
-            self._mainWindow.updateDecksList([(deck.d_id, deck.d_name) for deck in self._session.query(Deck).all()])
-            info.exec()
+            return
+        oldFields = json.loads(oldCard.c_fields)
+        mapping = list(range(len(oldFields)))
+        if deck.c_id != newCard.c_id:  # edited card, notes are remapped to the fields of the new card
+            mapping = inferFieldMapping(oldFields, json.loads(newCard.c_fields))
+            if not self._confirmFieldMapping(oldFields, mapping):
+                return
+        with self._unitOfWork() as session:
+            if not isIdentityMapping(mapping, len(oldFields)):
+                remapNotes(session, [d_id], mapping)
+            session.query(Deck).filter(Deck.d_id == d_id) \
+                .update({Deck.d_name: deckName, Deck.c_id: newCard.c_id}, synchronize_session=False)
+        self._metadata.invalidate()
+        self._reloadSessionTemplates()
+        info = InfoMessage("Saved new deck settings.")
+        self._refreshDeckLists(deckList)
+        info.exec()
 
+    def _refreshDeckLists(self, deckList: DeckListView):
+        """Refreshes the deck list dialog and the decks on the main window"""
+        decks = self._deckNames()
+        deckList.refresh([d_name for _, d_name in decks], [d_id for d_id, _ in decks])
+        self._mainWindow.updateDecksList(decks, self._dueCounts.counts())
+
+    @profiledAction
     def deleteDeck(self, deckList: DeckListView):
         """Delete deck from deck list, refresh deck list"""
         selected = deckList.getSelectedId()
         if selected == -1:
             return
-        deck = self._session.query(Deck).filter_by(d_id=selected).one()
-        self._session.query(Note).filter_by(d_id=deck.d_id).delete()
-        self._session.delete(deck)
-        self._session.commit()
+        with self._unitOfWork() as session:
+            # notes and their reviews are removed by the database through ON DELETE CASCADE
+            session.query(Deck).filter(Deck.d_id == selected).delete(synchronize_session=False)
+        self._metadata.invalidate()
+        self._dueCounts.forgetDeck(selected)
+        self._maintenance.requestPass()
         info = InfoMessage("Deleted a deck")
-        newDecks = self._session.query(Deck.d_id, Deck.d_name).all()
-        deckList.refresh(list(map(lambda t: t[1], newDecks)), list(map(lambda t: t[0], newDecks)))
-        self._mainWindow.updateDecksList([(deck.d_id, deck.d_name) for deck in self._session.query(Deck).all()])
+        self._refreshDeckLists(deckList)
         self._mainWindow.setPage(0)
         info.exec()
 
+    def _loadNotes(self, card: CardInfo, deck: Deck, noteBrowser: NoteBrowserView):
+        """Loads the first page of notes matching the sort and filter of the note browser"""
+        try:
+            with self._readUnitOfWork() as session:
+                page = fetchNotePage(session, noteBrowser.getQuery(deck.d_id), len(card.fields))
+        except ValueError as exception:
+            error = ErrorMessage(str(exception))
+            error.exec()
+            return
+        noteBrowser.refresh(page)
+
+    @profiledAction
     def viewNotes(self, deckList: DeckListView):
         """View notes of a deck from deck list"""
         selected = deckList.getSelectedId()
         if selected == -1:
             return
-        deck = self._session.query(Deck).filter_by(d_id=selected).one()
-        card = self._session.query(Card).filter_by(c_id=deck.c_id).one()
-        notes = self._session.query(Note.n_id, Note.n_data).filter_by(d_id=selected).all()
-        notesData = list(map(lambda t: (t[0], json.loads(t[1])), notes))
-        noteBrowser = NoteBrowserView(deck.d_name, json.loads(card.c_fields), notesData)
+        deck, card = self._metadata.deck(selected), self._metadata.deckCard(selected)
+        noteBrowser = NoteBrowserView(deck.d_name, card.fields)
+        self._loadNotes(card, deck, noteBrowser)
+        noteBrowser.signalQueryChanged.connect(lambda: self._loadNotes(card, deck, noteBrowser))
+        noteBrowser.signalSortChanged.connect(lambda: self.viewNotesSort(card, deck, noteBrowser))
+        noteBrowser.signalMoreNeeded.connect(lambda: self.viewNotesMore(card, deck, noteBrowser))
         noteBrowser.signalAdd.connect(lambda: self.viewNotesAdd(card, deck, noteBrowser))
         noteBrowser.signalEdit.connect(lambda: self.viewNotesEdit(card, deck, noteBrowser))
         noteBrowser.signalDelete.connect(lambda: self.viewNotesDelete(card, deck, noteBrowser))
+        noteBrowser.signalMove.connect(lambda: self.viewNotesMove(card, deck, noteBrowser))
+        noteBrowser.signalReset.connect(lambda: self.viewNotesReset(card, deck, noteBrowser))
+        noteBrowser.signalReschedule.connect(lambda: self.viewNotesReschedule(card, deck, noteBrowser))
+        noteBrowser.signalImport.connect(lambda: self.viewNotesImport(card, deck, noteBrowser))
+        noteBrowser.signalExport.connect(lambda: self.viewNotesExport(card, deck, noteBrowser))
         noteBrowser.exec()
 
-    def viewNotesAdd(self, card: Card, deck: Deck, noteBrowser: NoteBrowserView):
+    @profiledAction
+    def viewNotesSort(self, card: CardInfo, deck: Deck, noteBrowser: NoteBrowserView):
+        """
+        Sort column of note browser changed, a column sorted often gets an index.
+        It is built on a worker thread, the notes are sorted without it meanwhile.
+        """
+        index = self._sortIndexes.noteSorted(noteBrowser.getQuery(deck.d_id).sort)
+        if index is not None:
+            engine = self._engine
+            self._writerBackground.run(lambda: createSortIndex(engine, index), lambda _: None, self._onBackgroundError)
+        self._loadNotes(card, deck, noteBrowser)
+
+    @profiledAction
+    def viewNotesMore(self, card: CardInfo, deck: Deck, noteBrowser: NoteBrowserView):
+        """Note browser scrolled near the end of loaded notes, load the following page"""
+        after = noteBrowser.getNextKey()
+        if after is None:
+            return
+        with self._readUnitOfWork() as session:
+            page = fetchNotePage(session, noteBrowser.getQuery(deck.d_id), len(card.fields), after)
+        noteBrowser.appendNotes(page)
+
+    def viewNotesAdd(self, card: CardInfo, deck: Deck, noteBrowser: NoteBrowserView):
         """View notes of a deck from deck list, add new note"""
-        noteForm = NoteFormView(deck.d_name, json.loads(card.c_fields))
+        noteForm = NoteFormView(deck.d_name, card.fields)
         noteForm.signalCancel.connect(noteForm.close)
         noteForm.signalSave.connect(lambda: self.viewNotesAddSave(card, deck, noteBrowser, noteForm))
         noteForm.exec()
 
-    def viewNotesAddSave(self, card: Card, deck: Deck, noteBrowser: NoteBrowserView, noteForm: NoteFormView):
+    @profiledAction
+    def viewNotesAddSave(self, card: CardInfo, deck: Deck, noteBrowser: NoteBrowserView, noteForm: NoteFormView):
         """Add new note, refresh note browser"""
         data = noteForm.getData()
         if "" in data:
             error = ErrorMessage("Field cannot be empty.")
             error.exec()
         else:
-            newNote = Note(n_data=json.dumps(data), d_id=deck.d_id)
-            self._session.add(newNote)
-            self._session.commit()
+            data = [internMedia(value, self._mediaStore) for value in data]
+            with self._unitOfWork() as session:
+                session.add(Note(n_data=json.dumps(data), d_id=deck.d_id))
+            self._dueCounts.noteChanged(deck.d_id, None, 0)
+            self._onDueCountsChanged()
             info = InfoMessage("Added new note.")
-            notes = self._session.query(Note.n_id, Note.n_data).filter_by(d_id=deck.d_id).all()
-            notesData = list(map(lambda t: (t[0], json.loads(t[1])), notes))
-            noteBrowser.refresh(json.loads(card.c_fields), notesData)
+            self._loadNotes(card, deck, noteBrowser)
             info.exec()
             noteForm.close()
 
-    def viewNotesEdit(self, card: Card, deck: Deck, noteBrowser: NoteBrowserView):
+    def viewNotesEdit(self, card: CardInfo, deck: Deck, noteBrowser: NoteBrowserView):
         """Edit note from note browser"""
         selected = noteBrowser.getSelectedId()
-        note = self._session.query(Note).filter_by(n_id=selected).one()
-        noteForm = NoteFormView(deck.d_name, json.loads(card.c_fields), json.loads(note.n_data))
+        with self._unitOfWork() as session:
+            note = session.query(Note.n_data).filter(Note.n_id == selected).one()
+        noteForm = NoteFormView(deck.d_name, card.fields, json.loads(note.n_data))
         noteForm.signalCancel.connect(noteForm.close)
         noteForm.signalSave.connect(lambda: self.viewNotesEditSave(card, deck, noteBrowser, noteForm))
         noteForm.exec()
 
-    def viewNotesEditSave(self, card: Card, deck: Deck, noteBrowser: NoteBrowserView, noteForm: NoteFormView):
+    @profiledAction
+    def viewNotesEditSave(self, card: CardInfo, deck: Deck, noteBrowser: NoteBrowserView, noteForm: NoteFormView):
         """Edit note from note browser, refresh note browser view"""
         selected = noteBrowser.getSelectedId()
         data = noteForm.getData()
@@ -491,39 +892,164 @@ class Controller:
             error = ErrorMessage("Field cannot be empty")
             error.exec()
         else:
-            note = self._session.query(Note).filter_by(n_id=selected).one()
-            note.n_data = json.dumps(data)
-            self._session.commit()
+            data = [internMedia(value, self._mediaStore) for value in data]
+            with self._unitOfWork() as session:
+                session.query(Note).filter(Note.n_id == selected) \
+                    .update({Note.n_data: json.dumps(data)}, synchronize_session=False)
+            self._studySession.forgetContent(selected)
             info = InfoMessage("Saved edited note.")
-            notes = self._session.query(Note.n_id, Note.n_data).filter_by(d_id=deck.d_id).all()
-            notesData = list(map(lambda t: (t[0], json.loads(t[1])), notes))
-            noteBrowser.refresh(json.loads(card.c_fields), notesData)
+            noteBrowser.updateNote(selected, data)
             info.exec()
             noteForm.close()
 
-    def viewNotesDelete(self, card: Card, deck: Deck, noteBrowser: NoteBrowserView):
-        """Delete note from note browser, refresh note browser"""
-        selected = noteBrowser.getSelectedId()
-        note = self._session.query(Note).filter_by(n_id=selected).one()
-        self._session.delete(note)
-        self._session.commit()
-        info = InfoMessage("Deleted note")
-        notes = self._session.query(Note.n_id, Note.n_data).filter_by(d_id=deck.d_id).all()
-        notesData = list(map(lambda t: (t[0], json.loads(t[1])), notes))
-        noteBrowser.refresh(json.loads(card.c_fields), notesData)
+    @profiledAction
+    def viewNotesDelete(self, card: CardInfo, deck: Deck, noteBrowser: NoteBrowserView):
+        """Delete selected notes from note browser, remove them from note browser"""
+        selected = noteBrowser.getSelectedIds()
+        if not selected:
+            return
+        confirm = ConfirmMessage(f"Delete {len(selected)} notes and their reviews?")
+        if not confirm.exec():
+            return
+        with self._unitOfWork() as session:
+            deleted = bulknotes.deleteNotes(session, selected)
+        for n_id in selected:
+            self._studySession.forgetContent(n_id)
+        self._dueCounts.reloadDeck(deck.d_id)
+        self._onDueCountsChanged()
+        self._maintenance.requestPass()
+        noteBrowser.removeNotes(selected)
+        info = InfoMessage(f"Deleted {deleted} notes")
+        info.exec()
+
+    @profiledAction
+    def viewNotesMove(self, card: CardInfo, deck: Deck, noteBrowser: NoteBrowserView):
+        """Move selected notes to another deck of the same card, remove them from note browser"""
+        selected = noteBrowser.getSelectedIds()
+        if not selected:
+            return
+        targets = {row.d_name: row.d_id for row in self._metadata.decks()
+                   if row.c_id == deck.c_id and row.d_id != deck.d_id}
+        if not targets:
+            error = ErrorMessage("There is no other deck of this card to move the notes to.")
+            error.exec()
+            return
+        name = noteBrowser.askTargetDeck(list(targets))
+        if not name:
+            return
+        with self._unitOfWork() as session:
+            moved = bulknotes.moveNotes(session, selected, targets[name])
+        self._dueCounts.reloadDeck(deck.d_id)
+        self._dueCounts.reloadDeck(targets[name])
+        self._onDueCountsChanged()
+        self._snapshot.invalidate()
+        noteBrowser.removeNotes(selected)
+        info = InfoMessage(f"Moved {moved} notes to {name}")
+        info.exec()
+
+    @profiledAction
+    def viewNotesReset(self, card: CardInfo, deck: Deck, noteBrowser: NoteBrowserView):
+        """Reset schedule of selected notes from note browser, they are studied as new"""
+        selected = noteBrowser.getSelectedIds()
+        if not selected:
+            return
+        confirm = ConfirmMessage(f"Reset schedule of {len(selected)} notes? They will be studied as new notes.")
+        if not confirm.exec():
+            return
+        with self._unitOfWork() as session:
+            reset = bulknotes.resetNotes(session, selected)
+            schedules = bulknotes.noteSchedules(session, selected)
+        self._dueCounts.reloadDeck(deck.d_id)
+        self._onDueCountsChanged()
+        self._snapshot.invalidate()
+        noteBrowser.updateSchedules(schedules)
+        info = InfoMessage(f"Reset {reset} notes")
+        info.exec()
+
+    @profiledAction
+    def viewNotesReschedule(self, card: CardInfo, deck: Deck, noteBrowser: NoteBrowserView):
+        """Make selected notes from note browser due on a chosen day"""
+        selected = noteBrowser.getSelectedIds()
+        if not selected:
+            return
+        timestamp = noteBrowser.askRescheduleDate()
+        if timestamp is None:
+            return
+        with self._unitOfWork() as session:
+            rescheduled = bulknotes.rescheduleNotes(session, selected, timestamp)
+            schedules = bulknotes.noteSchedules(session, selected)
+        self._dueCounts.reloadDeck(deck.d_id)
+        self._onDueCountsChanged()
+        self._snapshot.invalidate()
+        noteBrowser.updateSchedules(schedules)
+        info = InfoMessage(f"Rescheduled {rescheduled} notes")
         info.exec()
 
+    def viewNotesImport(self, card: CardInfo, deck: Deck, noteBrowser: NoteBrowserView):
+        """Import notes from delimited text into the deck from note browser"""
+        importForm = DelimitedImportView(card.fields)
+        importForm.signalImport.connect(lambda: self.viewNotesImportSave(card, deck, noteBrowser, importForm))
+        importForm.exec()
+
+    @profiledAction
+    def viewNotesImportSave(self, card: CardInfo, deck: Deck, noteBrowser: NoteBrowserView,
+                            importForm: DelimitedImportView):
+        """Stream the rows into the deck in batches, rejected rows are reported at the end"""
+        mapping = importForm.getMapping()
+        if not importForm.hasSource():
+            error = ErrorMessage("Please choose a file or paste notes from the clipboard")
+            error.exec()
+            return
+        if None in mapping:
+            error = ErrorMessage("Please choose a column for every field")
+            error.exec()
+            return
+        errors = []
+        try:
+            with importForm.openSource() as stream:
+                notes = parseNotes(stream, importForm.getDialect(), mapping, importForm.hasHeader(), errors,
+                                   lambda value: internMedia(value, self._mediaStore))
+                imported = importNotes(self._sessionFactory, deck.d_id, notes)
+        except (OSError, UnicodeDecodeError) as exception:
+            error = ErrorMessage(f"Couldn't read notes: {exception}")
+            error.exec()
+            return
+        finally:
+            self._dueCounts.reloadDeck(deck.d_id)  # batches committed before a failure count too
+            self._onDueCountsChanged()
+        self._loadNotes(card, deck, noteBrowser)
+        message = f"Imported {imported} notes."
+        if errors:
+            message += f" Skipped {len(errors)} rows:\n"
+            message += "\n".join(f"line {rowError.line}: {rowError.message}" for rowError in errors[:IMPORT_ERRORS_SHOWN])
+        info = InfoMessage(message)
+        info.exec()
+        importForm.close()
+
+    def viewNotesExport(self, card: CardInfo, deck: Deck, noteBrowser: NoteBrowserView):
+        """Export notes of the deck from note browser to delimited text"""
+        path = noteBrowser.chooseExportFile()
+        if not path:
+            return
+        dialect = csv.excel_tab if path.lower().endswith(".tsv") else csv.excel
+
+        def export() -> int:
+            with open(path, "w", newline="", encoding="utf-8") as stream:
+                return exportNotes(self._readSessionFactory, deck.d_id, card.fields, stream, dialect)
+        self._background.run(export, lambda exported: InfoMessage(f"Exported {exported} notes").exec(),
+                             self._onBackgroundError)
+
     # ADD NOTE FORM
 
     def addNote(self, d_id: int):
         """Add note"""
-        deck = self._session.query(Deck).filter_by(d_id=d_id).one()
-        card = self._session.query(Card).filter_by(c_id=deck.c_id).one()
-        form = NoteFormView(deck.d_name, json.loads(card.c_fields))
+        deck, card = self._metadata.deck(d_id), self._metadata.deckCard(d_id)
+        form = NoteFormView(deck.d_name, card.fields)
         form.signalCancel.connect(form.close)
         form.signalSave.connect(lambda: self.addNoteSave(form, d_id))
         form.exec()
 
+    @profiledAction
     def addNoteSave(self, form: NoteFormView, d_id: int):
         """Add note and save"""
         data = form.getData()
@@ -531,25 +1057,62 @@ class Controller:
             error = ErrorMessage("Field can't be empty")
             error.exec()
         else:
-            self._session.add(Note(n_data=json.dumps(data), d_id=d_id))
-            self._session.commit()
+            data = [internMedia(value, self._mediaStore) for value in data]
+            with self._unitOfWork() as session:
+                session.add(Note(n_data=json.dumps(data), d_id=d_id))
+            self._dueCounts.noteChanged(d_id, None, 0)
+            self._onDueCountsChanged()
             info = InfoMessage("Added new note")
             info.exec()
             form.close()
             self.openMainDetails(d_id) # refresh ui
 
     # STATS
+    @profiledAction
     def display_deck_stats(self, d_id):
-        """Display deck stats for a given deck"""
-        notes = self._session.query(Note).filter_by(d_id=d_id).all()
-        dataPie = prepareDeckDataPie(notes)
-        dataBar = prepareDeckDataBar(notes)
-        window = DeckStatsView(dataPie, dataBar)
-        window.exec()
+        """
+        Display deck stats for a given deck, the window stays open and follows the ratings.
+        Data is read from the columnar snapshot in the background, which catches up with the reviews logged since
+        the last refresh, so ratings keep committing meanwhile.
+        """
+        snapshot = self._snapshot
+        def load():
+            snapshot.refresh()
+            last_r, next_r = snapshot.deckSchedule(d_id)
+            dataPie, dataBar = prepareDeckDataColumns(last_r, next_r)
+            forecast = simulateWorkload(last_r, next_r, normalizeEaseCounts(snapshot.easeCounts(d_id)), FORECAST_DAYS)
+            return dataPie, dataBar, forecast
+        self._background.run(load, lambda result: self._showDeckStats(d_id, *result), self._onBackgroundError)
+
+    def _showDeckStats(self, d_id, dataPie, dataBar, forecast):
+        if self._deckStatsView is None:
+            self._deckStatsView = DeckStatsView()
+        self._liveDeckStats = (d_id, dataPie, dataBar)
+        self._deckStatsView.setDataPie(dataPie.items())
+        self._deckStatsView.setDataBar(dataBar)
+        self._deckStatsView.setDataForecast((forecast.mean.tolist(), forecast.lower.tolist(), forecast.upper.tolist()))
+        self._deckStatsView.show()
 
+    def _updateLiveDeckStats(self, d_id: int, old, new):
+        """Moves a rated note between chart categories while the deck stats window is open"""
+        if self._deckStatsView is None or not self._deckStatsView.isVisible() or self._liveDeckStats[0] != d_id:
+            return
+        _, dataPie, dataBar = self._liveDeckStats
+        updateDeckData(dataPie, dataBar, old, new)
+        self._deckStatsView.setDataPie(dataPie.items())
+        self._deckStatsView.setDataBar(dataBar)
+
+    @profiledAction
     def display_flashcard_stats(self, n_id):
-        """Display note stats for a given note"""
-        reviews = self._session.query(Review).filter_by(n_id=n_id).all()
-        dataPie = prepareNoteDataPie(reviews)
-        window = NoteStatsView(dataPie)
-        window.exec()
\ No newline at end of file
+        """Display note stats for a given note, ratings are read from the columnar snapshot"""
+        snapshot = self._snapshot
+        def load():
+            snapshot.refresh()
+            return prepareNoteDataColumns(snapshot.noteEases(n_id))
+        self._background.run(load, self._showNoteStats, self._onBackgroundError)
+
+    def _showNoteStats(self, dataPie):
+        if self._noteStatsView is None:
+            self._noteStatsView = NoteStatsView()
+        self._noteStatsView.setNoteDataPie(dataPie)
+        self._noteStatsView.exec()
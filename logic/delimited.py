@@ -0,0 +1,111 @@
+import csv
+import itertools
+import json
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional, TextIO
+
+import sqlalchemy.orm
+
+from data import dbmodel as dbm
+from data.dbmodel import Note
+
+
+BATCH_SIZE = 5000  # notes inserted or exported per transaction
+SAMPLE_LINES = 20
+DELIMITERS = ",\t;"
+
+
+class RowError(NamedTuple):
+    """Row rejected by the import, line is the number of the line it starts on"""
+    line: int
+    message: str
+
+
+def sniffDialect(sample: str, default: str = ","):
+    """Detects delimiter and quoting from the first lines, falls back to the default delimiter"""
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=DELIMITERS)
+    except csv.Error:
+        return csv.excel_tab if default == "\t" else csv.excel
+
+
+def readSample(stream: TextIO, lines: int = SAMPLE_LINES) -> str:
+    """Reads the first lines of the stream and rewinds it"""
+    sample = "".join(itertools.islice(stream, lines))
+    stream.seek(0)
+    return sample
+
+
+def mapColumns(header: Optional[List[str]], fields: List[str], columnCount: int) -> List[Optional[int]]:
+    """
+    Returns the column of every field, columns are matched by name when there is a header,
+    otherwise fields take the columns in order. None marks a field without a column.
+    """
+    if header:
+        names = [name.strip().lower() for name in header]
+        mapping = [names.index(field.lower()) if field.lower() in names else None for field in fields]
+        if any(column is not None for column in mapping):
+            return mapping
+    return [idx if idx < columnCount else None for idx in range(len(fields))]
+
+
+def parseNotes(stream: TextIO, dialect, mapping: List[Optional[int]], hasHeader: bool,
+               errors: List[RowError], transform: Callable[[str], str] = lambda value: value) -> Iterator[List[str]]:
+    """
+    Yields values of the note fields for every valid row, rows are read and validated one at a time.
+    Rejected rows are appended to errors, the import goes on without them.
+    """
+    reader = csv.reader(stream, dialect)
+    needed = max((column for column in mapping if column is not None), default=-1) + 1
+    if hasHeader:
+        next(reader, None)
+    while True:
+        line = reader.line_num + 1
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as error:
+            errors.append(RowError(line, str(error)))
+            continue
+        if not any(value.strip() for value in row):
+            continue
+        if len(row) < needed:
+            errors.append(RowError(line, f"expected at least {needed} columns, found {len(row)}"))
+            continue
+        values = [row[column].strip() if column is not None else "" for column in mapping]
+        if "" in values:
+            errors.append(RowError(line, "fields can't be empty"))
+            continue
+        yield [transform(value) for value in values]
+
+
+def importNotes(factory: sqlalchemy.orm.sessionmaker, d_id: int, notes: Iterable[List[str]],
+                batchSize: int = BATCH_SIZE) -> int:
+    """Inserts the notes into the deck, every batch is a transaction of its own. Returns number of inserted notes"""
+    notes = iter(notes)
+    inserted = 0
+    while True:
+        batch = [{"n_data": json.dumps(values), "n_last_r": 0, "n_next_r": 0, "d_id": d_id}
+                 for values in itertools.islice(notes, batchSize)]
+        if not batch:
+            return inserted
+        with dbm.sessionScope(factory) as session:
+            session.execute(Note.__table__.insert(), batch)
+        inserted += len(batch)
+
+
+def exportNotes(factory: sqlalchemy.orm.sessionmaker, d_id: int, fields: List[str], stream: TextIO,
+                dialect=csv.excel, batchSize: int = BATCH_SIZE) -> int:
+    """Writes the notes of the deck with a header row, reading them in batches by n_id. Returns number of notes"""
+    writer = csv.writer(stream, dialect)
+    writer.writerow(fields)
+    written, lastId = 0, -1
+    while True:
+        with dbm.sessionScope(factory) as session:
+            rows = session.query(Note.n_id, Note.n_data) \
+                .filter(Note.d_id == d_id, Note.n_id > lastId).order_by(Note.n_id).limit(batchSize).all()
+        if not rows:
+            return written
+        writer.writerows(json.loads(row.n_data) for row in rows)
+        written += len(rows)
+        lastId = rows[-1].n_id
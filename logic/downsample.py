@@ -0,0 +1,32 @@
+from typing import List, Sequence
+
+
+def lttbIndices(values: Sequence[float], threshold: int) -> List[int]:
+    """
+    Largest-Triangle-Three-Buckets downsampling of a series sampled at x = 0, 1, 2, ...
+    Returns indices of at most threshold points which keep the visual shape of the series,
+    the first and the last point are always kept.
+    """
+    count = len(values)
+    if threshold >= count or threshold < 3:
+        return list(range(count))
+    selected = [0]
+    bucketSize = (count - 2) / (threshold - 2)
+    previous = 0
+    for bucket in range(threshold - 2):
+        start = int(bucket * bucketSize) + 1
+        end = int((bucket + 1) * bucketSize) + 1
+        # average of the next bucket is the third vertex of the triangle
+        nextStart, nextEnd = end, min(int((bucket + 2) * bucketSize) + 1, count)
+        averageX = (nextStart + nextEnd - 1) / 2
+        averageY = sum(values[nextStart:nextEnd]) / (nextEnd - nextStart)
+        best, bestArea = start, -1.0
+        for idx in range(start, end):
+            area = abs((previous - averageX) * (values[idx] - values[previous])
+                       - (previous - idx) * (averageY - values[previous]))
+            if area > bestArea:
+                best, bestArea = idx, area
+        selected.append(best)
+        previous = best
+    selected.append(count - 1)
+    return selected
@@ -0,0 +1,114 @@
+import time
+from typing import Callable, Dict, List, Optional
+
+import sqlalchemy.orm
+from sqlalchemy import func
+
+from data import dbmodel as dbm
+from data.dbmodel import Note
+
+
+class DueCountTracker:
+    """
+    Keeps the number of due notes of every deck and the time the next note of the deck becomes due.
+    Counts are exact up to checkedAt. When the earliest boundary passes, advance() counts only the notes
+    which became due since then, a range query over ix_n_d_id_next_r of the decks whose boundary passed.
+    Ratings and edits are applied directly through noteChanged, a boundary may be too early but never late,
+    which costs one empty range query.
+    """
+    def __init__(self, factory: sqlalchemy.orm.sessionmaker, clock: Callable[[], float] = time.time):
+        self._factory = factory
+        self._clock = clock
+        self._counts: Dict[int, int] = {}
+        self._nextDue: Dict[int, int] = {}
+        self._checkedAt: Optional[int] = None
+
+    def _now(self) -> int:
+        return int(self._clock())
+
+    def reload(self) -> None:
+        """Counts the due notes of all decks from scratch, used after bulk changes"""
+        now = self._now()
+        with dbm.sessionScope(self._factory) as session:
+            deckIds = [d_id for d_id, in session.query(dbm.Deck.d_id)]
+            counts = dict(session.query(Note.d_id, func.count(Note.n_id))
+                          .filter(Note.n_next_r <= now).group_by(Note.d_id).all())
+            nextDue = dict(session.query(Note.d_id, func.min(Note.n_next_r))
+                           .filter(Note.n_next_r > now).group_by(Note.d_id).all())
+        self._counts = {d_id: counts.get(d_id, 0) for d_id in deckIds}
+        self._nextDue = nextDue
+        self._checkedAt = now
+
+    def reloadDeck(self, d_id: int) -> None:
+        """Counts the due notes of one deck from scratch, used after changes whose old schedule isn't known"""
+        if self._checkedAt is None:
+            self.reload()
+            return
+        with dbm.sessionScope(self._factory) as session:
+            count = session.query(func.count(Note.n_id)) \
+                .filter(Note.d_id == d_id, Note.n_next_r <= self._checkedAt).scalar()
+            nextDue = session.query(func.min(Note.n_next_r)) \
+                .filter(Note.d_id == d_id, Note.n_next_r > self._checkedAt).scalar()
+        self._counts[d_id] = count
+        self._setNextDue(d_id, nextDue)
+
+    def forgetDeck(self, d_id: int) -> None:
+        self._counts.pop(d_id, None)
+        self._nextDue.pop(d_id, None)
+
+    def _setNextDue(self, d_id: int, nextDue: Optional[int]) -> None:
+        if nextDue is None:
+            self._nextDue.pop(d_id, None)
+        else:
+            self._nextDue[d_id] = nextDue
+
+    def nextBoundary(self) -> Optional[int]:
+        """Returns the earliest time a note of any deck becomes due, None when no note is scheduled"""
+        return min(self._nextDue.values(), default=None)
+
+    def advance(self) -> List[int]:
+        """Brings the counts up to now, returns IDs of the decks whose count changed"""
+        if self._checkedAt is None:
+            self.reload()
+            return list(self._counts)
+        now = self._now()
+        passed = [d_id for d_id, nextDue in self._nextDue.items() if nextDue <= now]
+        if passed:
+            with dbm.sessionScope(self._factory) as session:
+                added = dict(session.query(Note.d_id, func.count(Note.n_id))
+                             .filter(Note.d_id.in_(passed), Note.n_next_r > self._checkedAt, Note.n_next_r <= now)
+                             .group_by(Note.d_id).all())
+                nextDue = dict(session.query(Note.d_id, func.min(Note.n_next_r))
+                               .filter(Note.d_id.in_(passed), Note.n_next_r > now).group_by(Note.d_id).all())
+            for d_id in passed:
+                self._counts[d_id] = self._counts.get(d_id, 0) + added.get(d_id, 0)
+                self._setNextDue(d_id, nextDue.get(d_id))
+        self._checkedAt = now
+        return [d_id for d_id in passed if d_id in self._counts]
+
+    def noteChanged(self, d_id: int, oldNext: Optional[int], newNext: Optional[int]) -> None:
+        """
+        Applies a change of the schedule of one note, oldNext is None for an added note
+        and newNext is None for a deleted one
+        """
+        if self._checkedAt is None:
+            return
+        count = self._counts.get(d_id, 0)
+        if oldNext is not None and oldNext <= self._checkedAt:
+            count -= 1
+        if newNext is not None:
+            if newNext <= self._checkedAt:
+                count += 1
+            elif newNext < self._nextDue.get(d_id, newNext + 1):
+                self._nextDue[d_id] = newNext
+        self._counts[d_id] = max(count, 0)
+
+    def count(self, d_id: int) -> int:
+        if self._checkedAt is None:
+            self.reload()
+        return self._counts.get(d_id, 0)
+
+    def counts(self) -> Dict[int, int]:
+        if self._checkedAt is None:
+            self.reload()
+        return dict(self._counts)
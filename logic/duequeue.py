@@ -0,0 +1,41 @@
+import heapq
+from typing import Iterator, List
+
+import sqlalchemy as sql
+import sqlalchemy.orm
+
+from data import dbmodel as dbm
+from data.dbmodel import Note
+
+
+FIRST_PAGE_SIZE = 8  # keeps the startup cost proportional to the decks, not to their due notes
+MAX_PAGE_SIZE = 512
+
+
+def dueOrder(note) -> tuple:
+    return note.n_next_r, note.n_id
+
+
+def scanDueNotes(factory: sqlalchemy.orm.sessionmaker, d_id: int, timeNow: int) -> Iterator:
+    """
+    Yields due notes of the deck ordered by (n_next_r, n_id).
+    Notes are read in pages by keyset pagination over ix_n_d_id_next_r, every page in its own unit of work,
+    the page size doubles as the user keeps studying the deck.
+    """
+    pageSize, lastKey = FIRST_PAGE_SIZE, None
+    while True:
+        with dbm.sessionScope(factory) as session:
+            query = session.query(*dbm.QUEUE_COLUMNS).filter(Note.d_id == d_id, Note.n_next_r <= timeNow)
+            if lastKey is not None:
+                query = query.filter(sql.tuple_(Note.n_next_r, Note.n_id) > sql.tuple_(*lastKey))
+            page = query.order_by(Note.n_next_r, Note.n_id).limit(pageSize).all()
+        yield from page
+        if len(page) < pageSize:
+            return
+        lastKey = dueOrder(page[-1])
+        pageSize = min(pageSize * 2, MAX_PAGE_SIZE)
+
+
+def mergeDueNotes(factory: sqlalchemy.orm.sessionmaker, deckIds: List[int], timeNow: int) -> Iterator:
+    """Merges due queues of the decks into one queue ordered by due time, a heap holds the head of every deck"""
+    return heapq.merge(*(scanDueNotes(factory, d_id, timeNow) for d_id in deckIds), key=dueOrder)
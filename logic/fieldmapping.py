@@ -0,0 +1,77 @@
+import json
+from typing import List, Optional
+
+import sqlalchemy as sql
+import sqlalchemy.orm
+
+from data.dbmodel import Note
+
+
+REMAP_CHUNK_SIZE = 5000  # rows per executemany when SQLite was built without JSON functions
+
+
+def inferFieldMapping(oldFields: List[str], newFields: List[str]) -> List[Optional[int]]:
+    """
+    Infers where the value of every new field comes from.
+    A field keeps its value when its name is kept, otherwise when it stays at the same position
+    and the old field at this position wasn't moved elsewhere (it was renamed).
+    Returns index of the old field for every new field, None for a new empty field.
+    """
+    mapping: List[Optional[int]] = []
+    for idx, name in enumerate(newFields):
+        if name in oldFields:
+            mapping.append(oldFields.index(name))
+        elif idx < len(oldFields) and oldFields[idx] not in newFields:
+            mapping.append(idx)
+        else:
+            mapping.append(None)
+    return mapping
+
+
+def isIdentityMapping(mapping: List[Optional[int]], oldFieldCount: int) -> bool:
+    return mapping == list(range(oldFieldCount))
+
+
+def droppedFields(oldFields: List[str], mapping: List[Optional[int]]) -> List[str]:
+    """Returns names of the old fields whose values are lost by the mapping"""
+    return [name for idx, name in enumerate(oldFields) if idx not in mapping]
+
+
+def remapValues(values: List[str], mapping: List[Optional[int]]) -> List[str]:
+    return [values[idx] if idx is not None and idx < len(values) else "" for idx in mapping]
+
+
+def hasJsonFunctions(session: sqlalchemy.orm.Session) -> bool:
+    try:
+        session.execute(sql.text("SELECT json_array()"))
+        return True
+    except sql.exc.OperationalError:
+        return False
+
+
+def remapNotes(session: sqlalchemy.orm.Session, deckIds: List[int], mapping: List[Optional[int]]) -> int:
+    """
+    Rewrites n_data of all notes in the decks, so that the new field i holds the old field mapping[i].
+    Runs in the transaction of the session as a single UPDATE, or in chunks when JSON functions are missing.
+    Returns the number of updated notes.
+    """
+    if not deckIds:
+        return 0
+    if hasJsonFunctions(session):
+        # indexes are ints, so the expression can't be used for injection
+        values = ", ".join("''" if idx is None else f"coalesce(json_extract(n_data, '$[{int(idx)}]'), '')" for idx in mapping)
+        statement = sql.text(f"UPDATE notes SET n_data = json_array({values}) WHERE d_id IN :deckIds") \
+            .bindparams(sql.bindparam("deckIds", expanding=True))
+        return session.execute(statement, {"deckIds": deckIds}).rowcount
+    updated, lastId = 0, -1
+    while True:
+        rows = session.query(Note.n_id, Note.n_data) \
+            .filter(Note.d_id.in_(deckIds), Note.n_id > lastId).order_by(Note.n_id).limit(REMAP_CHUNK_SIZE).all()
+        if not rows:
+            return updated
+        session.execute(
+            Note.__table__.update().where(Note.n_id == sql.bindparam("b_n_id")),
+            [{"b_n_id": n_id, "n_data": json.dumps(remapValues(json.loads(n_data), mapping))} for n_id, n_data in rows]
+        )
+        updated += len(rows)
+        lastId = rows[-1].n_id
@@ -0,0 +1,173 @@
+import argparse
+import time
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+import sqlalchemy as sql
+import sqlalchemy.orm
+
+from data.dbmodel import Note, Review
+from logic.scheduling import FIRST_INTERVAL, intervalMultiplier
+
+
+ONE_DAY = 60 * 60 * 24
+DEFAULT_EASE_DISTRIBUTION = {1: 0.15, 3: 0.7, 5: 0.15}  # used when there is no review history yet
+EASE_TABLE_SIZE = 1024
+INTERVAL_STEPS = 25  # buckets of the interval per e-fold, neighbours are 4% apart
+MIN_INTERVAL = 60  # seconds, shorter intervals share the first bucket
+MAX_INTERVAL = 100 * 365 * ONE_DAY  # longer intervals share the last bucket
+
+
+class Forecast(NamedTuple):
+    """
+    Result of the workload simulation, each array has one entry per day from now
+    mean        - expected number of reviews
+    lower       - lower bound of the confidence band
+    upper       - upper bound of the confidence band
+    """
+    mean: np.ndarray
+    lower: np.ndarray
+    upper: np.ndarray
+
+
+def loadSchedule(session: sqlalchemy.orm.Session, d_id: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Loads (n_last_r, n_next_r) columns of all notes, or notes of a single deck"""
+    query = sql.select([Note.n_last_r, Note.n_next_r])
+    if d_id is not None:
+        query = query.where(Note.d_id == d_id)
+    rows = np.array(session.execute(query).fetchall(), dtype=np.int64).reshape(-1, 2)
+    return rows[:, 0], rows[:, 1]
+
+
+def loadEaseDistribution(session: sqlalchemy.orm.Session, d_id: Optional[int] = None) -> Dict[int, float]:
+    """Loads the historical distribution of ratings from the reviews table"""
+    query = sql.select([Review.r_ease, sql.func.count()]).group_by(Review.r_ease)
+    if d_id is not None:
+        query = query.where(Review.n_id.in_(sql.select([Note.n_id]).where(Note.d_id == d_id)))
+    return normalizeEaseCounts(dict(session.execute(query).fetchall()))
+
+
+def normalizeEaseCounts(counts: Dict[int, int]) -> Dict[int, float]:
+    """Turns counts of reviews by rating into the distribution of ratings"""
+    total = sum(counts.values())
+    if total == 0:
+        return dict(DEFAULT_EASE_DISTRIBUTION)
+    return {ease: count / total for ease, count in counts.items()}
+
+
+def simulateWorkload(last_r: np.ndarray, next_r: np.ndarray, easeDistribution: Dict[int, float], days: int = 31,
+                     simulations: int = 8, confidence: float = 0.9, now: Optional[int] = None,
+                     seed: Optional[int] = None) -> Forecast:
+    """
+    Runs a Monte Carlo simulation of future reviews for all notes at once.
+    Every simulated review draws a rating from easeDistribution and reschedules the note
+    with the same rule as the study session, a note is reviewed at most once per day.
+    The first review is simulated note by note. Later ones are simulated for counts of notes by the day
+    they are due and their interval, rounded to one of INTERVAL_STEPS buckets per e-fold,
+    so the work of a day depends on the number of distinct intervals rather than on the number of notes.
+    """
+    now = int(time.time()) if now is None else now
+    rng = np.random.default_rng(seed)
+    bucketCount = int(INTERVAL_STEPS * np.log(MAX_INTERVAL / MIN_INTERVAL)) + 1
+    intervalDays = MIN_INTERVAL * np.exp(np.arange(bucketCount) / INTERVAL_STEPS) / ONE_DAY
+    wholeDays = np.floor(intervalDays).astype(np.int64)
+    dayFraction = intervalDays - wholeDays
+
+    eases = sorted(easeDistribution)
+    probabilities = np.array([easeDistribution[ease] for ease in eases], dtype=np.float64)
+    probabilities /= probabilities.sum()
+    multipliers = np.array([intervalMultiplier(ease) for ease in eases], dtype=np.float64)
+    # ratings of single notes are drawn through a lookup table, which is much cheaper than sampling the distribution
+    slots = np.searchsorted(np.cumsum(probabilities), (np.arange(EASE_TABLE_SIZE) + 0.5) / EASE_TABLE_SIZE)
+    multiplierTable = multipliers[slots.clip(0, len(eases) - 1)]
+    # a rating moves the interval by a fractional number of buckets, it is rounded down or up at random
+    # so the intervals don't drift, each rating has an outcome for either way
+    shifts = INTERVAL_STEPS * np.log(np.maximum(multipliers, MIN_INTERVAL / MAX_INTERVAL))
+    roundedUp = shifts - np.floor(shifts)
+    outcomeShifts = np.concatenate([np.floor(shifts), np.floor(shifts) + 1]).astype(np.int64)
+    outcomeProbabilities = np.concatenate([probabilities * (1 - roundedUp), probabilities * roundedUp])
+    possible = outcomeProbabilities > 0
+    outcomeShifts, outcomeProbabilities = outcomeShifts[possible], outcomeProbabilities[possible]
+
+    last_r = np.asarray(last_r, dtype=np.int64)
+    next_r = np.asarray(next_r, dtype=np.int64)
+    firstReview = (last_r == 0) | (next_r == 0)
+    startDue = np.where(firstReview, 0, np.maximum(next_r - now, 0))
+    startInterval = np.where(firstReview, FIRST_INTERVAL, next_r - last_r)
+    inHorizon = startDue < days * ONE_DAY
+    # single precision is accurate to seconds over a year and halves the memory traffic of the first reviews
+    startDue, startInterval = startDue[inHorizon].astype(np.float32), startInterval[inHorizon].astype(np.float32)
+    startDay = np.floor(startDue / ONE_DAY)
+    results = np.tile(np.bincount(startDay.astype(np.int64), minlength=days), (simulations, 1))
+
+    # the first review is at the due time, the next one can't happen before the following day
+    counts = np.zeros((simulations, days, bucketCount), dtype=np.int64)
+    for s in range(simulations):
+        interval = startInterval * multiplierTable[rng.integers(0, EASE_TABLE_SIZE, len(startDue), dtype=np.int16)]
+        nextDay = np.floor(np.maximum(startDue + interval, (startDay + 1) * ONE_DAY) / ONE_DAY).astype(np.int64)
+        keep = nextDay < days
+        counts[s] = np.bincount(nextDay[keep] * bucketCount + _intervalBucket(interval[keep], bucketCount),
+                                minlength=days * bucketCount).reshape(days, bucketCount)
+
+    # later reviews are simulated for all simulations at once
+    for day in range(days):
+        simulation, buckets = np.nonzero(counts[:, day])
+        if not len(buckets):
+            continue
+        due = counts[simulation, day, buckets]
+        results[:, day] += np.bincount(simulation, weights=due, minlength=simulations).astype(np.int64)
+        reviewed = rng.multinomial(due, outcomeProbabilities).ravel()
+        targets = np.clip(buckets[:, None] + outcomeShifts, 0, bucketCount - 1).ravel()
+        simulation = np.repeat(simulation, len(outcomeShifts))
+        rated = reviewed > 0
+        reviewed, targets, simulation = reviewed[rated], targets[rated], simulation[rated]
+        # past the first review the time of day is taken as uniform, so an interval ends a day later
+        # for the part of the notes given by its fraction of a day
+        later = rng.binomial(reviewed, dayFraction[targets])
+        for offset, moved in ((wholeDays[targets], reviewed - later), (wholeDays[targets] + 1, later)):
+            nextDay = day + np.maximum(offset, 1)
+            keep = (nextDay < days) & (moved > 0)
+            np.add.at(counts, (simulation[keep], nextDay[keep], targets[keep]), moved[keep])
+
+    tail = (1 - confidence) / 2 * 100
+    return Forecast(
+        mean=results.mean(axis=0),
+        lower=np.percentile(results, tail, axis=0),
+        upper=np.percentile(results, 100 - tail, axis=0),
+    )
+
+
+def _intervalBucket(intervals: np.ndarray, bucketCount: int) -> np.ndarray:
+    """Returns the buckets of intervals given in seconds"""
+    steps = np.round(INTERVAL_STEPS * np.log(np.maximum(intervals, MIN_INTERVAL) / MIN_INTERVAL))
+    return np.clip(steps, 0, bucketCount - 1).astype(np.int64)
+
+
+def forecastWorkload(session: sqlalchemy.orm.Session, d_id: Optional[int] = None, days: int = 31,
+                     simulations: int = 8, seed: Optional[int] = None) -> Forecast:
+    """Simulates future workload of a deck, or the whole collection when d_id is None"""
+    last_r, next_r = loadSchedule(session, d_id)
+    return simulateWorkload(last_r, next_r, loadEaseDistribution(session, d_id), days, simulations, seed=seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate future review workload")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--simulations", type=int, default=8)
+    parser.add_argument("--deck", type=int, default=None, help="ID of the deck, whole collection by default")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    from data import dbmodel as dbm
+    session = dbm.Session()
+    start = time.perf_counter()
+    forecast = forecastWorkload(session, args.deck, args.days, args.simulations, args.seed)
+    elapsed = time.perf_counter() - start
+    print("day\tmean\tlower\tupper")
+    for day in range(args.days):
+        print(f"{day}\t{forecast.mean[day]:.1f}\t{forecast.lower[day]:.0f}\t{forecast.upper[day]:.0f}")
+    print(f"simulated {args.days} days in {elapsed:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
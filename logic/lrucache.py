@@ -0,0 +1,59 @@
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class LRUCache:
+    """
+    LRUCache keeps the most recently used values as long as their total cost fits in the budget.
+    By default every value costs 1, so maxCost is the number of entries.
+    """
+    def __init__(self, maxCost: int, cost: Callable[[Any], int] = lambda value: 1,
+                 onEvict: Optional[Callable[[Hashable, Any], None]] = None):
+        self._maxCost = maxCost
+        self._cost = cost
+        self._onEvict = onEvict
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._costs = {}
+        self.totalCost = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        if key not in self._entries:
+            return default
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if key in self._entries:
+            self._remove(key)
+        cost = self._cost(value)
+        if cost > self._maxCost:  # would evict everything and still not fit
+            return
+        self._entries[key] = value
+        self._costs[key] = cost
+        self.totalCost += cost
+        while self.totalCost > self._maxCost:
+            oldKey, oldValue = next(iter(self._entries.items()))
+            self._remove(oldKey)
+            if self._onEvict:
+                self._onEvict(oldKey, oldValue)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        if key not in self._entries:
+            return default
+        return self._remove(key)
+
+    def clear(self) -> None:
+        for key in list(self._entries):
+            value = self._remove(key)
+            if self._onEvict:
+                self._onEvict(key, value)
+
+    def _remove(self, key: Hashable) -> Any:
+        self.totalCost -= self._costs.pop(key)
+        return self._entries.pop(key)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,149 @@
+import logging
+import time
+from typing import Callable, Iterator, Optional, Tuple, Union
+
+import sqlalchemy as sql
+
+
+logger = logging.getLogger(__name__)
+
+MAINTAINED_TABLES = ["cards", "decks", "notes", "reviews"]
+ANALYSIS_LIMIT = 1000  # rows sampled per index by ANALYZE, keeps every table's analysis short
+VACUUM_STEP_PAGES = 256
+# existing databases need a full VACUUM to enable incremental vacuum, it is only done while it's quick
+AUTO_VACUUM_CONVERSION_LIMIT = 32 * 2**20
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+class DatabaseMaintenance:
+    """
+    DatabaseMaintenance runs database housekeeping in small steps, so it can be
+    interleaved with the GUI while the user is idle. A pass updates planner statistics,
+    returns free pages to the file system, checks integrity and checkpoints the WAL.
+    The integrity check and the conversion to incremental vacuum take as long as the database is large,
+    they are handed out by takeBackgroundStep() to run on a worker thread, the pass waits for them.
+    """
+    def __init__(self, engine: sql.engine.Engine, readerEngine: Optional[sql.engine.Engine] = None,
+                 sliceBudget: float = 0.05, interval: float = 60 * 60):
+        self._engine = engine
+        self._readerEngine = engine if readerEngine is None else readerEngine
+        self._sliceBudget = sliceBudget
+        self._interval = interval
+        self._steps: Optional[Iterator[Union[str, Callable[[], str]]]] = None
+        self._backgroundStep: Optional[Callable[[], str]] = None
+        self._inBackground = False
+        self._nextPass = 0.0
+        self._spent = 0.0
+        self._sizeBefore = 0
+
+    def requestPass(self) -> None:
+        """Schedules a pass as soon as possible, used after imports and large deletions"""
+        self._nextPass = 0.0
+
+    def isPending(self) -> bool:
+        return self._steps is not None or time.monotonic() >= self._nextPass
+
+    def takeBackgroundStep(self) -> Optional[Callable[[], str]]:
+        """
+        Returns the step the pass is waiting for, if any. The caller runs it on a worker thread
+        and calls backgroundStepDone() on the GUI thread once it finished, whether it succeeded or not.
+        """
+        step, self._backgroundStep = self._backgroundStep, None
+        self._inBackground = self._inBackground or step is not None
+        return step
+
+    def backgroundStepDone(self, step: Optional[str] = None) -> None:
+        self._inBackground = False
+        logger.debug("Maintenance step %s done", step)
+
+    def runSlice(self) -> bool:
+        """Runs maintenance steps until the time budget is used up, returns whether any work is left"""
+        if self._backgroundStep is not None or self._inBackground:
+            return True
+        start = time.monotonic()
+        if self._steps is None:
+            if start < self._nextPass:
+                return False
+            self._steps = self._runPass()
+            self._spent = 0.0
+            self._sizeBefore = self._fileSize()[0]
+        try:
+            while time.monotonic() - start < self._sliceBudget:
+                step = next(self._steps)
+                if callable(step):
+                    self._backgroundStep = step
+                    break
+                logger.debug("Maintenance step %s done", step)
+        except StopIteration:
+            self._finishPass()
+            return False
+        finally:
+            self._spent += time.monotonic() - start
+        return True
+
+    def _finishPass(self) -> None:
+        self._steps = None
+        self._nextPass = time.monotonic() + self._interval
+        sizeAfter, free = self._fileSize()
+        logger.info("Database maintenance reclaimed %d bytes in %.3fs, %d bytes still free",
+                    self._sizeBefore - sizeAfter, self._spent, free)
+
+    def _fileSize(self) -> Tuple[int, int]:
+        """Returns (size of the database, size of its free pages) in bytes"""
+        with self._engine.connect() as connection:
+            pageSize = connection.exec_driver_sql("PRAGMA page_size").scalar()
+            pageCount = connection.exec_driver_sql("PRAGMA page_count").scalar()
+            freePages = connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+        return pageSize * pageCount, pageSize * freePages
+
+    def _runPass(self) -> Iterator[Union[str, Callable[[], str]]]:
+        """
+        Generator doing one bounded unit of work per iteration, or yielding a step for a worker thread.
+        The engine has a single writer connection, so it's never held between iterations.
+        """
+        for table in MAINTAINED_TABLES:
+            with self._engine.connect() as connection:
+                connection.exec_driver_sql(f"PRAGMA analysis_limit={ANALYSIS_LIMIT}")
+                connection.exec_driver_sql(f"ANALYZE {table}")
+            yield f"analyze {table}"
+        with self._engine.connect() as connection:
+            connection.exec_driver_sql("PRAGMA optimize")
+        yield "optimize"
+        yield from self._vacuum()
+        yield self._checkIntegrity
+        with self._engine.connect() as connection:
+            connection.exec_driver_sql("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+        yield "wal_checkpoint"
+
+    def _vacuum(self) -> Iterator[str]:
+        with self._engine.connect() as connection:
+            converted = connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() == AUTO_VACUUM_INCREMENTAL
+        if not converted:
+            size, _ = self._fileSize()
+            if size > AUTO_VACUUM_CONVERSION_LIMIT:
+                logger.info("Incremental vacuum unavailable, database is too large to convert while idle")
+                return
+            yield self._convertToIncrementalVacuum
+        while True:
+            with self._engine.connect() as connection:
+                if connection.exec_driver_sql("PRAGMA freelist_count").scalar() == 0:
+                    return
+                # sqlite3 steps a statement without result rows only once, which frees a single page
+                connection.connection.executescript(f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})")
+            yield "incremental_vacuum"
+
+    def _convertToIncrementalVacuum(self) -> str:
+        """Rewrites the whole database, runs on a worker thread and holds the writer meanwhile"""
+        with self._engine.connect() as connection:
+            connection.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+            connection.exec_driver_sql("VACUUM")
+        return "convert to incremental vacuum"
+
+    def _checkIntegrity(self) -> str:
+        """Reads every page of the tables, runs on a worker thread on a reader connection"""
+        for table in MAINTAINED_TABLES:
+            with self._readerEngine.connect() as connection:
+                result = connection.exec_driver_sql(f"PRAGMA quick_check({table})").fetchall()
+            if result != [("ok",)]:
+                logger.error("Integrity check of table %s failed: %s", table, result)
+        return "quick_check"
@@ -0,0 +1,39 @@
+import os
+import re
+from typing import Iterable, List, Set
+
+from data.mediastore import MediaStore, MEDIA_SCHEME
+
+
+IMAGE_SOURCE = re.compile(r"""(<img\b[^>]*?\bsrc\s*=\s*)(["'])(.*?)\2""", re.IGNORECASE | re.DOTALL)
+URL_SCHEME = re.compile(r"^[A-Za-z][A-Za-z0-9+.-]+:")  # at least two letters, so Windows drives don't match
+MEDIA_REFERENCE = re.compile(MEDIA_SCHEME + r":([0-9a-f]{64}(?:\.[A-Za-z0-9]{1,8})?)")
+
+
+def mediaUrl(name: str) -> str:
+    return f"{MEDIA_SCHEME}:{name}"
+
+
+def extractImageSources(html: str) -> List[str]:
+    """Returns sources of all images in the html, in the order they appear"""
+    return [match.group(3) for match in IMAGE_SOURCE.finditer(html)]
+
+
+def extractMediaNames(texts: Iterable[str]) -> Set[str]:
+    """Returns names of all stored media referenced by the texts"""
+    names: Set[str] = set()
+    for text in texts:
+        if text:
+            names.update(MEDIA_REFERENCE.findall(text))
+    return names
+
+
+def internMedia(html: str, store: MediaStore) -> str:
+    """Copies local images referenced by the html into the store and points the references at it"""
+    def _intern(match):
+        source = match.group(3)
+        path = source[len("file://"):] if source.startswith("file://") else source
+        if URL_SCHEME.match(path) or not os.path.isfile(path):
+            return match.group(0)  # stored media, other URLs and missing files are kept as they are
+        return f"{match.group(1)}{match.group(2)}{mediaUrl(store.add(path))}{match.group(2)}"
+    return IMAGE_SOURCE.sub(_intern, html)
@@ -0,0 +1,19 @@
+import sys
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None  # type: ignore
+
+
+def currentRss() -> int:
+    """Returns resident set size of the process in bytes, 0 if it can't be measured"""
+    if resource is None:
+        return 0
+    try:
+        with open("/proc/self/statm", "r") as file:
+            return int(file.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # no procfs, fall back to the peak usage, reported in kilobytes on Linux and in bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
@@ -0,0 +1,95 @@
+import json
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import sqlalchemy.orm
+
+from data import dbmodel as dbm
+from data.dbmodel import Card, Deck, MetadataVersion
+
+
+VERSION_CHECK_INTERVAL = 1.0  # seconds between checks for changes made outside of the controller
+
+
+class CardInfo(NamedTuple):
+    """Card with its field list parsed, same columns as dbmodel.CARD_COLUMNS"""
+    c_id: int
+    c_name: str
+    c_fields: str
+    c_layout_f: str
+    c_layout_b: str
+    fields: List[str]
+
+
+class MetadataCache:
+    """
+    In-process cache of all cards and decks, they are few and read by almost every action.
+    The controller invalidates it after its own writes, other writers are noticed
+    through the version counter maintained by triggers, which is checked at most once per interval.
+    """
+    def __init__(self, factory: sqlalchemy.orm.sessionmaker, checkInterval: float = VERSION_CHECK_INTERVAL,
+                 clock: Callable[[], float] = time.monotonic):
+        self._factory = factory
+        self._checkInterval = checkInterval
+        self._clock = clock
+        self._version: Optional[int] = None
+        self._nextCheck = 0.0
+        self._cards: Dict[int, CardInfo] = {}
+        self._cardsByName: Dict[str, CardInfo] = {}
+        self._decks: Dict[int, tuple] = {}
+        self._decksByName: Dict[str, tuple] = {}
+
+    def invalidate(self) -> None:
+        self._version = None
+
+    def clear(self) -> None:
+        """Drops the cached rows, they are loaded again on next use"""
+        self.invalidate()
+        self._cards, self._cardsByName, self._decks, self._decksByName = {}, {}, {}, {}
+
+    def _ensureLoaded(self) -> None:
+        now = self._clock()
+        if self._version is not None and now < self._nextCheck:
+            return
+        with dbm.sessionScope(self._factory) as session:
+            version = session.query(MetadataVersion.version).filter(MetadataVersion.id == 1).scalar()
+            if version != self._version or version is None:
+                cards = session.query(*dbm.CARD_COLUMNS).order_by(Card.c_id).all()
+                decks = session.query(*dbm.DECK_COLUMNS).order_by(Deck.d_id).all()
+                self._cards = {card.c_id: CardInfo(*card, json.loads(card.c_fields)) for card in cards}
+                self._cardsByName = {card.c_name: card for card in self._cards.values()}
+                self._decks = {deck.d_id: deck for deck in decks}
+                self._decksByName = {deck.d_name: deck for deck in decks}
+                self._version = version if version is not None else -1
+        self._nextCheck = now + self._checkInterval
+
+    def card(self, c_id: int) -> Optional[CardInfo]:
+        self._ensureLoaded()
+        return self._cards.get(c_id)
+
+    def cardByName(self, name: str) -> Optional[CardInfo]:
+        self._ensureLoaded()
+        return self._cardsByName.get(name)
+
+    def cards(self) -> List[CardInfo]:
+        """Returns all cards ordered by c_id"""
+        self._ensureLoaded()
+        return list(self._cards.values())
+
+    def deck(self, d_id: int):
+        self._ensureLoaded()
+        return self._decks.get(d_id)
+
+    def deckByName(self, name: str):
+        self._ensureLoaded()
+        return self._decksByName.get(name)
+
+    def decks(self) -> list:
+        """Returns all decks ordered by d_id"""
+        self._ensureLoaded()
+        return list(self._decks.values())
+
+    def deckCard(self, d_id: int) -> Optional[CardInfo]:
+        """Returns card used by the deck"""
+        deck = self.deck(d_id)
+        return self._cards.get(deck.c_id) if deck else None
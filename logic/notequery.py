@@ -0,0 +1,188 @@
+"""
+Queries of the note browser: notes of a deck sorted and filtered by the database and read in keyset pages.
+Fields are compared through json_extract over n_data. A field sorted often gets an expression index
+on (d_id, field, n_id), so any page of it is read straight from the index, however deep it is.
+"""
+import json
+import re
+import time
+from collections import Counter
+from typing import List, NamedTuple, Optional, Union
+
+import sqlalchemy as sql
+import sqlalchemy.orm
+
+from data.dbmodel import Note, Review
+
+
+PAGE_SIZE = 200  # rows read per page, the browser asks for the next one when scrolled near the end
+INDEX_AFTER_SORTS = 3  # sorts by a column before it gets an index
+
+SORT_ID = "id"  # order of insertion
+SORT_DUE = "due"
+SORT_LAST = "last"
+SORT_REVIEWS = "reviews"
+
+_COMPARISON = re.compile(r"^\s*(<=|>=|<|>|=)?\s*(-?\d+)\s*$")
+
+
+class NoteQuery(NamedTuple):
+    """
+    Notes shown by the note browser
+    d_id            - deck of the notes
+    sort            - index of a field or one of SORT_ID, SORT_DUE, SORT_LAST, SORT_REVIEWS
+    descending      - sort order
+    filterColumn    - index of a field, SORT_DUE, SORT_LAST, SORT_REVIEWS or None for any field
+    filterText      - substring of fields, or a number with an optional comparison like "<7" for the other columns,
+                      due and last review take days from today
+    """
+    d_id: int
+    sort: Union[int, str] = SORT_ID
+    descending: bool = False
+    filterColumn: Union[int, str, None] = None
+    filterText: str = ""
+
+
+class NotePage(NamedTuple):
+    """
+    rows    - (n_id, fields, n_next_r, n_last_r, review count) of the notes
+    nextKey - keyset of the following page, None on the last page
+    """
+    rows: List[tuple]
+    nextKey: Optional[tuple]
+
+
+def _fieldSql(idx: int) -> str:
+    return f"coalesce(json_extract(n_data, '$[{int(idx)}]'), '') COLLATE NOCASE"
+
+
+def fieldExpression(idx: int):
+    """Sort key of a field, rendered literally so SQLite matches it with the expression index"""
+    return sql.literal_column(_fieldSql(idx))
+
+
+def _reviewCount():
+    return sql.select(sql.func.count(Review.r_id)).where(Review.n_id == Note.n_id).scalar_subquery()
+
+
+def sortExpression(sort: Union[int, str]):
+    if isinstance(sort, int):
+        return fieldExpression(sort)
+    return {SORT_ID: Note.n_id, SORT_DUE: Note.n_next_r, SORT_LAST: Note.n_last_r, SORT_REVIEWS: _reviewCount()}[sort]
+
+
+def parseComparison(text: str) -> tuple:
+    """Splits "<=7" into ("<=", 7), a number alone compares for equality, raises ValueError otherwise"""
+    match = _COMPARISON.match(text)
+    if match is None:
+        raise ValueError(f"Filter \"{text}\" isn't a number with an optional comparison like >3")
+    return match.group(1) or "=", int(match.group(2))
+
+
+def _compare(expression, operator: str, value):
+    return {"<": expression < value, "<=": expression <= value, ">": expression > value,
+            ">=": expression >= value, "=": expression == value}[operator]
+
+
+def _dayClause(column, operator: str, day: int, timeNow: int):
+    """Day number 0 is today, the clause compares the timestamps so ix_n_d_id_next_r still serves due dates"""
+    today = time.localtime(timeNow)
+    start = int(time.mktime((today.tm_year, today.tm_mon, today.tm_mday + day, 0, 0, 0, 0, 0, -1)))
+    end = int(time.mktime((today.tm_year, today.tm_mon, today.tm_mday + day + 1, 0, 0, 0, 0, 0, -1)))
+    return {"<": column < start, "<=": column < end, ">": column >= end, ">=": column >= start,
+            "=": sql.and_(column >= start, column < end)}[operator]
+
+
+def _likePattern(text: str) -> str:
+    return "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def _filterClause(query: NoteQuery, fieldCount: int, timeNow: int):
+    if not query.filterText:
+        return None
+    if query.filterColumn is None:
+        pattern = _likePattern(query.filterText)
+        fields = sql.or_(*(fieldExpression(idx).like(pattern, escape="\\") for idx in range(fieldCount)))
+        if json.dumps(query.filterText)[1:-1] != query.filterText:
+            return fields
+        # text JSON stores verbatim is matched against the raw n_data first, which is much cheaper than json_extract
+        return sql.and_(Note.n_data.like(pattern, escape="\\"), fields)
+    if isinstance(query.filterColumn, int):
+        return fieldExpression(query.filterColumn).like(_likePattern(query.filterText), escape="\\")
+    operator, value = parseComparison(query.filterText)
+    if query.filterColumn == SORT_REVIEWS:
+        return _compare(_reviewCount(), operator, value)
+    column = Note.n_next_r if query.filterColumn == SORT_DUE else Note.n_last_r
+    return _dayClause(column, operator, value, timeNow)
+
+
+def fetchNotePage(session: sqlalchemy.orm.Session, query: NoteQuery, fieldCount: int, after: Optional[tuple] = None,
+                  limit: int = PAGE_SIZE, timeNow: Optional[int] = None) -> NotePage:
+    """
+    Reads the page following the keyset after, the first page when it's None.
+    Pages are ordered by the sort column and n_id, so every page costs the same at any depth,
+    except sorting by review count which is computed for every note of the deck.
+    """
+    timeNow = int(time.time()) if timeNow is None else timeNow
+    sortKey = sortExpression(query.sort)
+    select = session.query(Note.n_id, Note.n_data, Note.n_next_r, Note.n_last_r, _reviewCount(),
+                           sortKey.label("sort_key")).filter(Note.d_id == query.d_id)
+    condition = _filterClause(query, fieldCount, timeNow)
+    if condition is not None:
+        select = select.filter(condition)
+    if after is not None and query.sort == SORT_ID:
+        select = select.filter(Note.n_id < after[1] if query.descending else Note.n_id > after[1])
+    elif after is not None:
+        # spelled out instead of a row value comparison, SQLite only takes the range of an expression index from
+        # a plain comparison of the expression
+        key, n_id = after
+        if query.descending:
+            select = select.filter(sortKey <= key, sql.or_(sortKey < key, Note.n_id < n_id))
+        else:
+            select = select.filter(sortKey >= key, sql.or_(sortKey > key, Note.n_id > n_id))
+    if query.descending:
+        select = select.order_by(sortKey.desc(), Note.n_id.desc())
+    else:
+        select = select.order_by(sortKey, Note.n_id)
+    page = select.limit(limit).all()
+    rows = [(n_id, json.loads(n_data), n_next_r, n_last_r, reviews)
+            for n_id, n_data, n_next_r, n_last_r, reviews, _ in page]
+    nextKey = (page[-1].sort_key, page[-1].n_id) if len(page) == limit else None
+    return NotePage(rows, nextKey)
+
+
+class SortIndexes:
+    """Counts sorts of the note browser by column, a column sorted often enough gets an index"""
+    def __init__(self, threshold: int = INDEX_AFTER_SORTS):
+        self._threshold = threshold
+        self._sorts: Counter = Counter()
+
+    @staticmethod
+    def indexDefinition(sort: Union[int, str]) -> Optional[tuple]:
+        """Name and columns of the index serving the sort, None when it needs none or can't have one"""
+        if isinstance(sort, int):
+            return f"ix_n_d_id_field{int(sort)}", f"d_id, {_fieldSql(sort)}, n_id"
+        if sort == SORT_LAST:
+            return "ix_n_d_id_last_r", "d_id, n_last_r"
+        if sort == SORT_ID:
+            return "ix_n_d_id_n_id", "d_id, n_id"
+        # ix_n_d_id_next_r serves the due date, review counts are computed
+        return None
+
+    def noteSorted(self, sort: Union[int, str]) -> Optional[tuple]:
+        """
+        Records a sort by the column, returns the definition of its index when the column was sorted often enough.
+        The caller builds it by createSortIndex, sorts run without the index until it exists.
+        """
+        definition = self.indexDefinition(sort)
+        if definition is None:
+            return None
+        self._sorts[sort] += 1
+        return definition if self._sorts[sort] == self._threshold else None
+
+
+def createSortIndex(engine: sql.engine.Engine, definition: tuple) -> None:
+    """Builds the index of a sort, it reads all notes and holds the writer meanwhile, so it runs on a worker thread"""
+    name, columns = definition
+    with engine.begin() as connection:
+        connection.execute(sql.text(f"CREATE INDEX IF NOT EXISTS {name} ON notes ({columns})"))
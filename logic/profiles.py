@@ -0,0 +1,128 @@
+import json
+import os
+import re
+from typing import Dict, List
+
+from sqlalchemy.orm import sessionmaker
+
+from data import dbmodel as dbm
+from data.mediastore import MediaStore
+from data.migrations import BackfillRunner
+from logic.duecounts import DueCountTracker
+from logic.lrucache import LRUCache
+from logic.maintenance import DatabaseMaintenance
+from logic.metacache import MetadataCache
+from logic.snapshot import CollectionSnapshot
+
+
+PROFILES_PATH = "profiles.json"
+PROFILES_DIRECTORY = "profiles"
+DEFAULT_PROFILE = "Default"
+MAX_OPEN_PROFILES = 3  # profiles kept open, the least recently used one is closed
+PROFILE_NAME = re.compile(r"^[\w -]{1,40}$")
+
+
+class ProfileRegistry:
+    """
+    ProfileRegistry keeps names of the profiles and paths of their databases in a JSON file.
+    The default profile is the database the app always used, other profiles live in their own directories.
+    """
+    def __init__(self, path: str = PROFILES_PATH):
+        self._path = path
+        self._profiles: Dict[str, str] = {DEFAULT_PROFILE: dbm.DATABASE_PATH}
+        self._current = DEFAULT_PROFILE
+        if os.path.exists(path):
+            with open(path, "r") as file:
+                stored = json.load(file)
+            self._profiles.update(stored.get("profiles", {}))
+            if stored.get("current") in self._profiles:
+                self._current = stored["current"]
+
+    def names(self) -> List[str]:
+        return sorted(self._profiles, key=lambda name: (name != DEFAULT_PROFILE, name.lower()))
+
+    def databasePath(self, name: str) -> str:
+        return self._profiles[name]
+
+    def current(self) -> str:
+        return self._current
+
+    def setCurrent(self, name: str) -> None:
+        if name not in self._profiles:
+            raise KeyError(name)
+        self._current = name
+        self._save()
+
+    def add(self, name: str) -> None:
+        """Registers a new profile, its database is created when it's opened for the first time"""
+        name = name.strip()
+        if not PROFILE_NAME.match(name):
+            raise ValueError("Profile name can contain only letters, digits, spaces, - and _")
+        if name.lower() in (existing.lower() for existing in self._profiles):
+            raise ValueError("Profile already exists")
+        self._profiles[name] = os.path.join(PROFILES_DIRECTORY, name, "appdata.db")
+        self._save()
+
+    def _save(self) -> None:
+        temporary = f"{self._path}.tmp"
+        with open(temporary, "w") as file:
+            json.dump({"profiles": self._profiles, "current": self._current}, file, indent=2)
+        os.replace(temporary, self._path)
+
+
+class ProfileData:
+    """
+    Data layer of one profile: engines, session factories, metadata cache, due counts, stats snapshot,
+    maintenance, backfills of data migrations and media store.
+    The default profile reuses the engines created by dbmodel.
+    """
+    def __init__(self, databasePath: str):
+        self.databasePath = databasePath
+        if os.path.abspath(databasePath) == os.path.abspath(dbm.DATABASE_PATH):
+            self.engine, self.readerEngine = dbm.Engine, dbm.ReaderEngine
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(databasePath)), exist_ok=True)
+            self.engine = dbm.createEngine(f"sqlite:///{databasePath}")
+            dbm.prepareDatabase(self.engine)
+            self.readerEngine = dbm.createEngine(f"sqlite:///{databasePath}", readOnly=True,
+                                                 poolSize=dbm.READER_POOL_SIZE)
+        self.session = sessionmaker(bind=self.engine, expire_on_commit=False)
+        self.readSession = sessionmaker(bind=self.readerEngine, expire_on_commit=False)
+        self.metadata = MetadataCache(self.readSession)
+        self.dueCounts = DueCountTracker(self.readSession)
+        self.snapshot = CollectionSnapshot(f"{databasePath}.snapshot", self.readSession)
+        self.maintenance = DatabaseMaintenance(self.engine, self.readerEngine)
+        self.backfills = BackfillRunner(self.engine, dbm.MIGRATIONS)
+        self.mediaStore = MediaStore(os.path.join(os.path.dirname(os.path.abspath(databasePath)), "media"))
+
+    def release(self) -> None:
+        """Closes pooled connections, caches stay warm and connections are opened again on next use"""
+        self.engine.dispose()
+        self.readerEngine.dispose()
+
+    def close(self) -> None:
+        self.backfills.stop()
+        self.release()
+        self.metadata.clear()
+        self.snapshot.close()
+
+
+class ProfileManager:
+    """Opens profiles lazily and keeps the recently used ones open, so switching back to them is fast"""
+
+    def __init__(self, registry: ProfileRegistry, maxOpen: int = MAX_OPEN_PROFILES):
+        self.registry = registry
+        self._open = LRUCache(maxOpen, onEvict=lambda name, data: data.close())
+
+    def open(self, name: str) -> ProfileData:
+        data = self._open.get(name)
+        if data is None:
+            data = ProfileData(self.registry.databasePath(name))
+            self._open.put(name, data)
+        return data
+
+    def isOpen(self, name: str) -> bool:
+        return name in self._open
+
+    def closeAll(self) -> None:
+        self._open.clear()
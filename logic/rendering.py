@@ -0,0 +1,55 @@
+import re
+from functools import lru_cache
+from typing import List, Tuple, Dict
+
+from data.consts import HTML_TEMPLATE
+
+
+PLACEHOLDER = re.compile(r"\{\{(.+?)\}\}")
+
+
+def fillLayout(layout: str, fields: List[Tuple[str, str]]) -> str:
+    """Replaces {{Field}} placeholders in the layout with values of the note"""
+    layout = layout if layout else ""
+    for (field, value) in fields:
+        layout = layout.replace(f"{{{{{field}}}}}", f"{value}")
+    return layout
+
+
+def renderCard(front: str, back: str, fields: List[Tuple[str, str]], displayFront: bool) -> str:
+    """Renders full html of a card side for the note described by (field, value) pairs"""
+    front = fillLayout(front, fields)
+    if displayFront:
+        return HTML_TEMPLATE.replace("{{Body}}", front)
+    back = fillLayout(back, fields)
+    return HTML_TEMPLATE.replace("{{Body}}", back.replace("{{FrontSide}}", front))
+
+
+class CompiledLayout:
+    """Layout split once into literal text and placeholders, so it can be filled with many notes"""
+
+    def __init__(self, layout: str):
+        parts = PLACEHOLDER.split(layout if layout else "")
+        self._literals = parts[0::2]
+        self._names = parts[1::2]
+
+    def fill(self, values: Dict[str, str]) -> str:
+        """Same as fillLayout, placeholders without a value are kept"""
+        result = [self._literals[0]]
+        for name, literal in zip(self._names, self._literals[1:]):
+            result.append(values.get(name, f"{{{{{name}}}}}"))
+            result.append(literal)
+        return "".join(result)
+
+
+@lru_cache(maxsize=16)
+def compileLayout(layout: str) -> CompiledLayout:
+    return CompiledLayout(layout)
+
+
+def renderCompiled(front: CompiledLayout, back: CompiledLayout, values: Dict[str, str], displayFront: bool) -> str:
+    """renderCard for compiled layouts"""
+    frontHtml = front.fill(values)
+    if displayFront:
+        return HTML_TEMPLATE.replace("{{Body}}", frontHtml)
+    return HTML_TEMPLATE.replace("{{Body}}", back.fill(values).replace("{{FrontSide}}", frontHtml))
@@ -0,0 +1,286 @@
+"""
+Local JSON API for review clients, scripts and web pages on the same machine study through it
+instead of the Qt window. Scheduling is the one used by the app, through logic.scheduling.recordRatings,
+and cards are rendered by logic.rendering.renderCard like the flashcard page does.
+
+    GET  /decks                         {"decks": [{"d_id": ..., "d_name": ..., "due": count}]}
+    GET  /decks/<d_id>/due?limit=20     {"notes": [{"n_id": ..., "n_last_r": ..., "n_next_r": ...}]}
+    GET  /notes/<n_id>/card?side=front  {"n_id": ..., "deck": name, "html": ...}, side is front or back
+    POST /notes/<n_id>/rate             {"ease": 1 | 3 | 5} -> {"n_id": ..., "n_last_r": ..., "n_next_r": ...}
+
+The server runs on asyncio streams and speaks just enough HTTP/1.1 for keep-alive clients.
+Reads run on a bounded thread pool over the pooled reader connections. Ratings are queued and
+written by a single writer thread, the ratings arriving while one batch is written form the next batch,
+so a busy server commits many ratings per transaction without delaying a lone rating.
+The app doesn't see ratings made here until its due counts are reloaded, open the deck list again.
+
+    python -m logic.reviewapi appdata.db --port 8766 --workers 4
+"""
+import argparse
+import asyncio
+import json
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import sqlalchemy as sql
+from sqlalchemy.orm import sessionmaker
+
+from data import dbmodel as dbm
+from data.dbmodel import Note
+from logic.metacache import MetadataCache
+from logic.rendering import renderCard
+from logic.scheduling import RatedNote, recordRatings
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8766
+DEFAULT_WORKERS = 4
+MAX_BATCH = 256  # ratings committed in one transaction
+MAX_DUE_LIMIT = 500
+MAX_BODY = 64 * 1024
+RATES = (1, 3, 5)
+
+
+class ApiError(Exception):
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class RatingBatcher:
+    """Queues ratings and writes them in batches on a single writer thread"""
+
+    def __init__(self, factory: sessionmaker, maxBatch: int = MAX_BATCH):
+        self._factory = factory
+        self._maxBatch = maxBatch
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="api-writer")
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.ratings = 0
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._writer.shutdown()
+
+    async def rate(self, n_id: int, rate: int) -> Optional[RatedNote]:
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((n_id, rate, int(time.time()), future))
+        return await future
+
+    def _write(self, ratings: List[Tuple[int, int, int]]) -> List[Optional[RatedNote]]:
+        with dbm.sessionScope(self._factory) as session:
+            return recordRatings(session, ratings)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self._maxBatch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                results = await loop.run_in_executor(self._writer, self._write,
+                                                     [(n_id, rate, ratedAt) for n_id, rate, ratedAt, _ in batch])
+            except Exception as exception:  # the whole transaction was rolled back
+                logger.exception("Rating batch of %d failed", len(batch))
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(exception)
+                continue
+            self.batches += 1
+            self.ratings += len(batch)
+            for (*_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+class ReviewApi:
+    """Routes requests of the review clients, reads run on the thread pool, ratings go through the batcher"""
+
+    ROUTES = [
+        ("GET", re.compile(r"^/decks$"), "_getDecks"),
+        ("GET", re.compile(r"^/decks/(\d+)/due$"), "_getDue"),
+        ("GET", re.compile(r"^/notes/(\d+)/card$"), "_getCard"),
+        ("POST", re.compile(r"^/notes/(\d+)/rate$"), "_postRate"),
+    ]
+
+    def __init__(self, databasePath: str, workers: int = DEFAULT_WORKERS, maxBatch: int = MAX_BATCH):
+        self.engine = dbm.createEngine(f"sqlite:///{databasePath}")
+        dbm.prepareDatabase(self.engine)
+        self.readerEngine = dbm.createEngine(f"sqlite:///{databasePath}", readOnly=True, poolSize=workers)
+        self._readSession = sessionmaker(bind=self.readerEngine, expire_on_commit=False)
+        self._readers = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api-reader")
+        self._metadata = MetadataCache(self._readSession)
+        self.batcher = RatingBatcher(sessionmaker(bind=self.engine, expire_on_commit=False), maxBatch)
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str = "localhost", port: int = DEFAULT_PORT) -> int:
+        """Starts listening, returns the port, which is chosen by the system when port is 0"""
+        self.batcher.start()
+        self._server = await asyncio.start_server(self._serve, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        await self.batcher.stop()
+        self._readers.shutdown()
+        self.engine.dispose()
+        self.readerEngine.dispose()
+
+    # HTTP
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                requestLine = await reader.readline()
+                if not requestLine:
+                    break
+                method, target, version = requestLine.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY:
+                    raise ValueError("request body too large")
+                body = await reader.readexactly(length) if length else b""
+                status, payload = await self._dispatch(method, target, body)
+                keepAlive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                data = json.dumps(payload).encode("utf-8")
+                head = f"HTTP/1.1 {status.value} {status.phrase}\r\nContent-Type: application/json\r\n" \
+                       f"Content-Length: {len(data)}\r\n"
+                if not keepAlive:
+                    head += "Connection: close\r\n"
+                writer.write(head.encode("latin-1") + b"\r\n" + data)
+                await writer.drain()
+                if not keepAlive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass  # malformed requests just close the connection
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method: str, target: str, body: bytes) -> Tuple[HTTPStatus, dict]:
+        url = urlsplit(target)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            for routeMethod, pattern, handler in self.ROUTES:
+                match = pattern.match(url.path)
+                if match is None:
+                    continue
+                if method != routeMethod:
+                    raise ApiError(HTTPStatus.METHOD_NOT_ALLOWED, f"use {routeMethod}")
+                payload = json.loads(body) if body else {}
+                return HTTPStatus.OK, await getattr(self, handler)(*map(int, match.groups()), query, payload)
+            raise ApiError(HTTPStatus.NOT_FOUND, "unknown path")
+        except ApiError as error:
+            return error.status, {"error": str(error)}
+        except (ValueError, KeyError, TypeError) as error:
+            return HTTPStatus.BAD_REQUEST, {"error": str(error)}
+        except Exception:
+            logger.exception("%s %s failed", method, target)
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "internal error"}
+
+    def _read(self, function, *args):
+        return asyncio.get_running_loop().run_in_executor(self._readers, function, *args)
+
+    # handlers
+
+    async def _getDecks(self, query: dict, payload: dict) -> dict:
+        return await self._read(self._loadDecks, int(time.time()))
+
+    def _loadDecks(self, timeNow: int) -> dict:
+        with dbm.sessionScope(self._readSession) as session:
+            due = dict(session.query(Note.d_id, sql.func.count(Note.n_id))
+                       .filter(Note.n_next_r <= timeNow).group_by(Note.d_id).all())
+        return {"decks": [{"d_id": deck.d_id, "d_name": deck.d_name, "due": due.get(deck.d_id, 0)}
+                          for deck in self._metadata.decks()]}
+
+    async def _getDue(self, d_id: int, query: dict, payload: dict) -> dict:
+        limit = min(int(query.get("limit", 20)), MAX_DUE_LIMIT)
+        return await self._read(self._loadDue, d_id, limit, int(time.time()))
+
+    def _loadDue(self, d_id: int, limit: int, timeNow: int) -> dict:
+        if self._metadata.deck(d_id) is None:
+            raise ApiError(HTTPStatus.NOT_FOUND, f"no deck {d_id}")
+        with dbm.sessionScope(self._readSession) as session:
+            # the first page of logic.duequeue.scanDueNotes, in the same order
+            notes = session.query(*dbm.QUEUE_COLUMNS).filter(Note.d_id == d_id, Note.n_next_r <= timeNow) \
+                .order_by(Note.n_next_r, Note.n_id).limit(limit).all()
+        return {"notes": [{"n_id": note.n_id, "n_last_r": note.n_last_r, "n_next_r": note.n_next_r}
+                          for note in notes]}
+
+    async def _getCard(self, n_id: int, query: dict, payload: dict) -> dict:
+        side = query.get("side", "front")
+        if side not in ("front", "back"):
+            raise ValueError("side is front or back")
+        return await self._read(self._renderCard, n_id, side == "front")
+
+    def _renderCard(self, n_id: int, displayFront: bool) -> dict:
+        with dbm.sessionScope(self._readSession) as session:
+            note = session.query(Note.n_data, Note.d_id).filter(Note.n_id == n_id).one_or_none()
+        if note is None:
+            raise ApiError(HTTPStatus.NOT_FOUND, f"no note {n_id}")
+        deck, card = self._metadata.deck(note.d_id), self._metadata.deckCard(note.d_id)
+        fields = list(zip(card.fields, json.loads(note.n_data)))
+        return {"n_id": n_id, "deck": deck.d_name,
+                "html": renderCard(card.c_layout_f, card.c_layout_b, fields, displayFront)}
+
+    async def _postRate(self, n_id: int, query: dict, payload: dict) -> dict:
+        rate = payload.get("ease")
+        if rate not in RATES:
+            raise ValueError(f"ease is one of {', '.join(map(str, RATES))}")
+        rated = await self.batcher.rate(n_id, rate)
+        if rated is None:
+            raise ApiError(HTTPStatus.NOT_FOUND, f"no note {n_id}")
+        return {"n_id": n_id, "n_last_r": rated.new[0], "n_next_r": rated.new[1]}
+
+
+async def serve(databasePath: str, host: str, port: int, workers: int) -> None:
+    api = ReviewApi(databasePath, workers)
+    port = await api.start(host, port)
+    logger.info("Serving %s on %s:%d", databasePath, host, port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("database", help="collection served to clients")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="threads and connections for reads")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    dbm.Engine.echo = dbm.ReaderEngine.echo = False
+    try:
+        asyncio.run(serve(args.database, args.host, args.port, args.workers))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+from typing import List, NamedTuple, Optional, Tuple
+
+import sqlalchemy as sql
+import sqlalchemy.orm
+
+from data.dbmodel import Note, Review
+
+
+FIRST_INTERVAL = 60 * 60  # interval used for the first review of a note, in seconds
+BASE_RATE = 3  # rating which keeps the interval unchanged
+LOOKUP_CHUNK = 500  # notes read per statement by recordRatings
+
+
+def intervalMultiplier(rate: int) -> float:
+    """Returns how much the interval between reviews grows for a given rating"""
+    return rate / BASE_RATE
+
+
+def isFirstReview(last_r: int, next_r: int) -> bool:
+    """Checks whether note has never been reviewed"""
+    return last_r == 0 or next_r == 0
+
+
+def computeNextReview(last_r: int, next_r: int, rate: int, currentT: int) -> Tuple[int, int]:
+    """
+    Computes new (n_last_r, n_next_r) pair for a note rated at time currentT
+    last_r      - previous time of the last review of the note
+    next_r      - previous time of the next review of the note
+    rate        - rating given by the user
+    currentT    - time of the review
+    """
+    if isFirstReview(last_r, next_r):
+        return max(currentT, 0), max((currentT + int(FIRST_INTERVAL * intervalMultiplier(rate))), 0)
+    return currentT, currentT + int((next_r - last_r) * intervalMultiplier(rate))
+
+
+class RatedNote(NamedTuple):
+    """Schedule of a note before and after a rating"""
+    n_id: int
+    d_id: int
+    old: Tuple[int, int]  # (n_last_r, n_next_r)
+    new: Tuple[int, int]
+
+
+def recordRatings(session: sqlalchemy.orm.Session, ratings: List[Tuple[int, int, int]]) -> List[Optional[RatedNote]]:
+    """
+    Schedules rated notes and logs their reviews, ratings are (n_id, rate, currentT) applied in order,
+    so a note rated twice is scheduled from its first rating. The schedules are read in the same transaction,
+    notes and reviews are written by one statement each. Returns None for notes which don't exist.
+    """
+    ids = sorted({n_id for n_id, _, _ in ratings})
+    schedules = {}
+    for start in range(0, len(ids), LOOKUP_CHUNK):
+        rows = session.query(Note.n_id, Note.d_id, Note.n_last_r, Note.n_next_r) \
+            .filter(Note.n_id.in_(ids[start:start + LOOKUP_CHUNK])).all()
+        schedules.update((row.n_id, (row.d_id, (row.n_last_r, row.n_next_r))) for row in rows)
+    results, reviews = [], []
+    for n_id, rate, currentT in ratings:
+        if n_id not in schedules:
+            results.append(None)
+            continue
+        d_id, old = schedules[n_id]
+        new = computeNextReview(*old, rate, currentT)
+        schedules[n_id] = (d_id, new)
+        results.append(RatedNote(n_id, d_id, old, new))
+        reviews.append({"r_ease": rate, "n_id": n_id})
+    if reviews:
+        session.execute(sql.insert(Review), reviews)
+        session.execute(sql.update(Note).where(Note.n_id == sql.bindparam("b_id")).values(
+            n_last_r=sql.bindparam("b_last"), n_next_r=sql.bindparam("b_next")),
+            [{"b_id": n_id, "b_last": new[0], "b_next": new[1]} for n_id, (_, new) in schedules.items()])
+    return results
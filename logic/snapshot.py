@@ -0,0 +1,251 @@
+"""
+Columnar snapshot of the scheduling and review columns, kept next to the database as fixed-width binary files.
+Every column is a file of little-endian integers, header.json holds the row counts and the position
+in the review log the snapshot is current up to. Columns are memory-mapped, analytics read them without queries.
+
+Ratings are the only way the app reschedules notes, and every rating logs a review,
+so a refresh reads reviews logged since the last one and reloads the schedule of their notes,
+new notes are appended. Deletions and syncs, which change notes without logging reviews,
+are noticed by new graves and by the change sequence of the collection and cause a full rebuild.
+"""
+import itertools
+import json
+import os
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import sqlalchemy as sql
+import sqlalchemy.orm
+
+from data import dbmodel as dbm
+
+
+FORMAT_VERSION = 1
+BUILD_PAGE_SIZE = 100000  # rows read per query while the snapshot is built
+LOOKUP_CHUNK = 500  # notes reloaded per query during a refresh
+
+NOTE_COLUMNS = {"n_id": "<i8", "d_id": "<i8", "n_last_r": "<i8", "n_next_r": "<i8"}
+REVIEW_COLUMNS = {"r_id": "<i8", "n_id": "<i8", "r_ease": "<i1"}
+
+
+class NoteColumns(NamedTuple):
+    """Columns of the notes table ordered by n_id"""
+    n_id: np.ndarray
+    d_id: np.ndarray
+    n_last_r: np.ndarray
+    n_next_r: np.ndarray
+
+
+class ReviewColumns(NamedTuple):
+    """Columns of the reviews table ordered by r_id"""
+    r_id: np.ndarray
+    n_id: np.ndarray
+    r_ease: np.ndarray
+
+
+def _columns(rows: list, width: int) -> np.ndarray:
+    """Turns result rows into a 2D array with one row per column, flattened first as numpy is slow with Row objects"""
+    values = np.fromiter(itertools.chain.from_iterable(rows), dtype=np.int64, count=len(rows) * width)
+    return values.reshape(-1, width).T
+
+
+class CollectionSnapshot:
+    """
+    Memory-mapped snapshot of one collection database.
+    refresh() brings it up to date, arrays returned by notes() and reviews() stay valid until the next refresh.
+    """
+    def __init__(self, directory: str, factory: sqlalchemy.orm.sessionmaker):
+        self._directory = directory
+        self._factory = factory
+        self._lock = threading.Lock()  # stats are loaded by worker threads
+        self._header: Optional[dict] = None
+        self._stale = False  # notes changed without a review, the next refresh rebuilds
+        self._notes: Optional[NoteColumns] = None
+        self._reviews: Optional[ReviewColumns] = None
+
+    # files
+
+    def _columnPath(self, table: str, column: str) -> str:
+        return os.path.join(self._directory, f"{table}.{column}.bin")
+
+    def _headerPath(self) -> str:
+        return os.path.join(self._directory, "header.json")
+
+    def _readHeader(self) -> Optional[dict]:
+        try:
+            with open(self._headerPath(), "r") as file:
+                header = json.load(file)
+        except (OSError, ValueError):
+            return None
+        return header if header.get("version") == FORMAT_VERSION else None
+
+    def _writeHeader(self, header: dict) -> None:
+        """The header is written last and atomically, bytes past the counts it records are ignored"""
+        temporary = self._headerPath() + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump(header, file)
+        os.replace(temporary, self._headerPath())
+        self._header = header
+        self._notes = self._reviews = None
+
+    def _map(self, table: str, columns: Dict[str, str], count: int, writable: bool = False) -> List[np.ndarray]:
+        arrays = []
+        for column, dtype in columns.items():
+            if count == 0:
+                arrays.append(np.empty(0, dtype=dtype))
+            else:
+                arrays.append(np.memmap(self._columnPath(table, column), dtype=dtype,
+                                        mode="r+" if writable else "r", shape=(count,)))
+        return arrays
+
+    def _append(self, table: str, columns: Dict[str, str], count: int, rows: np.ndarray) -> None:
+        """Writes rows, one column per row of the 2D array, after the first count values of every column"""
+        for idx, (column, dtype) in enumerate(columns.items()):
+            with open(self._columnPath(table, column), "r+b") as file:
+                file.seek(count * np.dtype(dtype).itemsize)
+                file.truncate()
+                rows[idx].astype(dtype).tofile(file)
+
+    # access
+
+    def notes(self) -> NoteColumns:
+        with self._lock:
+            if self._notes is None:
+                self._ensureHeader()
+                self._notes = NoteColumns(*self._map("notes", NOTE_COLUMNS, self._header["notes"]))
+            return self._notes
+
+    def reviews(self) -> ReviewColumns:
+        with self._lock:
+            if self._reviews is None:
+                self._ensureHeader()
+                self._reviews = ReviewColumns(*self._map("reviews", REVIEW_COLUMNS, self._header["reviews"]))
+            return self._reviews
+
+    def deckSchedule(self, d_id: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns (n_last_r, n_next_r) of all notes, or notes of a single deck"""
+        notes = self.notes()
+        if d_id is None:
+            return notes.n_last_r, notes.n_next_r
+        inDeck = notes.d_id == d_id
+        return notes.n_last_r[inDeck], notes.n_next_r[inDeck]
+
+    def easeCounts(self, d_id: Optional[int] = None) -> Dict[int, int]:
+        """Counts reviews by rating, of the whole collection or of notes of a single deck"""
+        eases = self.reviews().r_ease
+        if d_id is not None:
+            notes = self.notes()
+            eases = eases[np.isin(self.reviews().n_id, notes.n_id[notes.d_id == d_id])]
+        values, counts = np.unique(eases, return_counts=True)
+        return {int(ease): int(count) for ease, count in zip(values, counts)}
+
+    def noteEases(self, n_id: int) -> np.ndarray:
+        reviews = self.reviews()
+        return reviews.r_ease[reviews.n_id == n_id]
+
+    def close(self) -> None:
+        """Drops the mappings, they are opened again on next use"""
+        with self._lock:
+            self._notes = self._reviews = None
+
+    def _ensureHeader(self) -> None:
+        if self._header is None:
+            self._header = self._readHeader()
+        if self._header is None:
+            self._build()
+
+    # updates
+
+    @staticmethod
+    def _state(session: sqlalchemy.orm.Session) -> dict:
+        """Markers of the collection, all of them are primary key lookups"""
+        return dict(session.execute(sql.text(
+            "SELECT (SELECT seq FROM sync_state WHERE id = 1) AS seq, "
+            "(SELECT coalesce(max(g_id), 0) FROM graves) AS lastGrave, "
+            "(SELECT coalesce(max(n_id), 0) FROM notes) AS lastNote"
+        )).one()._mapping)
+
+    def refresh(self) -> None:
+        """Applies reviews logged since the last refresh, rebuilds the snapshot when that isn't enough"""
+        with self._lock:
+            if self._header is None:
+                self._header = self._readHeader()
+            if self._header is None or self._stale or not self._update():
+                self._build()
+
+    def rebuild(self) -> None:
+        with self._lock:
+            self._build()
+
+    def invalidate(self) -> None:
+        """Marks the snapshot out of date after notes were moved or rescheduled without logging reviews"""
+        with self._lock:
+            self._stale = True
+
+    def _build(self) -> None:
+        os.makedirs(self._directory, exist_ok=True)
+        with dbm.sessionScope(self._factory) as session:
+            state = self._state(session)
+            notes = self._readPages(session, "SELECT n_id, d_id, n_last_r, n_next_r FROM notes", "n_id", 4)
+            reviews = self._readPages(session, "SELECT r_id, n_id, r_ease FROM reviews", "r_id", 3)
+        # columns are written beside the old ones and swapped in, arrays still mapping the old files stay valid
+        for table, columns, rows in [("notes", NOTE_COLUMNS, notes), ("reviews", REVIEW_COLUMNS, reviews)]:
+            for idx, (column, dtype) in enumerate(columns.items()):
+                path = self._columnPath(table, column)
+                rows[idx].astype(dtype).tofile(path + ".tmp")
+                os.replace(path + ".tmp", path)
+        lastReview = int(reviews[0][-1]) if reviews.shape[1] else 0
+        self._writeHeader(dict(state, version=FORMAT_VERSION, notes=notes.shape[1], reviews=reviews.shape[1],
+                               lastReview=lastReview))
+        self._stale = False
+
+    @staticmethod
+    def _readPages(session: sqlalchemy.orm.Session, select: str, key: str, width: int) -> np.ndarray:
+        """Reads the table by keyset pages into a 2D array with one row per column"""
+        pages, lastKey = [_columns([], width)], 0
+        statement = sql.text(f"{select} WHERE {key} > :last ORDER BY {key} LIMIT :limit")
+        while True:
+            page = session.execute(statement, {"last": lastKey, "limit": BUILD_PAGE_SIZE}).fetchall()
+            if not page:
+                break
+            pages.append(_columns(page, width))
+            lastKey = page[-1][0]
+        return np.concatenate(pages, axis=1)
+
+    def _update(self) -> bool:
+        """Applies new reviews and notes, returns False when the snapshot has to be rebuilt"""
+        header = self._header
+        with dbm.sessionScope(self._factory) as session:
+            state = self._state(session)
+            if state["seq"] != header["seq"] or state["lastGrave"] != header["lastGrave"]:  # synced or deleted
+                return False
+            reviews = _columns(session.execute(sql.text(
+                "SELECT r_id, n_id, r_ease FROM reviews WHERE r_id > :last ORDER BY r_id"
+            ), {"last": header["lastReview"]}).fetchall(), 3)
+            newNotes = _columns(session.execute(sql.text(
+                "SELECT n_id, d_id, n_last_r, n_next_r FROM notes WHERE n_id > :last ORDER BY n_id"
+            ), {"last": header["lastNote"]}).fetchall(), 4)
+            reviewed = np.unique(reviews[1])
+            reviewed = reviewed[reviewed <= header["lastNote"]].tolist()
+            rescheduled = []
+            for start in range(0, len(reviewed), LOOKUP_CHUNK):
+                rescheduled += session.execute(sql.text(
+                    "SELECT n_id, n_last_r, n_next_r FROM notes WHERE n_id IN :ids"
+                ).bindparams(sql.bindparam("ids", expanding=True)), {"ids": reviewed[start:start + LOOKUP_CHUNK]}).fetchall()
+        if not reviews.shape[1] and not newNotes.shape[1]:
+            return True
+        if rescheduled:
+            rescheduled = _columns(rescheduled, 3)
+            n_id, _, n_last_r, n_next_r = self._map("notes", NOTE_COLUMNS, header["notes"], writable=True)
+            positions = np.searchsorted(n_id, rescheduled[0])
+            n_last_r[positions] = rescheduled[1]
+            n_next_r[positions] = rescheduled[2]
+            n_last_r.flush()
+            n_next_r.flush()
+        self._append("notes", NOTE_COLUMNS, header["notes"], newNotes)
+        self._append("reviews", REVIEW_COLUMNS, header["reviews"], reviews)
+        lastReview = int(reviews[0][-1]) if reviews.shape[1] else header["lastReview"]
+        self._writeHeader(dict(state, version=FORMAT_VERSION, notes=header["notes"] + newNotes.shape[1],
+                               reviews=header["reviews"] + reviews.shape[1], lastReview=lastReview))
+        return True
@@ -0,0 +1,158 @@
+"""
+Detects stalls of the GUI event loop. A heartbeat on the GUI thread calls beat() at a fixed interval,
+a monitor thread notices when the beat is late by more than the threshold and records the Python stack
+of the GUI thread while it is still blocked. The stall is attributed to the innermost controller method
+entered from outside the controller on that stack, the slot which blocked the loop: slots mostly run in the nested
+event loop of a modal dialog, so the method which opened the dialog is further down the same stack.
+Its length is known once the loop beats again.
+"""
+import linecache
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Callable, Deque, Dict, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+STALL_THRESHOLD = 0.2  # seconds the loop may be late before it counts as a stall
+HEARTBEAT_INTERVAL = 0.05  # seconds between beats
+MAX_STALLS = 1000  # stalls kept for the report, older ones are dropped
+UNKNOWN_SLOT = "(outside controller)"
+
+
+class Stall(NamedTuple):
+    """
+    One stall of the event loop
+    slot        - name of the controller method which blocked the loop
+    started     - time.time() of the last beat before the stall
+    duration    - seconds the loop was late
+    stack       - collapsed stack of the GUI thread, root first, empty when it wasn't captured in time
+    """
+    slot: str
+    started: float
+    duration: float
+    stack: str
+
+
+def _calls(caller, name: str, slotFile: str) -> bool:
+    """
+    Tells whether the caller frame called the function directly, rather than through an event loop running in C
+    like the exec() of a dialog, which leaves no frame between the caller and the slot
+    """
+    if caller is None or os.path.basename(caller.f_code.co_filename) != slotFile:
+        return False
+    line = linecache.getline(caller.f_code.co_filename, caller.f_lineno)
+    if not line:
+        return name in caller.f_code.co_names
+    return ("lambda" if name == "<lambda>" else name) in line
+
+
+class StallMonitor:
+    """Measures the lag of the heartbeat and collects stalls, beat() must be called from the monitored thread"""
+
+    def __init__(self, threshold: float = STALL_THRESHOLD, interval: float = HEARTBEAT_INTERVAL,
+                 slotFile: str = "controller.py", wrapperFiles: Tuple[str, ...] = ("actionprofiler.py",),
+                 clock: Callable[[], float] = time.perf_counter):
+        self.threshold = threshold
+        self.interval = interval
+        self._slotFile = slotFile
+        self._wrapperFiles = wrapperFiles
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._threadId: Optional[int] = None
+        self._lastBeat = clock()
+        self._beats = 0
+        self._pending: Optional[tuple] = None  # (beat, slot, stack) captured during the current stall
+        self._stalls: Deque[Stall] = deque(maxlen=MAX_STALLS)
+        self._monitor: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        self._threadId = threading.get_ident()
+        self._lastBeat = self._clock()
+        self._stop.clear()
+        self._monitor = threading.Thread(target=self._watch, name="stall-monitor", daemon=True)
+        self._monitor.start()
+
+    def stop(self) -> None:
+        if self._monitor is not None:
+            self._stop.set()
+            self._monitor.join()
+            self._monitor = None
+
+    def beat(self) -> None:
+        now = self._clock()
+        with self._lock:
+            lag = now - self._lastBeat - self.interval
+            pending = self._pending if self._pending is not None and self._pending[0] == self._beats else None
+            self._lastBeat = now
+            self._beats += 1
+            self._pending = None
+        if lag > self.threshold:
+            slot, stack = pending[1:] if pending is not None else (UNKNOWN_SLOT, "")
+            stall = Stall(slot, time.time() - lag - self.interval, lag, stack)
+            self._stalls.append(stall)
+            logger.warning("Event loop stalled for %.0f ms in %s", lag * 1000, slot)
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.interval / 2):
+            with self._lock:
+                late = self._clock() - self._lastBeat - self.interval > self.threshold
+                beat = self._beats
+                captured = self._pending is not None and self._pending[0] == beat
+            if late and not captured:
+                frame = sys._current_frames().get(self._threadId)
+                slot, stack = self._describe(frame)
+                with self._lock:
+                    if self._beats == beat:  # still the same stall
+                        self._pending = (beat, slot, stack)
+
+    def _describe(self, frame) -> tuple:
+        """Returns the slot and the collapsed stack of a frame"""
+        frames = []
+        while frame is not None:
+            frames.append(frame)
+            frame = frame.f_back
+        frames.reverse()
+        start, entered, caller = None, False, None
+        for idx, frame in enumerate(frames):
+            fileName = os.path.basename(frame.f_code.co_filename)
+            if fileName in self._wrapperFiles:
+                continue
+            if fileName == self._slotFile:
+                entered = entered or not _calls(caller, frame.f_code.co_name, self._slotFile)
+                # a lambda only connects the signal, the slot is the method it calls
+                if entered and not frame.f_code.co_name.startswith("<"):
+                    start, entered = idx, False
+            caller = frame
+        # the stack is cut above the slot, the event loop and the wrappers under it are the same every time
+        slot = UNKNOWN_SLOT if start is None else frames[start].f_code.co_name
+        return slot, ";".join(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}"
+                              for frame in frames[start or 0:])
+
+    def stalls(self) -> List[Stall]:
+        return list(self._stalls)
+
+    def report(self, stacks: int = 1) -> str:
+        """Summarizes stalls by slot, the slots which blocked the loop longest in total come first"""
+        bySlot: Dict[str, List[Stall]] = {}
+        for stall in self._stalls:
+            bySlot.setdefault(stall.slot, []).append(stall)
+        if not bySlot:
+            return f"No stalls longer than {self.threshold * 1000:.0f} ms"
+        lines = [f"{'slot':<32}{'stalls':>7}{'total ms':>10}{'median ms':>11}{'max ms':>9}"]
+        ordered = sorted(bySlot.items(), key=lambda item: -sum(stall.duration for stall in item[1]))
+        for slot, stalls in ordered:
+            durations = [stall.duration * 1000 for stall in stalls]
+            lines.append(f"{slot:<32}{len(stalls):>7}{sum(durations):>10.0f}"
+                         f"{statistics.median(durations):>11.0f}{max(durations):>9.0f}")
+        for slot, stalls in ordered:
+            common = Counter(stall.stack for stall in stalls if stall.stack).most_common(stacks)
+            for stack, count in common:
+                lines.append(f"\n{slot}, {count} of {len(stalls)} stalls in:")
+                lines.extend(f"    {frame}" for frame in stack.split(";"))
+        return "\n".join(lines)
@@ -1,9 +1,34 @@
 import time
-from typing import List
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
 
 from data.dbmodel import Note, Review
 
 
+ONE_DAY = 60 * 60 * 24
+BAR_DAYS = 31
+FORECAST_DAYS = 180  # longer than DOWNSAMPLE_POINTS of the chart, which reduces it with LTTB
+
+
+def noteMaturity(n_last_r: int, n_next_r: int) -> str:
+    """Returns maturity category of a note used by the deck pie chart"""
+    diff = n_last_r - n_next_r  # how mature is the note?
+    if diff <= ONE_DAY:
+        return "New"
+    elif ONE_DAY < diff <= ONE_DAY * 7:
+        return "Young"
+    elif ONE_DAY * 7 < diff <= ONE_DAY * 31:
+        return "Adult"
+    else:
+        return "Old"
+
+
+def noteDueDay(n_next_r: int, timeNow: int) -> int:
+    """Returns in how many days from now the note is due, 0 for notes due already"""
+    return max(0, n_next_r - timeNow) // ONE_DAY
+
+
 def prepareDeckDataPie(notes: List[Note]):
     maturity = {
         "New": 0,
@@ -12,31 +37,22 @@ def prepareDeckDataPie(notes: List[Note]):
         "Old" :0
     }
     for note in notes:
-        diff = note.n_last_r - note.n_next_r  # how mature is the note?
-        oneDay = 60 * 60 * 24
-        if diff <= oneDay:
-            maturity["New"] += 1
-        elif oneDay < diff <= oneDay * 7:
-            maturity["Young"] += 1
-        elif oneDay * 7 < diff <= oneDay * 31:
-            maturity["Adult"] += 1
-        else:
-            maturity["Old"] += 1
+        maturity[noteMaturity(note.n_last_r, note.n_next_r)] += 1
 
     return maturity.items()
 
 
-def prepareDeckDataBar(notes: List[Note]):
+def prepareDeckDataBar(notes: List[Note], timeNow: Optional[int] = None):
     daysFromNow = {}
-    oneDay = 60 * 60 * 24
+    timeNow = int(time.time()) if timeNow is None else timeNow
     for note in notes:
-        waitTimeDays = max(0, note.n_next_r - int(time.time())) // oneDay
+        waitTimeDays = noteDueDay(note.n_next_r, timeNow)
         if waitTimeDays in daysFromNow:
             daysFromNow[waitTimeDays] += 1
         else:
             daysFromNow[waitTimeDays] = 1
     preparedData = []
-    for i in range(0, 31):
+    for i in range(0, BAR_DAYS):
         if i in daysFromNow:
             preparedData.append(daysFromNow[i])
         else:
@@ -44,6 +60,31 @@ def prepareDeckDataBar(notes: List[Note]):
     return preparedData
 
 
+def prepareDeckDataColumns(n_last_r: np.ndarray, n_next_r: np.ndarray,
+                           timeNow: Optional[int] = None) -> Tuple[Dict[str, int], List[int]]:
+    """Vectorized prepareDeckDataPie and prepareDeckDataBar over schedule columns, returns (pie, bar)"""
+    timeNow = int(time.time()) if timeNow is None else timeNow
+    diff = np.asarray(n_last_r) - np.asarray(n_next_r)
+    category = np.digitize(diff, [ONE_DAY, ONE_DAY * 7, ONE_DAY * 31], right=True)
+    counts = np.bincount(category, minlength=4)
+    pie = {name: int(count) for name, count in zip(["New", "Young", "Adult", "Old"], counts)}
+    days = np.maximum(0, np.asarray(n_next_r) - timeNow) // ONE_DAY
+    bar = np.bincount(days[days < BAR_DAYS], minlength=BAR_DAYS)
+    return pie, bar.tolist()
+
+
+def updateDeckData(pie: Dict[str, int], bar: List[int], old: Tuple[int, int], new: Tuple[int, int]) -> None:
+    """Moves a rescheduled note between categories of the deck charts, old and new are (n_last_r, n_next_r)"""
+    timeNow = int(time.time())
+    pie[noteMaturity(*old)] -= 1
+    pie[noteMaturity(*new)] += 1
+    oldDay, newDay = noteDueDay(old[1], timeNow), noteDueDay(new[1], timeNow)
+    if oldDay < len(bar):
+        bar[oldDay] -= 1
+    if newDay < len(bar):
+        bar[newDay] += 1
+
+
 def prepareNoteDataPie(reviews: List[Review]):
     data = {}
     for review in reviews:
@@ -53,4 +94,10 @@ def prepareNoteDataPie(reviews: List[Review]):
         else:
             data[ease] = 1
 
-    return map(lambda t: (str(t[0]), t[1]), data.items())
\ No newline at end of file
+    return map(lambda t: (str(t[0]), t[1]), data.items())
+
+
+def prepareNoteDataColumns(r_ease: np.ndarray):
+    """Vectorized prepareNoteDataPie over the ratings of one note"""
+    eases, counts = np.unique(r_ease, return_counts=True)
+    return [(str(ease), int(count)) for ease, count in zip(eases, counts)]
@@ -0,0 +1,243 @@
+import heapq
+import itertools
+import time
+from array import array
+from typing import Callable, Iterator, List, NamedTuple, Optional, Tuple
+
+from logic.scheduling import isFirstReview
+
+
+ORDER_DUE = "due"
+ORDER_OVERDUE = "overdue"
+NEW_INTERVAL = 4  # reviews shown between two new notes
+LEARNING_DELAY = 10 * 60  # seconds before a failed note is shown again
+
+PULL_CHUNK = 32  # notes read ahead from the iterator, it's sorted so reading ahead keeps the order
+
+SOURCE_LEARNING, SOURCE_NEW, SOURCE_REVIEW = range(3)
+
+
+class QueuedNote(NamedTuple):
+    """Note as held by the queue, same columns as dbmodel.QUEUE_COLUMNS. Content is fetched when it's shown"""
+    n_id: int
+    n_last_r: int
+    n_next_r: int
+    d_id: int
+
+
+class NoteBuffer:
+    """
+    FIFO of queued notes stored column-wise in arrays of 64-bit integers, 32 bytes per note.
+    Notes are materialized as QueuedNote only when they are read.
+    """
+    __slots__ = ("_ids", "_last", "_next", "_decks", "_head")
+    COMPACT_AFTER = 4096  # popped slots kept before the arrays are shifted
+
+    def __init__(self):
+        self._ids, self._last, self._next, self._decks = array("q"), array("q"), array("q"), array("q")
+        self._head = 0
+
+    def _columns(self):
+        return self._ids, self._last, self._next, self._decks
+
+    def append(self, note: QueuedNote) -> None:
+        self._ids.append(note.n_id)
+        self._last.append(note.n_last_r)
+        self._next.append(note.n_next_r)
+        self._decks.append(note.d_id)
+
+    def appendleft(self, note: QueuedNote) -> None:
+        if self._head > 0:
+            self._head -= 1
+            for column, value in zip(self._columns(), note):
+                column[self._head] = value
+        else:
+            for column, value in zip(self._columns(), note):
+                column.insert(0, value)
+
+    def _note(self, idx: int) -> QueuedNote:
+        return QueuedNote(self._ids[idx], self._last[idx], self._next[idx], self._decks[idx])
+
+    def peek(self) -> QueuedNote:
+        if self._head >= len(self._ids):
+            raise IndexError("peek into an empty note buffer")
+        return self._note(self._head)
+
+    def popleft(self) -> QueuedNote:
+        head = self._head
+        if head >= len(self._ids):
+            raise IndexError("pop from an empty note buffer")
+        note = QueuedNote(self._ids[head], self._last[head], self._next[head], self._decks[head])
+        self._head = head + 1
+        if self._head >= self.COMPACT_AFTER and self._head * 2 >= len(self._ids):
+            for column in self._columns():
+                del column[:self._head]
+            self._head = 0
+        return note
+
+    def sort(self, key: Callable[[QueuedNote], float]) -> None:
+        """Reorders the remaining notes by the key, notes with equal keys keep their order"""
+        notes = sorted(self, key=key)
+        for column in self._columns():
+            del column[:]
+        self._head = 0
+        for note in notes:
+            self.append(note)
+
+    def __iter__(self) -> Iterator[QueuedNote]:
+        for idx in range(self._head, len(self._ids)):
+            yield self._note(idx)
+
+    def __len__(self) -> int:
+        return len(self._ids) - self._head
+
+    def nbytes(self) -> int:
+        """Memory held by the arrays, including popped slots not yet compacted"""
+        return sum(column.buffer_info()[1] * column.itemsize for column in self._columns())
+
+
+def overdueRatio(note, now: float) -> float:
+    """How many intervals of the note passed since it became due"""
+    return (now - note.n_next_r) / max(note.n_next_r - note.n_last_r, 1)
+
+
+class StudyQueue:
+    """
+    Priority queue of the notes of a study session.
+    Reviews are shown by due time or by overdue ratio, new notes are shown
+    after every newInterval reviews and failed notes return from a learning heap after a delay.
+    Notes come from an iterator sorted by due time, with the due order it is only read
+    as far as the next shown note, the overdue order needs all notes upfront.
+    Reviews and new notes are kept in compact buffers, the iterator already yields them in due order
+    and the overdue order is fixed once all notes are read.
+    """
+    def __init__(self, order: str = ORDER_DUE, newInterval: int = NEW_INTERVAL,
+                 learningDelay: int = LEARNING_DELAY, clock: Callable[[], float] = time.time):
+        self._order = order
+        self._newInterval = newInterval
+        self._learningDelay = learningDelay
+        self._clock = clock
+        self._sequence = itertools.count()  # ties are broken by arrival, so notes are never compared
+        self.clear()
+
+    def clear(self) -> None:
+        self._reviews = NoteBuffer()
+        self._new = NoteBuffer()
+        self._learning: List[Tuple[float, int, QueuedNote]] = []
+        self._pending: Iterator = iter(())
+        self._sinceNew = 0
+        self._remaining = 0
+        self._selected: Optional[int] = None  # source of the shown note, kept so pop returns what peek did
+
+    def fill(self, notes: Iterator, count: int, eager: bool = False) -> None:
+        """
+        Fills the queue from an iterator of rows with the columns of QueuedNote, sorted by due time.
+        Eager fill reads all rows at once, so the source can be released.
+        """
+        self.clear()
+        self._pending = iter(notes)
+        self._remaining = count
+        if eager or self._order == ORDER_OVERDUE:
+            self._pull()
+        if self._order == ORDER_OVERDUE:
+            now = self._clock()
+            self._reviews.sort(key=lambda note: -overdueRatio(note, now))
+
+    def _pull(self, limit: Optional[int] = None) -> int:
+        """Moves up to limit notes, all of them when it's None, from the iterator to the buffers"""
+        pulled = 0
+        for note in itertools.islice(self._pending, limit):
+            if isFirstReview(note.n_last_r, note.n_next_r):
+                self._new.append(note)
+            else:
+                self._reviews.append(note)
+            pulled += 1
+        return pulled
+
+    def _select(self, sinceNew: int) -> Optional[int]:
+        """Returns source of the next note, sinceNew is the number of reviews shown after the last new note"""
+        if self._learning and self._learning[0][0] <= self._clock():
+            return SOURCE_LEARNING
+        if self._new and sinceNew >= self._newInterval:
+            return SOURCE_NEW
+        # the iterator is sorted by due time, so a buffered review precedes all pending ones
+        while not self._reviews and self._pull(PULL_CHUNK):
+            pass
+        if self._reviews:
+            return SOURCE_REVIEW
+        if self._new:
+            return SOURCE_NEW
+        # nothing else to study, failed notes are shown before their delay passes
+        return SOURCE_LEARNING if self._learning else None
+
+    def _buffer(self, source: int) -> NoteBuffer:
+        return self._new if source == SOURCE_NEW else self._reviews
+
+    def _take(self, source: int):
+        if source == SOURCE_LEARNING:
+            return heapq.heappop(self._learning)
+        return self._buffer(source).popleft()
+
+    def _putBack(self, source: int, entry) -> None:
+        if source == SOURCE_LEARNING:
+            heapq.heappush(self._learning, entry)
+        else:
+            self._buffer(source).appendleft(entry)
+
+    def _head(self, source: int) -> QueuedNote:
+        if source == SOURCE_LEARNING:
+            return self._learning[0][2]
+        return self._buffer(source).peek()
+
+    def _advance(self, source: int, sinceNew: int) -> int:
+        if source == SOURCE_NEW:
+            return 0
+        return sinceNew + 1 if source == SOURCE_REVIEW else sinceNew
+
+    def _current(self) -> Optional[int]:
+        if self._selected is None:
+            self._selected = self._select(self._sinceNew)
+        return self._selected
+
+    def isEmpty(self) -> bool:
+        return self._current() is None
+
+    def peek(self) -> Optional[QueuedNote]:
+        source = self._current()
+        return None if source is None else self._head(source)
+
+    def peekFollowing(self) -> Optional[QueuedNote]:
+        """Returns the note shown after the next one, the queue is left unchanged"""
+        source = self._current()
+        if source is None:
+            return None
+        entry = self._take(source)
+        try:
+            following = self._select(self._advance(source, self._sinceNew))
+            return None if following is None else self._head(following)
+        finally:
+            self._putBack(source, entry)
+
+    def pop(self) -> QueuedNote:
+        source = self._current()
+        if source is None:
+            raise IndexError("pop from an empty study queue")
+        self._selected = None
+        self._sinceNew = self._advance(source, self._sinceNew)
+        self._remaining = max(self._remaining - 1, 0)
+        entry = self._take(source)
+        return entry[2] if source == SOURCE_LEARNING else entry
+
+    def relearn(self, note: QueuedNote) -> None:
+        """Shows the note again once the learning delay passes"""
+        heapq.heappush(self._learning, (self._clock() + self._learningDelay, next(self._sequence), note))
+        self._remaining += 1
+        self._selected = None
+
+    def nbytes(self) -> int:
+        """Memory held by the buffers of reviews and new notes"""
+        return self._reviews.nbytes() + self._new.nbytes()
+
+    def __len__(self) -> int:
+        # the count given to fill is only an estimate once notes are rated elsewhere
+        return 0 if self.isEmpty() else self._remaining
@@ -1,16 +1,28 @@
-from typing import Optional, List
+from typing import Optional, Dict, Iterator, List
 
 from data.dbmodel import Note, Deck, Card
+from logic.lrucache import LRUCache
+from logic.studyqueue import StudyQueue, QueuedNote, ORDER_DUE, NEW_INTERVAL, LEARNING_DELAY
+
+
+CONTENT_CACHE_SIZE = 4  # shown and prefetched notes whose content is kept
 
 
 class StudySession:
     """
-    StudySession contains the information regarding state of the study session
+    StudySession contains the information regarding state of the study session.
+    A session covers one deck, or several decks whose notes are merged by due time.
+    Notes may come from a lazy iterator, they are pulled only when they are about to be shown.
+    The queue holds only IDs and times, content of the shown and prefetched notes is kept aside.
     """
-    def __init__(self):
+    def __init__(self, order: str = ORDER_DUE, newInterval: int = NEW_INTERVAL, learningDelay: int = LEARNING_DELAY):
         self._currentCard: Optional[Card] = None
         self._currentDeck: Optional[Deck] = None
-        self._notesToStudy: list[Note] = []
+        self._merged = False
+        self._cards: Dict[int, Card] = {}  # template cache shared by all notes of the session
+        self._decks: Dict[int, Deck] = {}
+        self._notesToStudy = StudyQueue(order, newInterval, learningDelay)
+        self._content = LRUCache(CONTENT_CACHE_SIZE)
 
     def reset(self) -> None:
         """
@@ -18,30 +30,93 @@ class StudySession:
         """
         self._currentCard = None
         self._currentDeck = None
-        self._notesToStudy = []
+        self._merged = False
+        self._cards = {}
+        self._decks = {}
+        self._notesToStudy.clear()
+        self._content.clear()
 
-    def fill(self, card: Card, deck: Deck, notes: List[Note]) -> None:
+    def fill(self, card: Card, deck: Deck, notes: Iterator[Note], count: int) -> None:
+        """Fills the session with notes of one deck, they have to come sorted by due time"""
+        self.reset()
+        self._cards = {card.c_id: card}
+        self._decks = {deck.d_id: deck}
+        self._notesToStudy.fill(notes, count)
         self._currentCard = card
         self._currentDeck = deck
-        self._notesToStudy = notes[::-1]
+        self._merged = False
+
+    def fillMerged(self, cards: Dict[int, Card], decks: Dict[int, Deck], notes: Iterator[Note], count: int) -> None:
+        """
+        Fills the session with notes of several decks, cards and decks are keyed by their IDs.
+        Notes have to come sorted by due time, count is the number of notes the iterator yields.
+        """
+        self.reset()
+        self._merged = True
+        self._cards = cards
+        self._decks = decks
+        self._notesToStudy.fill(notes, count)
 
     def isActive(self) -> bool:
-        return self._currentDeck is not None and self._currentCard is not None
+        return self._merged or (self._currentDeck is not None and self._currentCard is not None)
+
+    def isMerged(self) -> bool:
+        return self._merged
 
     def isFinished(self) -> bool:
-        return self._notesToStudy == []
+        return self._notesToStudy.isEmpty()
+
+    def peekNextNote(self) -> QueuedNote:
+        return self._notesToStudy.peek()  # type: ignore
 
-    def peekNextNote(self) -> Note:
-        return self._notesToStudy[-1]
+    def peekFollowingNote(self) -> Optional[QueuedNote]:
+        """Returns the note coming after the next one, if there is any"""
+        return self._notesToStudy.peekFollowing()
 
-    def popNextNote(self) -> Note:
+    def popNextNote(self) -> QueuedNote:
         return self._notesToStudy.pop()
 
+    def relearnNote(self, note: QueuedNote, n_last_r: int, n_next_r: int) -> None:
+        """Puts a failed note back into the session with its new schedule"""
+        self._notesToStudy.relearn(note._replace(n_last_r=n_last_r, n_next_r=n_next_r))
+
+    def getContent(self, n_id: int) -> Optional[str]:
+        """Returns n_data of a shown or prefetched note, None when it wasn't fetched yet"""
+        return self._content.get(n_id)
+
+    def setContent(self, n_id: int, n_data: str) -> None:
+        self._content.put(n_id, n_data)
+
+    def forgetContent(self, n_id: int) -> None:
+        """Drops content of an edited note, it's fetched again when shown"""
+        self._content.pop(n_id)
+
+    def updateTemplates(self, cards: Dict[int, Card], decks: Dict[int, Deck]) -> None:
+        """
+        Replaces cards and decks of the session after they were edited, keyed by their IDs.
+        Their notes may have been remapped to new fields, so cached content is fetched again.
+        """
+        self._cards = cards
+        self._decks = decks
+        if self._currentDeck is not None and self._currentDeck.d_id in decks:
+            self._currentDeck = decks[self._currentDeck.d_id]
+            self._currentCard = cards[self._currentDeck.c_id]
+        self._content.clear()
+
+    def getDeckIds(self) -> List[int]:
+        return list(self._decks)
+
     def getCard(self) -> Optional[Card]:
         return self._currentCard
 
     def getDeck(self) -> Optional[Deck]:
         return self._currentDeck
 
+    def getNoteCard(self, note: Note) -> Card:
+        return self._cards[self._decks[note.d_id].c_id]
+
+    def getNoteDeck(self, note: Note) -> Deck:
+        return self._decks[note.d_id]
+
     def getLen(self) -> int:
         return len(self._notesToStudy)
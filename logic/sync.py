@@ -0,0 +1,364 @@
+"""
+Delta sync between two collection databases.
+
+Triggers stamp every modified row with the change sequence number of its collection and keep tombstones
+of deleted rows (see dbmodel.createChangeLogTriggers). Sync asks both sides for the rows changed since
+the marks stored by the previous sync, resolves conflicting rows the same way on both sides and sends
+each side what it is missing. Rows are identified by guids, parents are referenced by their guid.
+
+    python -m logic.sync other/appdata.db
+    python -m logic.sync http://localhost:8765
+"""
+import argparse
+import gzip
+import json
+import time
+import urllib.request
+from typing import Dict, List, NamedTuple, Tuple
+
+import sqlalchemy as sql
+
+from data import dbmodel as dbm
+from data.migrations import BackfillRunner
+
+
+LOOKUP_CHUNK = 500  # guids resolved per query
+APPLY_CHUNK = 1000  # received rows applied per transaction
+APPLY_PAUSE = 0.005  # seconds between transactions, lets a waiting app write take the writer connection
+TABLES = ["cards", "decks", "notes", "reviews"]  # parents before children
+ChangeSet = Dict[str, List[dict]]
+
+_KEYS = {table: (key, prefix) for table, key, prefix, _ in dbm.SYNCED_TABLES}
+# fields sent for every table and the columns they are stored in
+_COLUMNS = {
+    "cards": {"name": "c_name", "fields": "c_fields", "layout_f": "c_layout_f", "layout_b": "c_layout_b"},
+    "decks": {"name": "d_name"},
+    "notes": {"data": "n_data", "last_r": "n_last_r", "next_r": "n_next_r"},
+    "reviews": {"ease": "r_ease"},
+}
+# field referencing the parent row and the parent table
+_PARENTS = {"decks": ("card", "cards"), "notes": ("deck", "decks"), "reviews": ("note", "notes")}
+_SELECTS = {
+    "cards": "SELECT c_guid AS guid, c_mtime AS mtime, c_name AS name, c_fields AS fields, "
+             "c_layout_f AS layout_f, c_layout_b AS layout_b FROM cards WHERE c_mod > :mark",
+    "decks": "SELECT d_guid AS guid, d_mtime AS mtime, d_name AS name, c_guid AS card "
+             "FROM decks JOIN cards USING (c_id) WHERE d_mod > :mark",
+    "notes": "SELECT n_guid AS guid, n_mtime AS mtime, n_data AS data, n_last_r AS last_r, n_next_r AS next_r, "
+             "d_guid AS deck FROM notes JOIN decks USING (d_id) WHERE n_mod > :mark",
+    "reviews": "SELECT r_guid AS guid, r_mtime AS mtime, r_ease AS ease, n_guid AS note "
+               "FROM reviews JOIN notes USING (n_id) WHERE r_mod > :mark",
+}
+
+
+class SyncResult(NamedTuple):
+    """Rows and tombstones sent to and received from the other collection, sizes are of the gzipped JSON"""
+    sent: int
+    received: int
+    sentBytes: int
+    receivedBytes: int
+
+
+def _chunks(items: list, size: int = LOOKUP_CHUNK):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def countRows(changes: ChangeSet) -> int:
+    return sum(len(rows) for rows in changes.values())
+
+
+def payloadSize(changes: ChangeSet) -> int:
+    return len(gzip.compress(json.dumps(changes).encode("utf-8")))
+
+
+def _rowKey(row: dict):
+    """Orders versions of a row, the newer one wins and ties are broken by content so both sides agree"""
+    return row["mtime"], json.dumps(row, sort_keys=True)
+
+
+def mergeRows(table: str, ours: dict, theirs: dict) -> dict:
+    """
+    Resolves a row changed by both collections. The newer version wins,
+    except for the schedule of a note, which is taken from the version reviewed last.
+    A note combined from both versions is a new version, its mtime is later than both,
+    so the two collections store the same mtime and resolve later conflicts alike.
+    """
+    newer = max(ours, theirs, key=_rowKey)
+    if table != "notes":
+        return newer
+    scheduled = max(ours, theirs, key=lambda row: (row["last_r"], row["next_r"]))
+    merged = dict(newer, last_r=scheduled["last_r"], next_r=scheduled["next_r"])
+    if merged != newer:
+        merged["mtime"] = max(ours["mtime"], theirs["mtime"]) + 1
+    return merged
+
+
+def resolveChanges(ours: ChangeSet, theirs: ChangeSet) -> Tuple[ChangeSet, ChangeSet]:
+    """
+    Returns changes to apply locally and changes to send to the other collection.
+    Deletion wins over modification, rows whose parent is deleted are dropped by the cascade.
+    """
+    oursDeleted = {(grave["table"], grave["guid"]) for grave in ours.get("graves", [])}
+    theirsDeleted = {(grave["table"], grave["guid"]) for grave in theirs.get("graves", [])}
+    toLocal: ChangeSet = {"graves": list(theirs.get("graves", []))}
+    toRemote: ChangeSet = {"graves": list(ours.get("graves", []))}
+    for table in TABLES:
+        ourRows = {row["guid"]: row for row in ours.get(table, [])}
+        toLocal[table], toRemote[table] = [], []
+        for row in theirs.get(table, []):
+            if (table, row["guid"]) in oursDeleted:
+                continue
+            ourRow = ourRows.pop(row["guid"], None)
+            if ourRow is None:
+                toLocal[table].append(row)
+                continue
+            merged = mergeRows(table, ourRow, row)
+            if merged != ourRow:
+                toLocal[table].append(merged)
+            if merged != row:
+                toRemote[table].append(merged)
+        toRemote[table].extend(row for guid, row in ourRows.items() if (table, guid) not in theirsDeleted)
+    return toLocal, toRemote
+
+
+class LocalCollection:
+    """
+    Collection database on this machine, all access goes through its writer engine.
+    The engine is disposed by close() only when the collection owns it, as the one of openCollection() does.
+    """
+
+    def __init__(self, engine: sql.engine.Engine, ownsEngine: bool = False):
+        self._engine = engine
+        self._ownsEngine = ownsEngine
+
+    def close(self) -> None:
+        if self._ownsEngine:
+            self._engine.dispose()
+
+    def collectionId(self) -> str:
+        with self._engine.connect() as connection:
+            return connection.exec_driver_sql("SELECT collection_id FROM sync_state WHERE id = 1").scalar()
+
+    def peerMarks(self, peerId: str) -> Tuple[int, int]:
+        """Returns local and remote marks of the last sync with the peer, -1 when they never synced"""
+        with self._engine.connect() as connection:
+            row = connection.execute(sql.text("SELECT local_mark, remote_mark FROM sync_peers WHERE peer_id = :peer"),
+                                     {"peer": peerId}).first()
+        return (row.local_mark, row.remote_mark) if row else (-1, -1)
+
+    def setPeerMarks(self, peerId: str, localMark: int, remoteMark: int) -> None:
+        with self._engine.begin() as connection:
+            connection.execute(sql.text(
+                "INSERT OR REPLACE INTO sync_peers (peer_id, local_mark, remote_mark, last_sync) "
+                "VALUES (:peer, :local, :remote, :now)"
+            ), {"peer": peerId, "local": localMark, "remote": remoteMark, "now": int(time.time())})
+
+    def changesSince(self, mark: int) -> Tuple[ChangeSet, int]:
+        """
+        Returns rows and tombstones changed after the mark and the new mark.
+        The sequence number is bumped, so rows modified from now on are newer than the returned mark.
+        """
+        with self._engine.begin() as connection:
+            seq = connection.exec_driver_sql("SELECT seq FROM sync_state WHERE id = 1").scalar()
+            connection.exec_driver_sql("UPDATE sync_state SET seq = seq + 1 WHERE id = 1")
+            changes = {table: [dict(row._mapping) for row in connection.execute(sql.text(select), {"mark": mark})]
+                       for table, select in _SELECTS.items()}
+            changes["graves"] = [dict(row._mapping) for row in connection.execute(sql.text(
+                "SELECT g_table AS \"table\", g_guid AS guid, g_mtime AS mtime FROM graves WHERE g_mod > :mark"
+            ), {"mark": mark})]
+        return changes, seq
+
+    def apply(self, changes: ChangeSet, expectedMark: int) -> int:
+        """
+        Applies changes received from the other collection and returns the mark to store for this side.
+        Changes are applied in transactions of APPLY_CHUNK rows, the writer is free for the app between them.
+        Every chunk gets a sequence number of its own. When nothing else was modified since changesSince
+        returned expectedMark, the returned mark covers the applied rows, so they aren't sent back by the next sync.
+        """
+        with self._engine.begin() as connection:
+            seq = connection.exec_driver_sql("SELECT seq FROM sync_state WHERE id = 1").scalar()
+            clean = seq == expectedMark + 1
+        applied, others = seq, [seq]  # sequence numbers of the applied chunks and of writes between them
+        # children first, so a card is deleted after the decks of an earlier chunk which used it
+        graves = sorted(changes.get("graves", []), key=lambda grave: -TABLES.index(grave["table"]))
+        batches = [(None, chunk) for chunk in _chunks(graves, APPLY_CHUNK)]
+        batches += [(table, chunk) for table in TABLES for chunk in _chunks(changes.get(table) or [], APPLY_CHUNK)]
+        for table, rows in batches:
+            with self._engine.begin() as connection:
+                applied = self._bumpSeq(connection)
+                if table is None:
+                    self._applyGraves(connection, rows)
+                else:
+                    self._applyRows(connection, table, rows)
+                others.append(self._bumpSeq(connection))
+            time.sleep(APPLY_PAUSE)
+        with self._engine.begin() as connection:
+            clean = clean and not self._modifiedAt(connection, others)
+            self._bumpSeq(connection)
+            # cards deleted by the other side but still used here are sent back to it by the next sync
+            keptCards = list(self._lookupIds(connection, "cards", [grave["guid"] for grave in graves
+                                                                   if grave["table"] == "cards"]))
+            for chunk in _chunks(keptCards):
+                connection.execute(sql.text("UPDATE cards SET c_name = c_name WHERE c_guid IN :guids")
+                                   .bindparams(sql.bindparam("guids", expanding=True)), {"guids": chunk})
+        return applied if clean else expectedMark
+
+    @staticmethod
+    def _bumpSeq(connection: sql.engine.Connection) -> int:
+        """Starts a new sequence number and returns it"""
+        connection.exec_driver_sql("UPDATE sync_state SET seq = seq + 1 WHERE id = 1")
+        return connection.exec_driver_sql("SELECT seq FROM sync_state WHERE id = 1").scalar()
+
+    @staticmethod
+    def _modifiedAt(connection: sql.engine.Connection, seqs: List[int]) -> bool:
+        checks = [f"EXISTS (SELECT 1 FROM {table} WHERE {prefix}_mod IN :seqs)" for table, (_, prefix) in _KEYS.items()]
+        checks.append("EXISTS (SELECT 1 FROM graves WHERE g_mod IN :seqs)")
+        statement = sql.text(f"SELECT {' OR '.join(checks)}").bindparams(sql.bindparam("seqs", expanding=True))
+        return bool(connection.execute(statement, {"seqs": seqs}).scalar())
+
+    @staticmethod
+    def _lookupIds(connection: sql.engine.Connection, table: str, guids) -> Dict[str, int]:
+        """Maps guids of rows present in the table to their local IDs"""
+        key, prefix = _KEYS[table]
+        statement = sql.text(f"SELECT {prefix}_guid, {key} FROM {table} WHERE {prefix}_guid IN :guids") \
+            .bindparams(sql.bindparam("guids", expanding=True))
+        ids = {}
+        for chunk in _chunks(list(guids)):
+            ids.update(connection.execute(statement, {"guids": chunk}).fetchall())
+        return ids
+
+    @staticmethod
+    def _applyGraves(connection: sql.engine.Connection, graves: List[dict]) -> None:
+        """Deletes rows by their tombstones, children first, cards still used by a deck are kept"""
+        for table in reversed(TABLES):
+            key, prefix = _KEYS[table]
+            guids = [grave["guid"] for grave in graves if grave["table"] == table]
+            condition = " AND NOT EXISTS (SELECT 1 FROM decks WHERE decks.c_id = cards.c_id)" if table == "cards" else ""
+            statement = sql.text(f"DELETE FROM {table} WHERE {prefix}_guid IN :guids{condition}") \
+                .bindparams(sql.bindparam("guids", expanding=True))
+            for chunk in _chunks(guids):
+                connection.execute(statement, {"guids": chunk})
+
+    @staticmethod
+    def _claimName(connection: sql.engine.Connection, table: str, guid: str, name: str) -> str:
+        """
+        Names of cards and decks are unique. When a received row takes the name of another row,
+        the row with the greater guid is renamed, so both collections end with the same names.
+        """
+        _, prefix = _KEYS[table]
+        other = connection.execute(sql.text(
+            f"SELECT {prefix}_guid FROM {table} WHERE {prefix}_name = :name AND {prefix}_guid != :guid"
+        ), {"name": name, "guid": guid}).scalar()
+        if other is None:
+            return name
+        if guid > other:
+            return f"{name} ({guid[:6]})"
+        connection.execute(sql.text(f"UPDATE {table} SET {prefix}_name = :renamed WHERE {prefix}_guid = :other"),
+                           {"renamed": f"{name} ({other[:6]})", "other": other})
+        return name
+
+    def _applyRows(self, connection: sql.engine.Connection, table: str, rows: List[dict]) -> None:
+        """Updates rows already present and inserts the others, rows whose parent is missing are skipped"""
+        key, prefix = _KEYS[table]
+        columns = _COLUMNS[table]
+        existing = self._lookupIds(connection, table, [row["guid"] for row in rows])
+        parent = _PARENTS.get(table)
+        parentIds = self._lookupIds(connection, parent[1], {row[parent[0]] for row in rows}) if parent else {}
+        updates, inserts = [], []
+        for row in rows:
+            values = {column: row[field] for field, column in columns.items()}
+            values[f"{prefix}_guid"] = row["guid"]
+            values[f"{prefix}_mtime"] = row["mtime"]
+            if parent:
+                parentId = parentIds.get(row[parent[0]])
+                if parentId is None:
+                    continue
+                values[_KEYS[parent[1]][0]] = parentId
+            if "name" in columns:
+                values[f"{prefix}_name"] = self._claimName(connection, table, row["guid"], row["name"])
+            (updates if row["guid"] in existing else inserts).append(values)
+        if updates:
+            assignments = ", ".join(f"{column} = :{column}" for column in updates[0] if column != f"{prefix}_guid")
+            connection.execute(sql.text(f"UPDATE {table} SET {assignments} WHERE {prefix}_guid = :{prefix}_guid"),
+                               updates)
+        if inserts:
+            names = list(inserts[0])
+            connection.execute(sql.text(
+                f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join(':' + name for name in names)})"
+            ), inserts)
+
+
+class HttpCollection:
+    """Collection served by logic.syncserver, requests and responses are gzipped JSON"""
+
+    def __init__(self, url: str, timeout: float = 60.0):
+        self._url = url.rstrip("/")
+        self._timeout = timeout
+
+    def _call(self, path: str, payload: dict = None) -> dict:
+        data = gzip.compress(json.dumps(payload).encode("utf-8")) if payload is not None else None
+        request = urllib.request.Request(self._url + path, data=data, headers={
+            "Content-Type": "application/json", "Content-Encoding": "gzip", "Accept-Encoding": "gzip"})
+        with urllib.request.urlopen(request, timeout=self._timeout) as response:
+            return json.loads(gzip.decompress(response.read()))
+
+    def collectionId(self) -> str:
+        return self._call("/id")["collection_id"]
+
+    def changesSince(self, mark: int) -> Tuple[ChangeSet, int]:
+        result = self._call("/changes", {"since": mark})
+        return result["changes"], result["seq"]
+
+    def apply(self, changes: ChangeSet, expectedMark: int) -> int:
+        return self._call("/apply", {"changes": changes, "expected": expectedMark})["mark"]
+
+    def close(self) -> None:
+        pass  # every request uses its own connection
+
+
+def openCollection(target: str):
+    """
+    Opens a collection given by the path of its database or by the URL of a sync server,
+    the caller closes it once done
+    """
+    if target.startswith(("http://", "https://")):
+        return HttpCollection(target)
+    engine = dbm.createEngine(f"sqlite:///{target}")
+    try:
+        dbm.prepareDatabase(engine)
+        BackfillRunner(engine, dbm.MIGRATIONS, pause=0).complete()  # rows are matched by guid, all of them need one
+    except Exception:
+        engine.dispose()
+        raise
+    return LocalCollection(engine, ownsEngine=True)
+
+
+def syncCollections(local: LocalCollection, remote) -> SyncResult:
+    """
+    Exchanges changes made since the last sync of the two collections, marks are kept by the local one.
+    Applying is idempotent, a sync interrupted halfway sends the same rows again next time.
+    """
+    peerId = remote.collectionId()
+    if peerId == local.collectionId():
+        raise ValueError("Can't sync a collection with itself")
+    localMark, remoteMark = local.peerMarks(peerId)
+    ours, localSeq = local.changesSince(localMark)
+    theirs, remoteSeq = remote.changesSince(remoteMark)
+    toLocal, toRemote = resolveChanges(ours, theirs)
+    newRemoteMark = remote.apply(toRemote, remoteSeq) if countRows(toRemote) else remoteSeq
+    newLocalMark = local.apply(toLocal, localSeq) if countRows(toLocal) else localSeq
+    local.setPeerMarks(peerId, newLocalMark, newRemoteMark)
+    return SyncResult(countRows(toRemote), countRows(theirs), payloadSize(toRemote), payloadSize(theirs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("target", help="path of the other database or URL of a sync server")
+    parser.add_argument("--database", default=dbm.DATABASE_PATH, help="local collection")
+    args = parser.parse_args()
+    result = syncCollections(openCollection(args.database), openCollection(args.target))
+    print(f"sent {result.sent} changes ({result.sentBytes} B), received {result.received} ({result.receivedBytes} B)")
+
+
+if __name__ == "__main__":
+    main()
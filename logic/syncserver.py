@@ -0,0 +1,92 @@
+"""
+Stand-in sync server serving one collection database over HTTP, used by logic.sync.HttpCollection.
+
+    GET  /id        {"collection_id": ...}
+    POST /changes   {"since": mark}                       -> {"changes": ..., "seq": mark}
+    POST /apply     {"changes": ..., "expected": mark}    -> {"mark": mark}
+
+Bodies are gzipped JSON. Requests are handled one at a time, the collection has a single writer anyway.
+
+    python -m logic.syncserver server/appdata.db --port 8765
+"""
+import argparse
+import gzip
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from logic.sync import LocalCollection, openCollection
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8765
+
+
+class SyncRequestHandler(BaseHTTPRequestHandler):
+    server: "SyncServer"
+
+    def _reply(self, status: int, payload: dict) -> None:
+        body = gzip.compress(json.dumps(payload).encode("utf-8"))
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _readPayload(self) -> dict:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        return json.loads(body)
+
+    def do_GET(self):
+        if self.path == "/id":
+            self._reply(200, {"collection_id": self.server.collection.collectionId()})
+        else:
+            self._reply(404, {"error": "unknown path"})
+
+    def do_POST(self):
+        try:
+            payload = self._readPayload()
+            if self.path == "/changes":
+                changes, seq = self.server.collection.changesSince(int(payload["since"]))
+                self._reply(200, {"changes": changes, "seq": seq})
+            elif self.path == "/apply":
+                mark = self.server.collection.apply(payload["changes"], int(payload["expected"]))
+                self._reply(200, {"mark": mark})
+            else:
+                self._reply(404, {"error": "unknown path"})
+        except (ValueError, KeyError, TypeError) as error:
+            self._reply(400, {"error": str(error)})
+
+    def log_message(self, format, *args):
+        logger.info(format, *args)
+
+
+class SyncServer(HTTPServer):
+    def __init__(self, collection: LocalCollection, host: str = "localhost", port: int = DEFAULT_PORT):
+        super().__init__((host, port), SyncRequestHandler)
+        self.collection = collection
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("database", help="collection served to clients")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    collection = openCollection(args.database)
+    server = SyncServer(collection, args.host, args.port)
+    logger.info("Serving %s on %s:%d", args.database, args.host, args.port)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        collection.close()
+
+
+if __name__ == "__main__":
+    main()
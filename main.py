@@ -1,9 +1,21 @@
+import logging
 import sys
 from PySide2.QtWidgets import QApplication
-from logic.controller import Controller
+
+
+def configureLogging():
+    """Shows messages of the app modules, SQLAlchemy has its own handler"""
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    for name in ["data", "logic"]:
+        logger = logging.getLogger(name)
+        logger.setLevel(logging.INFO)
+        logger.addHandler(handler)
 
 
 if __name__ == '__main__':
+    configureLogging()
+    from logic.controller import Controller  # importing it opens the database, which may already log
     app = QApplication(sys.argv)
     controller = Controller()
     sys.exit(app.exec_())
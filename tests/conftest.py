@@ -0,0 +1,12 @@
+"""
+Importing data.dbmodel opens appdata.db in the working directory, tests run in a temporary one
+so they never touch a real collection.
+"""
+import os
+import tempfile
+
+os.chdir(tempfile.mkdtemp(prefix="tests-"))
+
+from data import dbmodel as dbm  # noqa: E402
+
+dbm.Engine.echo = dbm.ReaderEngine.echo = False
@@ -0,0 +1,16 @@
+from logic.downsample import lttbIndices
+from logic.statutils import FORECAST_DAYS
+
+
+def test_forecast_is_downsampled():
+    values = [float((day * 37) % 100) for day in range(FORECAST_DAYS)]
+    values[77] = 1000.0
+    indices = lttbIndices(values, 120)
+    assert len(indices) == 120
+    assert indices[0] == 0 and indices[-1] == FORECAST_DAYS - 1
+    assert indices == sorted(set(indices))
+    assert 77 in indices  # a peak keeps its place in the chart
+
+
+def test_short_series_is_kept():
+    assert lttbIndices([1.0, 2.0, 3.0], 120) == [0, 1, 2]
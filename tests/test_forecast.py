@@ -0,0 +1,52 @@
+import threading
+
+import numpy as np
+
+from logic.forecast import ONE_DAY, simulateWorkload, DEFAULT_EASE_DISTRIBUTION
+
+NOW = 1_700_000_000
+
+
+def simulate(last_r, next_r, days: int = 31) -> np.ndarray:
+    """Runs the simulation on a thread, a simulation which never ends fails the test instead of hanging it"""
+    result = []
+    worker = threading.Thread(target=lambda: result.append(simulateWorkload(
+        np.array(last_r), np.array(next_r), DEFAULT_EASE_DISTRIBUTION, days, now=NOW, seed=1)), daemon=True)
+    worker.start()
+    worker.join(10)
+    assert result, "simulation didn't finish"
+    return result[0].mean
+
+
+def test_single_note_finishes():
+    mean = simulate([NOW - ONE_DAY], [NOW + ONE_DAY])
+    assert mean.shape == (31,)
+    assert mean[1] == 1
+
+
+def test_few_notes_finish():
+    for count in (2, 3, 8):
+        mean = simulate([NOW - ONE_DAY] * count, [NOW] * count)
+        assert mean[0] == count
+
+
+def test_all_notes_beyond_horizon():
+    mean = simulate([NOW - ONE_DAY] * 5, [NOW + 100 * ONE_DAY] * 5)
+    assert not mean.any()
+
+
+def test_no_notes():
+    assert not simulate([], []).any()
+
+
+def test_short_intervals_are_reviewed_daily():
+    result = simulateWorkload(np.array([NOW - 3600] * 1000), np.array([NOW] * 1000), {3: 1.0}, 31, now=NOW, seed=1)
+    assert (result.mean == 1000).all()
+
+
+def test_unchanged_intervals_keep_their_pace():
+    # reviewed every third day: days 0, 3, ..., 30
+    result = simulateWorkload(np.array([NOW - 3 * ONE_DAY] * 1000), np.array([NOW] * 1000), {3: 1.0}, 31,
+                              now=NOW, seed=1)
+    assert result.mean[:4].tolist() == [1000, 0, 0, 1000]
+    assert abs(result.mean.sum() - 11000) < 11000 * 0.03
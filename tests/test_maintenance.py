@@ -0,0 +1,34 @@
+from data import dbmodel as dbm
+from logic.maintenance import DatabaseMaintenance
+
+
+def runPass(maintenance: DatabaseMaintenance) -> list:
+    """Runs slices like the idle timer, steps for a worker are run in between, returns their names"""
+    background = []
+    while maintenance.runSlice():
+        step = maintenance.takeBackgroundStep()
+        if step is not None:
+            assert maintenance.runSlice()  # the pass waits while the step runs
+            background.append(step())
+            maintenance.backgroundStepDone(background[-1])
+    return background
+
+
+def test_long_steps_run_in_background(tmp_path):
+    path = tmp_path / "collection.db"
+    engine = dbm.createEngine(f"sqlite:///{path}")
+    dbm.prepareDatabase(engine)
+    with engine.connect() as connection:
+        connection.exec_driver_sql("PRAGMA auto_vacuum=NONE")
+        connection.exec_driver_sql("VACUUM")
+    readerEngine = dbm.createEngine(f"sqlite:///{path}", readOnly=True)
+    maintenance = DatabaseMaintenance(engine, readerEngine, sliceBudget=10.0)
+
+    assert runPass(maintenance) == ["convert to incremental vacuum", "quick_check"]
+    assert not maintenance.isPending()
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2
+    maintenance.requestPass()
+    assert runPass(maintenance) == ["quick_check"]
+    engine.dispose()
+    readerEngine.dispose()
@@ -0,0 +1,149 @@
+import pytest
+import sqlalchemy as sql
+
+from benchmarks.schema_migrations import createLegacyCollection
+from data import dbmodel as dbm
+from data.migrations import BackfillRunner, migrate
+
+NOTES, REVIEWS, DECKS, ORPHANS = 3000, 6000, 5, 50
+
+
+def names(connection, kind: str) -> set:
+    return {row[0] for row in connection.execute(sql.text("SELECT name FROM sqlite_master WHERE type = :kind"),
+                                                 {"kind": kind})}
+
+
+def foreignKeys(connection, table: str) -> int:
+    return len(connection.exec_driver_sql(f"PRAGMA foreign_key_list({table})").fetchall())
+
+
+def count(connection, statement: str) -> int:
+    return connection.exec_driver_sql(statement).scalar()
+
+
+@pytest.fixture
+def legacy(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    createLegacyCollection(path, NOTES, REVIEWS, DECKS, ORPHANS)
+    engine = dbm.createEngine(f"sqlite:///{path}")
+    dbm.Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+def migrateTo(engine, version: int) -> None:
+    migrate(engine, [migration for migration in dbm.MIGRATIONS if migration.version <= version])
+
+
+def test_migrations_one_at_a_time(legacy):
+    migrateTo(legacy, 1)
+    with legacy.connect() as connection:
+        for table, _, prefix, _ in dbm.SYNCED_TABLES:
+            columns = {row[1] for row in connection.exec_driver_sql(f"PRAGMA table_info({table})")}
+            assert {f"{prefix}_guid", f"{prefix}_mod", f"{prefix}_mtime"} <= columns
+
+    migrateTo(legacy, 2)
+    with legacy.connect() as connection:
+        assert foreignKeys(connection, "decks") == 1
+        # large tables wait for their copy, nothing was copied at startup
+        assert {"notes_rebuilt", "reviews_rebuilt"} <= names(connection, "table")
+        assert count(connection, "SELECT COUNT(*) FROM notes_rebuilt") == 0
+        assert foreignKeys(connection, "notes_rebuilt") == 1 and foreignKeys(connection, "reviews_rebuilt") == 1
+        progress = connection.exec_driver_sql("SELECT name, end_key FROM backfill_progress").fetchall()
+        assert dict(progress) == {"notes_rebuild": NOTES, "reviews_rebuild": REVIEWS}
+
+    migrateTo(legacy, 3)
+    with legacy.connect() as connection:
+        indexes = names(connection, "index")
+        assert {"ix_d_guid", "ix_c_guid", "ix_n_guid", "ix_r_guid"} <= indexes
+        assert "ix_n_d_id" in indexes  # serves the old notes table until its swap
+
+    migrateTo(legacy, 4)
+    with legacy.connect() as connection:
+        assert {f"tr_{table}_{operation}_version" for table in dbm.VERSIONED_TABLES
+                for operation in ("insert", "update", "delete")} <= names(connection, "trigger")
+
+    migrateTo(legacy, 5)
+    with legacy.connect() as connection:
+        assert count(connection, "SELECT version FROM schema_version") == 5
+        assert {f"tr_{table}_insert_log" for table, *_ in dbm.SYNCED_TABLES} <= names(connection, "trigger")
+        assert count(connection, "SELECT COUNT(*) FROM backfill_progress") == 6
+    assert migrate(legacy, dbm.MIGRATIONS) == 0
+
+
+def test_backfills_resume_after_stop_and_keep_app_writes(legacy):
+    migrate(legacy, dbm.MIGRATIONS)
+    runner = BackfillRunner(legacy, dbm.MIGRATIONS, chunk=500, pause=0)
+    steps = []
+    step = runner.step
+
+    def stoppingStep():
+        steps.append(len(steps))
+        if len(steps) == 4:
+            runner.stop()
+        return step()
+
+    runner.step = stoppingStep
+    runner.complete()
+    assert len(steps) == 4
+    progress = {name: (last, done) for name, last, _, done in runner.progress()}
+    assert progress["notes_rebuild"] == (2000, False)
+
+    # the app keeps writing to the old tables while they are copied
+    with legacy.begin() as connection:
+        reviewsOfDeleted = count(connection, "SELECT COUNT(*) FROM reviews WHERE n_id = 200")
+        connection.exec_driver_sql("UPDATE notes SET n_next_r = 42 WHERE n_id IN (100, 2900)")
+        connection.exec_driver_sql("UPDATE notes SET n_next_r = 42 WHERE n_id = 1")  # orphan, isn't copied
+        connection.exec_driver_sql("DELETE FROM notes WHERE n_id = 200")
+        connection.exec_driver_sql("DELETE FROM reviews WHERE n_id = 200")
+        # past the note the orphaned reviews point at
+        connection.exec_driver_sql(
+            "INSERT INTO notes (n_id, n_data, n_last_r, n_next_r, d_id) VALUES (5000, '[\"new\"]', 0, 0, 1)")
+        connection.exec_driver_sql("INSERT INTO reviews (r_ease, n_id) VALUES (3, 2900)")
+
+    resumed = BackfillRunner(legacy, dbm.MIGRATIONS, chunk=500, pause=0)
+    assert resumed.isPending()
+    resumed.complete()
+    assert not resumed.isPending()
+    assert all(done for *_, done in resumed.progress())
+
+    with legacy.connect() as connection:
+        assert not {"notes_rebuilt", "reviews_rebuilt"} & names(connection, "table")
+        assert not [name for name in names(connection, "trigger") if name.endswith("_rebuilt")]
+        assert {f"tr_{table}_{operation}_log" for table, *_ in dbm.SYNCED_TABLES
+                for operation in ("insert", "update", "delete")} <= names(connection, "trigger")
+        declared = {index.name for table in dbm.Base.metadata.tables.values() for index in table.indexes}
+        assert declared <= names(connection, "index")
+        for table in ("decks", "notes", "reviews"):
+            assert foreignKeys(connection, table) == 1
+        assert not connection.exec_driver_sql("PRAGMA foreign_key_check").fetchall()
+
+        # orphans are gone, the deleted note too, the inserted one made it
+        assert count(connection, "SELECT COUNT(*) FROM notes") == NOTES - ORPHANS - 1 + 1
+        assert count(connection, "SELECT n_next_r FROM notes WHERE n_id = 2900") == 42
+        assert count(connection, "SELECT COUNT(*) FROM notes WHERE n_id = 200") == 0
+        assert count(connection, "SELECT COUNT(*) FROM notes WHERE n_data = '[\"new\"]'") == 1
+        assert count(connection, "SELECT COUNT(*) FROM reviews") == REVIEWS - ORPHANS - reviewsOfDeleted + 1
+
+        for table, _, prefix, _ in dbm.SYNCED_TABLES:
+            rows, guids, distinct = connection.exec_driver_sql(
+                f"SELECT COUNT(*), COUNT({prefix}_guid), COUNT(DISTINCT {prefix}_guid) FROM {table}").fetchone()
+            assert rows == guids == distinct, table
+
+
+def test_fresh_database_needs_no_copy(tmp_path):
+    engine = dbm.createEngine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    dbm.prepareDatabase(engine)
+    names = [name for name, *_ in BackfillRunner(engine, dbm.MIGRATIONS).progress()]
+    assert names == ["cards_guid", "decks_guid", "notes_guid", "reviews_guid"]
+    engine.dispose()
+
+
+def test_newer_database_is_refused(tmp_path):
+    engine = dbm.createEngine(f"sqlite:///{tmp_path / 'newer.db'}")
+    dbm.prepareDatabase(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("UPDATE schema_version SET version = 99")
+    with pytest.raises(RuntimeError):
+        dbm.prepareDatabase(engine)
+    engine.dispose()
@@ -0,0 +1,37 @@
+import json
+
+from sqlalchemy.orm import sessionmaker
+
+from data import dbmodel as dbm
+from logic.notequery import NoteQuery, SortIndexes, SORT_DUE, createSortIndex, fetchNotePage
+
+
+def indexNames(engine) -> set:
+    with engine.connect() as connection:
+        return {row[0] for row in connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+
+def test_sort_index_is_built_by_the_caller(tmp_path):
+    engine = dbm.createEngine(f"sqlite:///{tmp_path / 'collection.db'}")
+    dbm.prepareDatabase(engine)
+    with engine.begin() as connection:
+        connection.execute(dbm.Card.__table__.insert(), {"c_name": "Basic", "c_fields": json.dumps(["Front", "Back"])})
+        connection.execute(dbm.Deck.__table__.insert(), {"d_name": "Deck", "c_id": 1})
+        connection.execute(dbm.Note.__table__.insert(), [
+            {"n_data": json.dumps([f"front {n % 7}", "back"]), "n_last_r": 0, "n_next_r": 0, "d_id": 1}
+            for n in range(50)])
+    factory = sessionmaker(bind=engine)
+    indexes = SortIndexes(threshold=2)
+
+    assert indexes.noteSorted(SORT_DUE) is None  # served by an index of the schema
+    assert indexes.noteSorted(0) is None
+    with dbm.sessionScope(factory) as session:
+        unindexed = fetchNotePage(session, NoteQuery(1, 0), 2, limit=20)
+    definition = indexes.noteSorted(0)
+    assert definition is not None and definition[0] not in indexNames(engine)  # nothing is built while sorting
+    createSortIndex(engine, definition)
+    assert definition[0] in indexNames(engine)
+    assert indexes.noteSorted(0) is None
+    with dbm.sessionScope(factory) as session:
+        assert fetchNotePage(session, NoteQuery(1, 0), 2, limit=20) == unindexed
+    engine.dispose()
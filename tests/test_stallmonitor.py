@@ -0,0 +1,66 @@
+import sys
+import time
+from operator import methodcaller
+
+from logic.actionprofiler import profiledAction
+from logic.stallmonitor import StallMonitor
+
+SLOT_FILE = "test_stallmonitor.py"  # this file stands in for controller.py
+
+
+def qtCall(slot):
+    """Calls the slot from C, the way the event loop of Qt does, without a Python frame in between"""
+    return list(map(methodcaller("__call__"), [slot]))[0]
+
+
+class Controller:
+    def __init__(self, monitor: StallMonitor, stall: float = 0.0):
+        self._monitor = monitor
+        self._stall = stall
+        self._sortConnected = []
+
+    def viewNotes(self):
+        self._sortConnected.append(lambda: self.viewNotesSort())
+        return self._exec()
+
+    def _exec(self):
+        # the modal dialog runs a nested event loop until it is closed, slots are called from inside it
+        return qtCall(self._sortConnected[0])
+
+    @profiledAction
+    def viewNotesSort(self):
+        time.sleep(self._stall)
+        return self._sortedPage()
+
+    def _sortedPage(self):
+        return self._monitor._describe(sys._getframe())
+
+
+def test_nested_loop_is_blamed_on_the_inner_slot():
+    slot, stack = qtCall(Controller(StallMonitor(slotFile=SLOT_FILE)).viewNotes)
+    assert slot == "viewNotesSort"
+    assert stack.split(";") == [f"{SLOT_FILE}:viewNotesSort", f"{SLOT_FILE}:_sortedPage"]
+
+
+def test_direct_calls_stay_in_the_slot():
+    slot, stack = qtCall(Controller(StallMonitor(slotFile=SLOT_FILE)).viewNotesSort)
+    assert slot == "viewNotesSort"
+    assert stack.endswith(f"{SLOT_FILE}:_sortedPage")
+
+
+def test_stack_outside_controller():
+    slot, stack = StallMonitor(slotFile=SLOT_FILE)._describe(None)
+    assert slot == "(outside controller)" and stack == ""
+
+
+def test_stall_in_nested_loop_is_reported_for_the_inner_slot():
+    monitor = StallMonitor(threshold=0.1, interval=0.01, slotFile=SLOT_FILE)
+    controller = Controller(monitor, stall=0.4)
+    monitor.start()
+    try:
+        qtCall(controller.viewNotes)
+        monitor.beat()
+    finally:
+        monitor.stop()
+    assert [stall.slot for stall in monitor.stalls()] == ["viewNotesSort"]
+    assert monitor.stalls()[0].duration > 0.3
@@ -0,0 +1,113 @@
+import json
+import time
+
+import pytest
+import sqlalchemy as sql
+
+from data import dbmodel as dbm
+from logic import sync
+from logic.sync import LocalCollection, openCollection, syncCollections
+
+
+def createCollection(path: str, notes: int = 0) -> sql.engine.Engine:
+    engine = dbm.createEngine(f"sqlite:///{path}")
+    dbm.prepareDatabase(engine)
+    if notes:
+        with engine.begin() as connection:
+            connection.execute(dbm.Card.__table__.insert(), {"c_name": "Basic", "c_fields": json.dumps(["Front", "Back"])})
+            connection.execute(dbm.Deck.__table__.insert(), {"d_name": "Deck", "c_id": 1})
+            connection.execute(dbm.Note.__table__.insert(), [
+                {"n_data": json.dumps([f"front {n}", f"back {n}"]), "n_last_r": 0, "n_next_r": 0, "d_id": 1}
+                for n in range(notes)])
+    return engine
+
+
+@pytest.fixture
+def collection(tmp_path):
+    """Creates collections by name, their engines are disposed after the test whatever its outcome"""
+    engines = []
+
+    def create(name: str, notes: int = 0) -> sql.engine.Engine:
+        engines.append(createCollection(str(tmp_path / f"{name}.db"), notes))
+        return engines[-1]
+    yield create
+    for engine in engines:
+        engine.dispose()
+
+
+def cardNames(engine: sql.engine.Engine) -> set:
+    with engine.connect() as connection:
+        return {row[0] for row in connection.exec_driver_sql("SELECT c_name FROM cards")}
+
+
+def test_apply_releases_writer_between_chunks(collection, monkeypatch):
+    remote = collection("remote", notes=50)
+    local = collection("local")
+    monkeypatch.setattr(sync, "APPLY_CHUNK", 10)
+    writes = []
+
+    def appWrite(seconds):
+        # runs between two chunks of the local apply, the writer has to be free
+        if len(writes) < 3:
+            with local.begin() as connection:
+                connection.execute(dbm.Card.__table__.insert(), {"c_name": f"App {len(writes)}", "c_fields": "[]"})
+            writes.append(seconds)
+
+    monkeypatch.setattr(sync.time, "sleep", appWrite)
+    syncCollections(LocalCollection(local), LocalCollection(remote))
+    monkeypatch.setattr(sync.time, "sleep", time.sleep)
+    assert len(writes) == 3
+    with local.connect() as connection:
+        assert connection.exec_driver_sql("SELECT COUNT(*) FROM notes").scalar() == 50
+
+    # cards written while the changes were applied aren't covered by the stored mark
+    syncCollections(LocalCollection(local), LocalCollection(remote))
+    assert cardNames(remote) == {"Basic", "App 0", "App 1", "App 2"}
+    assert syncCollections(LocalCollection(local), LocalCollection(remote)).sent == 0
+
+
+def test_clean_apply_is_not_sent_back(collection):
+    remote = collection("remote", notes=30)
+    local = collection("local")
+    first = syncCollections(LocalCollection(local), LocalCollection(remote))
+    assert first.received == 32
+    again = syncCollections(LocalCollection(local), LocalCollection(remote))
+    assert again.sent == 0 and again.received == 0
+
+
+def test_merged_note_has_same_mtime_on_both_sides(collection):
+    remote = collection("remote", notes=3)
+    local = collection("local")
+    syncCollections(LocalCollection(local), LocalCollection(remote))
+    with remote.begin() as connection:
+        mtime = connection.exec_driver_sql("SELECT n_mtime FROM notes WHERE n_id = 1").scalar()
+        # reviewed on the remote, edited later locally: the local content and the remote schedule are kept
+        connection.exec_driver_sql(f"UPDATE notes SET n_last_r = 100, n_next_r = 200, n_mtime = {mtime + 10} "
+                                   "WHERE n_id = 1")
+    with local.begin() as connection:
+        connection.exec_driver_sql(f"UPDATE notes SET n_data = '[\"edited\", \"\"]', n_mtime = {mtime + 20} "
+                                   "WHERE n_id = 1")
+    syncCollections(LocalCollection(local), LocalCollection(remote))
+
+    query = "SELECT n_mtime, n_data, n_last_r, n_next_r FROM notes ORDER BY n_guid"
+    with local.connect() as connection:
+        ours = connection.exec_driver_sql(query).fetchall()
+    with remote.connect() as connection:
+        theirs = connection.exec_driver_sql(query).fetchall()
+    assert ours == theirs
+    assert (mtime + 21, '["edited", ""]', 100, 200) in ours
+    again = syncCollections(LocalCollection(local), LocalCollection(remote))
+    assert again.sent == 0 and again.received == 0
+
+
+def test_opened_collection_is_closed(collection, tmp_path):
+    local = collection("local", notes=5)
+    collection("remote")
+    remote = openCollection(str(tmp_path / "remote.db"))
+    try:
+        assert syncCollections(LocalCollection(local), remote).sent == 7
+    finally:
+        remote.close()
+    assert remote._engine.pool.checkedin() == 0
+    LocalCollection(local).close()  # not owned, stays usable
+    assert cardNames(local) == {"Basic"}
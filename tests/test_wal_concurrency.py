@@ -0,0 +1,34 @@
+import random
+import threading
+
+from benchmarks.wal_concurrency import createDatabase, checkSnapshot, readStats, runReaders, runWriter
+
+NOTES = 2000
+READERS = 4
+
+
+def test_read_transactions_see_one_snapshot(tmp_path):
+    random.seed(0)
+    writeFactory, readFactory = createDatabase(str(tmp_path / "wal.db"), NOTES, READERS)
+    stop, checks = threading.Event(), []
+    threads = runReaders(READERS, lambda: checkSnapshot(readFactory, 1000 * NOTES), stop, checks)
+    written = runWriter(writeFactory, NOTES, 1.0)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    assert written > 0 and checks
+    assert checks.count(False) == 0, f"{checks.count(False)} of {len(checks)} reads saw a torn snapshot"
+
+
+def test_writer_progresses_while_readers_scan(tmp_path):
+    random.seed(0)
+    writeFactory, readFactory = createDatabase(str(tmp_path / "wal.db"), NOTES, READERS)
+    alone = runWriter(writeFactory, NOTES, 0.5)
+    stop, reads = threading.Event(), []
+    threads = runReaders(READERS, lambda: readStats(readFactory), stop, reads)
+    concurrent = runWriter(writeFactory, NOTES, 0.5)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    # readers never block the writer in WAL mode, they only compete with it for the GIL
+    assert reads and concurrent >= alone // 10, f"{concurrent} writes with readers, {alone} alone"
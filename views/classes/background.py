@@ -0,0 +1,52 @@
+from typing import Any, Callable
+
+from PySide2.QtCore import QObject, QRunnable, QThreadPool, Signal
+
+
+class _TaskSignals(QObject):
+    signalDone = Signal(object)
+    signalFailed = Signal(object)
+
+
+class _Task(QRunnable):
+    def __init__(self, function: Callable[[], Any]):
+        super().__init__()
+        self._function = function
+        self.signals = _TaskSignals()
+
+    def run(self):
+        try:
+            result = self._function()
+        except Exception as exception:  # reported on the GUI thread
+            self.signals.signalFailed.emit(exception)
+        else:
+            self.signals.signalDone.emit(result)
+
+
+class BackgroundRunner:
+    """
+    Runs functions on a thread pool and hands their results to callbacks on the GUI thread.
+    Functions must not touch widgets, database access has to go through the read-only pool.
+    Sync is an exception, it writes in short transactions between network round trips.
+    Writes which take long run on runners with a single thread, apart from the reads: steps of database
+    maintenance and backfills of data migrations, each of the latter holds the writer only for one chunk at a time.
+    """
+    def __init__(self, maxThreads: int = 2):
+        self._pool = QThreadPool()
+        self._pool.setMaxThreadCount(maxThreads)
+        self._signals = set()  # keeps signal objects alive until their task reported back
+
+    def run(self, function: Callable[[], Any], onDone: Callable[[Any], None],
+            onFailed: Callable[[Exception], None] = None) -> None:
+        task = _Task(function)
+        signals = task.signals
+        self._signals.add(signals)
+        signals.signalDone.connect(onDone)
+        if onFailed is not None:
+            signals.signalFailed.connect(onFailed)
+        signals.signalDone.connect(lambda _: self._signals.discard(signals))
+        signals.signalFailed.connect(lambda _: self._signals.discard(signals))
+        self._pool.start(task)
+
+    def waitForDone(self) -> None:
+        self._pool.waitForDone()
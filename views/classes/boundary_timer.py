@@ -0,0 +1,39 @@
+import time
+from typing import Optional
+
+from PySide2.QtCore import QObject, QTimer, Qt, Signal
+
+
+class BoundaryTimer(QObject):
+    """
+    BoundaryTimer emits signalReached once the wall clock passes the time it's armed for.
+    A single timer serves any number of boundaries, the owner arms it for the earliest one.
+    """
+    signalReached = Signal()
+    MAX_DELAY = 60 * 60 * 1000  # longer waits are split, so a changed system clock is noticed within an hour
+
+    def __init__(self):
+        super().__init__()
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setTimerType(Qt.PreciseTimer)
+        self._timer.timeout.connect(self._onTimeout)
+        self._target: Optional[float] = None
+
+    def armAt(self, timestamp: Optional[float]) -> None:
+        """Arms the timer for the timestamp in seconds, None stops it"""
+        self._target = timestamp
+        if timestamp is None:
+            self._timer.stop()
+            return
+        delay = max(0, int((timestamp - time.time()) * 1000) + 1)
+        self._timer.start(min(delay, self.MAX_DELAY))
+
+    def _onTimeout(self):
+        if self._target is None:
+            return
+        if time.time() >= self._target:
+            self._target = None
+            self.signalReached.emit()
+        else:
+            self.armAt(self._target)
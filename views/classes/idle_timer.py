@@ -0,0 +1,31 @@
+from PySide2.QtCore import QObject, QTimer, QElapsedTimer, QEvent, Signal
+from PySide2.QtWidgets import QApplication
+
+
+class IdleTimer(QObject):
+    """
+    IdleTimer emits signalIdle periodically once the user hasn't used the keyboard
+    or the mouse in any window of the app for a while
+    """
+    signalIdle = Signal()
+    INPUT_EVENTS = {QEvent.KeyPress, QEvent.MouseButtonPress, QEvent.MouseMove, QEvent.Wheel}
+
+    def __init__(self, idleAfter: int = 30 * 1000, interval: int = 250):
+        super().__init__()
+        self._idleAfter = idleAfter
+        self._lastInput = QElapsedTimer()
+        self._lastInput.start()
+        self._timer = QTimer(self)
+        self._timer.setInterval(interval)
+        self._timer.timeout.connect(self._onTimeout)
+        QApplication.instance().installEventFilter(self)
+        self._timer.start()
+
+    def eventFilter(self, watched: QObject, event: QEvent) -> bool:
+        if event.type() in self.INPUT_EVENTS:
+            self._lastInput.restart()
+        return False
+
+    def _onTimeout(self):
+        if self._lastInput.elapsed() >= self._idleAfter:
+            self.signalIdle.emit()
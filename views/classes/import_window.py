@@ -0,0 +1,44 @@
+from typing import List
+
+from PySide2.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QFormLayout, QPushButton, QLabel, QCheckBox, \
+    QComboBox, QTableWidget
+
+
+class DelimitedImportWindow(QDialog):
+    """Dialog importing notes from delimited text, every field of the card gets a column selector"""
+
+    def __init__(self, fields: List[str]):
+        super().__init__()
+        self.setWindowTitle("Import notes")
+        self.resize(600, 450)
+        layout = QVBoxLayout()
+        # source
+        sourceLayout = QHBoxLayout()
+        self.buttonChooseFile = QPushButton("Choose file")
+        self.buttonClipboard = QPushButton("Paste from clipboard")
+        self.labelSource = QLabel("Choose a CSV or TSV file")
+        sourceLayout.addWidget(self.buttonChooseFile)
+        sourceLayout.addWidget(self.buttonClipboard)
+        sourceLayout.addWidget(self.labelSource, 1)
+        layout.addLayout(sourceLayout)
+        self.checkHeader = QCheckBox("First row is a header")
+        layout.addWidget(self.checkHeader)
+        # mapping
+        mappingLayout = QFormLayout()
+        self.comboColumns: List[QComboBox] = []
+        for field in fields:
+            combo = QComboBox()
+            mappingLayout.addRow(QLabel(field), combo)
+            self.comboColumns.append(combo)
+        layout.addLayout(mappingLayout)
+        self.tablePreview = QTableWidget()
+        layout.addWidget(self.tablePreview, 1)
+        # buttons
+        buttonLayout = QHBoxLayout()
+        buttonLayout.addStretch(1)
+        self.buttonCancel = QPushButton("Cancel")
+        self.buttonImport = QPushButton("Import")
+        buttonLayout.addWidget(self.buttonCancel)
+        buttonLayout.addWidget(self.buttonImport)
+        layout.addLayout(buttonLayout)
+        self.setLayout(layout)
@@ -0,0 +1,64 @@
+from typing import Callable, Iterable, Optional
+
+from PySide2.QtCore import QUrl
+from PySide2.QtGui import QImage, QTextDocument
+from PySide2.QtWidgets import QTextBrowser
+
+from data.mediastore import MEDIA_SCHEME
+from logic.lrucache import LRUCache
+
+
+class ImageCache:
+    """
+    ImageCache keeps decoded images used by card layouts, limited by their size in memory.
+    Stored media are found through the resolver, other sources are treated as local files.
+    """
+    def __init__(self, maxBytes: int):
+        self._images = LRUCache(maxBytes, cost=lambda image: image.sizeInBytes())
+        self._resolver: Callable[[str], Optional[str]] = lambda name: None
+
+    def setResolver(self, resolver: Callable[[str], Optional[str]]) -> None:
+        """Sets function returning path of a stored media file by its name"""
+        self._resolver = resolver
+        self._images.clear()
+
+    def _path(self, url: QUrl) -> Optional[str]:
+        if url.scheme() == MEDIA_SCHEME:
+            return self._resolver(url.path())
+        if url.isLocalFile():
+            return url.toLocalFile()
+        if not url.scheme() or len(url.scheme()) == 1:  # relative path or a Windows drive
+            return url.toString()
+        return None
+
+    def get(self, url: QUrl) -> Optional[QImage]:
+        key = url.toString()
+        image = self._images.get(key)
+        if image is None:
+            path = self._path(url)
+            if path is None:
+                return None
+            image = QImage(path)
+            if image.isNull():
+                return None
+            self._images.put(key, image)
+        return image
+
+    def prefetch(self, sources: Iterable[str]) -> None:
+        """Decodes images ahead of time, so they are ready when the card is shown"""
+        for source in sources:
+            self.get(QUrl(source))
+
+
+imageCache = ImageCache(64 * 2**20)
+
+
+class MediaTextBrowser(QTextBrowser):
+    """QTextBrowser which loads images through the shared image cache"""
+
+    def loadResource(self, resourceType: int, url: QUrl):
+        if resourceType == QTextDocument.ImageResource:
+            image = imageCache.get(url)
+            if image is not None:
+                return image
+        return super().loadResource(resourceType, url)
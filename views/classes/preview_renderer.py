@@ -0,0 +1,24 @@
+from typing import Dict
+
+from PySide2.QtCore import QObject, Signal, Slot
+
+from logic.rendering import compileLayout, renderCompiled
+
+
+class PreviewRenderer(QObject):
+    """
+    Renders previews of card layouts, it's meant to live in a worker thread.
+    Layouts are compiled once per text, switching the sample note only fills them again.
+    """
+    signalRendered = Signal(int, str)
+
+    def __init__(self):
+        super().__init__()
+        self.latestRequest = 0  # set by the GUI thread, older requests still queued are skipped
+
+    @Slot(int, str, str, object, bool)
+    def render(self, requestId: int, front: str, back: str, values: Dict[str, str], displayFront: bool) -> None:
+        if requestId < self.latestRequest:
+            return
+        html = renderCompiled(compileLayout(front), compileLayout(back), values, displayFront)
+        self.signalRendered.emit(requestId, html)
@@ -0,0 +1,23 @@
+from PySide2.QtCore import QObject, QTimer, Qt
+
+from logic.stallmonitor import StallMonitor
+
+
+class StallWatchdog(QObject):
+    """
+    StallWatchdog drives the heartbeat of a StallMonitor from the event loop of the thread it's created in,
+    a late beat means the loop was blocked by a slot
+    """
+    def __init__(self, monitor: StallMonitor):
+        super().__init__()
+        self.monitor = monitor
+        self._timer = QTimer(self)
+        self._timer.setTimerType(Qt.PreciseTimer)
+        self._timer.setInterval(int(monitor.interval * 1000))
+        self._timer.timeout.connect(monitor.beat)
+        monitor.start()
+        self._timer.start()
+
+    def stop(self):
+        self._timer.stop()
+        self.monitor.stop()
@@ -1,49 +1,109 @@
 from typing import Tuple, List
 
 from PySide2.QtCharts import QtCharts
+from PySide2.QtCore import Qt, QPointF
 from PySide2.QtGui import QPainter
 from PySide2.QtWidgets import QDialog, QGridLayout
 
+from logic.downsample import lttbIndices
+
+
+ANIMATION_POINT_LIMIT = 100  # animating more points costs more than it's worth
+DOWNSAMPLE_POINTS = 120
+
+
+def _setAnimated(chart: QtCharts.QChart, pointCount: int):
+    chart.setAnimationOptions(QtCharts.QChart.SeriesAnimations if pointCount <= ANIMATION_POINT_LIMIT
+                              else QtCharts.QChart.NoAnimation)
+
+
+def _updatePieSeries(pieSeries: QtCharts.QPieSeries, data: List[Tuple[str, int]]):
+    """Updates values of the slices in place, slices are only recreated when the labels change"""
+    data = list(data)
+    slices = pieSeries.slices()
+    if [pieSlice.label() for pieSlice in slices] == [name for name, _ in data]:
+        for pieSlice, (_, value) in zip(slices, data):
+            pieSlice.setValue(value)
+    else:
+        pieSeries.clear()
+        for name, value in data:
+            pieSeries.append(name, value)
+
 
 class DeckStatsWindow(QDialog):
+    """Charts are created once, later calls of the setters only replace the data"""
 
     def __init__(self):
         super().__init__()
-        self.setFixedSize(800, 400)
+        self.setFixedSize(1200, 400)
         self.setWindowTitle("Deck statistics")
         layout = QGridLayout()
         # graphs
         self.chartPieView = QtCharts.QChartView()
         self.chartPieView.setRenderHint(QPainter.Antialiasing)
         self.chartBarView = QtCharts.QChartView()
+        self.chartForecastView = QtCharts.QChartView()
+        self.chartForecastView.setRenderHint(QPainter.Antialiasing)
+        # pie
+        self._pieSeries = QtCharts.QPieSeries()
+        self._chartPie = QtCharts.QChart()
+        self._chartPie.addSeries(self._pieSeries)
+        self._chartPie.setTitle("Note maturity")
+        self.chartPieView.setChart(self._chartPie)
+        # bar
+        self._barSet = QtCharts.QBarSet("Days")
+        barSeries = QtCharts.QBarSeries()
+        barSeries.append(self._barSet)
+        self._chartBar = QtCharts.QChart()
+        self._chartBar.addSeries(barSeries)
+        self._chartBar.setTitle("Reviews by days")
+        self.chartBarView.setChart(self._chartBar)
+        # forecast
+        self._seriesMean = QtCharts.QLineSeries()
+        self._seriesMean.setName("Expected")
+        self._seriesLower = QtCharts.QLineSeries()
+        self._seriesUpper = QtCharts.QLineSeries()
+        band = QtCharts.QAreaSeries(self._seriesUpper, self._seriesLower)
+        band.setName("Confidence")
+        band.setOpacity(0.3)
+        self._chartForecast = QtCharts.QChart()
+        self._chartForecast.addSeries(band)
+        self._chartForecast.addSeries(self._seriesMean)
+        self._chartForecast.createDefaultAxes()
+        self._chartForecast.setTitle("Forecast reviews by days")
+        self.chartForecastView.setChart(self._chartForecast)
         # init
         layout.addWidget(self.chartPieView, 0, 0)
         layout.addWidget(self.chartBarView, 0, 1)
+        layout.addWidget(self.chartForecastView, 0, 2)
         self.setLayout(layout)
 
     def setPieChartData(self, data: List[Tuple[str, int]]):
-        pieSeries = QtCharts.QPieSeries()
-        for name, value in data:
-            pieSeries.append(name, value)
-        chartPie = QtCharts.QChart()
-        chartPie.addSeries(pieSeries)
-        chartPie.setAnimationOptions(QtCharts.QChart.SeriesAnimations)
-        chartPie.setTitle("Note maturity")
-        self.chartPieView.setChart(chartPie)
+        data = list(data)
+        _setAnimated(self._chartPie, len(data))
+        _updatePieSeries(self._pieSeries, data)
 
     def setBarChartData(self, data: List[int]):
-        barSet = QtCharts.QBarSet("Days")
-        barSet.append(data)
-        series = QtCharts.QBarSeries()
-        series.append(barSet)
-        chartBar = QtCharts.QChart()
-        chartBar.addSeries(series)
-        chartBar.setTitle("Reviews by days")
-        chartBar.setAnimationOptions(QtCharts.QChart.SeriesAnimations)
-        self.chartBarView.setChart(chartBar)
+        _setAnimated(self._chartBar, len(data))
+        if self._barSet.count() == len(data):
+            for idx, value in enumerate(data):
+                self._barSet.replace(idx, value)
+        else:
+            self._barSet.remove(0, self._barSet.count())
+            self._barSet.append(data)
+
+    def setForecastChartData(self, mean: List[float], lower: List[float], upper: List[float]):
+        indices = lttbIndices(mean, DOWNSAMPLE_POINTS)  # band is sampled at the same days as the mean
+        _setAnimated(self._chartForecast, len(indices))
+        self._seriesMean.replace([QPointF(idx, mean[idx]) for idx in indices])
+        self._seriesLower.replace([QPointF(idx, lower[idx]) for idx in indices])
+        self._seriesUpper.replace([QPointF(idx, upper[idx]) for idx in indices])
+        self._chartForecast.axes(Qt.Horizontal)[0].setRange(0, max(len(mean) - 1, 1))
+        self._chartForecast.axes(Qt.Vertical)[0].setRange(0, max(upper, default=0) + 1)
 
 
 class NoteStatsWindow(QDialog):
+    """Chart is created once, later calls of the setter only replace the data"""
 
     def __init__(self):
         super().__init__()
@@ -53,16 +113,16 @@ class NoteStatsWindow(QDialog):
         # graphs
         self.chartPieView = QtCharts.QChartView()
         self.chartPieView.setRenderHint(QPainter.Antialiasing)
+        self._pieSeries = QtCharts.QPieSeries()
+        self._chartPie = QtCharts.QChart()
+        self._chartPie.addSeries(self._pieSeries)
+        self._chartPie.setTitle("Rating history")
+        self.chartPieView.setChart(self._chartPie)
         # init
         layout.addWidget(self.chartPieView, 0, 0)
         self.setLayout(layout)
 
     def setPieChartData(self, data: List[Tuple[str, int]]):
-        pieSeries = QtCharts.QPieSeries()
-        for name, value in data:
-            pieSeries.append(name, value)
-        chartPie = QtCharts.QChart()
-        chartPie.addSeries(pieSeries)
-        chartPie.setAnimationOptions(QtCharts.QChart.SeriesAnimations)
-        chartPie.setTitle("Rating history")
-        self.chartPieView.setChart(chartPie)
+        data = list(data)
+        _setAnimated(self._chartPie, len(data))
+        _updatePieSeries(self._pieSeries, data)
@@ -1,15 +1,22 @@
+import csv
+import io
 import time
-from typing import Tuple, List
+from typing import Dict, Tuple, List, Optional, TextIO
 
 from PySide2 import QtCore
-from PySide2.QtCore import QFile, QIODevice, QObject, Signal
+from PySide2.QtCore import QFile, QIODevice, QObject, Signal, QTimer, QThread, Slot, QDate, QDateTime
 from PySide2.QtUiTools import QUiLoader
 from PySide2.QtWidgets import QLineEdit, QVBoxLayout, QPushButton, QMessageBox, QWidgetItem, QListWidget, QDialog, \
-    QPlainTextEdit, QTextBrowser, QStackedWidget, QLabel, QHBoxLayout, QComboBox, QTableWidget, QTableWidgetItem, \
-    QFileDialog
+    QPlainTextEdit, QStackedWidget, QLabel, QHBoxLayout, QComboBox, QTableWidget, QTableWidgetItem, \
+    QFileDialog, QApplication, QInputDialog, QDateEdit, QDialogButtonBox
 
-from data.consts import HTML_TEMPLATE
 from data.dbmodel import Note, Review
+from logic.delimited import sniffDialect, readSample, mapColumns
+from logic.notequery import NoteQuery, NotePage, SORT_ID, SORT_DUE, SORT_LAST, SORT_REVIEWS
+from logic.rendering import renderCard
+from views.classes.import_window import DelimitedImportWindow
+from views.classes.media_browser import MediaTextBrowser, imageCache
+from views.classes.preview_renderer import PreviewRenderer
 from views.classes.stat_windows import DeckStatsWindow, NoteStatsWindow
 
 
@@ -19,6 +26,7 @@ def load_ui(path: str):
     if not ui_file.open(QIODevice.ReadOnly):
         print("Cannot open {}: {}".format(path, ui_file.errorString()))
     loader = QUiLoader()
+    loader.registerCustomWidget(MediaTextBrowser)
     window = loader.load(ui_file)
     ui_file.close()
     if not window:
@@ -27,12 +35,14 @@ def load_ui(path: str):
 
 
 class InfoMessage:
-    """Display info box popup"""
-    def __init__(self, message: str):
+    """Display info box popup, details are shown in an expandable text area"""
+    def __init__(self, message: str, details: Optional[str] = None):
         self.msgBox = QMessageBox()
         self.msgBox.setIcon(QMessageBox.Information)
         self.msgBox.setText("Info")
         self.msgBox.setInformativeText(message)
+        if details:
+            self.msgBox.setDetailedText(details)
         self.msgBox.setStandardButtons(QMessageBox.Ok)
 
     def exec(self):
@@ -52,8 +62,25 @@ class ErrorMessage:
         self.msgBox.exec_()
 
 
+class ConfirmMessage:
+    """Display confirmation box popup"""
+    def __init__(self, message: str):
+        self.msgBox = QMessageBox()
+        self.msgBox.setIcon(QMessageBox.Question)
+        self.msgBox.setText("Confirm")
+        self.msgBox.setInformativeText(message)
+        self.msgBox.setStandardButtons(QMessageBox.Ok | QMessageBox.Cancel)
+        self.msgBox.setDefaultButton(QMessageBox.Cancel)
+
+    def exec(self) -> bool:
+        return self.msgBox.exec_() == QMessageBox.Ok
+
+
 class MainWindowView(QObject):
     signalOpenDeck = Signal(int)
+    signalOpenAllDecks = Signal()
+    signalSwitchProfile = Signal(str)
+    signalAddProfile = Signal()
 
     def __init__(self):
         super().__init__()
@@ -63,6 +90,7 @@ class MainWindowView(QObject):
         # Pages
         # main page
         self._containerDecks: QVBoxLayout = self._window.containerDecks
+        self._deckButtons: Dict[int, Tuple[QPushButton, str]] = {}
         # details page
         self._labelDeckName: QLabel = self._window.labelDeckName
         self._labelTotalNotes: QLabel = self._window.labelTotalNotes
@@ -75,7 +103,7 @@ class MainWindowView(QObject):
         self._labelFlashcardName: QLabel = self._window.labelFlashcardName
         self._buttonFlashcardStats: QPushButton = self._window.buttonFlashcardStats
         self._buttonFlashcardClose: QPushButton = self._window.buttonFlashcardClose
-        self._flashcardDisplay: QTextBrowser = self._window.flashcardDisplay
+        self._flashcardDisplay: MediaTextBrowser = self._window.flashcardDisplay
         self._buttonFlashcardShow: QPushButton = self._window.buttonFlashcardShow
         self._buttonFlashcardHard: QPushButton = self._window.buttonFlashcardHard
         self._buttonFlashcardOK: QPushButton = self._window.buttonFlashcardOK
@@ -86,6 +114,13 @@ class MainWindowView(QObject):
         self.signalManageDecks = self._window.actionManageDecks.triggered
         self.signalBatchImport = self._window.actionBatchImport.triggered
         self.signalBatchExport = self._window.actionBatchExport.triggered
+        self.signalSync = self._window.actionSync.triggered
+        self._menuProfile = self._window.menubar.addMenu("Profile")
+        self._menuDeveloper = self._window.menubar.addMenu("Developer")
+        self._actionProfiling = self._menuDeveloper.addAction("Profile actions")
+        self._actionProfiling.setCheckable(True)
+        self.signalToggleProfiling = self._actionProfiling.toggled
+        self.signalStallReport = self._menuDeveloper.addAction("Stall report").triggered
         # details page
         self.signalDetailsCancel = self._buttonDetailsCancel.clicked
         self.signalDetailsStats = self._buttonDetailsStats.clicked
@@ -106,44 +141,85 @@ class MainWindowView(QObject):
             return
         self._stackedWidget.setCurrentIndex(idx)
 
-    def updateDecksList(self, decks: List[Tuple[int, str]]):
+    def updateDecksList(self, decks: List[Tuple[int, str]], dueCounts: Optional[Dict[int, int]] = None):
         for _ in range(self._containerDecks.count()):
             self._containerDecks.takeAt(0).widget().deleteLater()
+        self._deckButtons = {}
         for (d_id, d_name) in decks:
             def _scope_fix(_d_id, _d_name):
                 button = QPushButton(d_name)
                 # noinspection PyUnresolvedReferences
                 button.clicked.connect(lambda: self.signalOpenDeck.emit(_d_id))  # type: ignore
                 self._containerDecks.addWidget(button)
+                self._deckButtons[_d_id] = (button, _d_name)
             _scope_fix(d_id, d_name)
-
-    def updateDeckDetails(self, name: str, notesTotal: int, notesToLearn: int):
+        if dueCounts is not None:
+            self.updateDueCounts(dueCounts)
+        if len(decks) > 1:
+            button = QPushButton("Study all decks")
+            # noinspection PyUnresolvedReferences
+            button.clicked.connect(self.signalOpenAllDecks.emit)  # type: ignore
+            self._containerDecks.addWidget(button)
+
+    def updateDueCounts(self, dueCounts: Dict[int, int]):
+        """Shows the number of due notes next to the deck names, the buttons are kept"""
+        for d_id, (button, name) in self._deckButtons.items():
+            count = dueCounts.get(d_id, 0)
+            button.setText(f"{name} ({count} due)" if count else name)
+
+    def updateDeckDetails(self, name: str, notesTotal: int, notesToLearn: int, singleDeck: bool = True):
         self._labelDeckName.setText(name)
         self._labelTotalNotes.setText(f"Total notes: {notesTotal}")
         self._labelNotesToStudy.setText(f"Notes to study: {notesToLearn}")
         self._buttonDetailsStudy.setEnabled(notesToLearn > 0)
+        # stats and quick add work on a single deck
+        self._buttonDetailsStats.setEnabled(singleDeck)
+        self._buttonDetailsQuickAdd.setEnabled(singleDeck)
 
     def updateFlashcard(self, name: str, front: str, back: str, fields: Tuple[List[str], List[str]], displayFront: bool):
         self._labelFlashcardName.setText(name)
-        front = front if front else ""
-        back = back if back else ""
-        for (field, value) in fields:  # fill fields with data
-            front = front.replace(f"{{{{{field}}}}}", f"{value}")
-            back = back.replace(f"{{{{{field}}}}}", f"{value}")
+        full = renderCard(front, back, fields, displayFront)
         if displayFront:
-            full = HTML_TEMPLATE.replace("{{Body}}", front)
             self._buttonFlashcardEasy.setVisible(False)
             self._buttonFlashcardOK.setVisible(False)
             self._buttonFlashcardHard.setVisible(False)
             self._buttonFlashcardShow.setVisible(True)
         else:
-            full = HTML_TEMPLATE.replace("{{Body}}", back.replace("{{FrontSide}}", front))
             self._buttonFlashcardEasy.setVisible(True)
             self._buttonFlashcardOK.setVisible(True)
             self._buttonFlashcardHard.setVisible(True)
             self._buttonFlashcardShow.setVisible(False)
         self._flashcardDisplay.setHtml(full)
 
+    def updateProfiles(self, names: List[str], current: str):
+        self._menuProfile.clear()
+        for name in names:
+            action = self._menuProfile.addAction(name)
+            action.setCheckable(True)
+            action.setChecked(name == current)
+            # noinspection PyUnresolvedReferences
+            action.triggered.connect(lambda _=False, _name=name: self.signalSwitchProfile.emit(_name))  # type: ignore
+        self._menuProfile.addSeparator()
+        # noinspection PyUnresolvedReferences
+        self._menuProfile.addAction("New profile").triggered.connect(self.signalAddProfile.emit)  # type: ignore
+        self._window.setWindowTitle(f"Flashcards - {current}")
+
+    def askProfileName(self) -> str:
+        """Asks for the name of a new profile, returns an empty string when cancelled"""
+        name, accepted = QInputDialog.getText(self._window, "New profile", "Name of the profile:")
+        return name.strip() if accepted else ""
+
+    def askSyncTarget(self) -> str:
+        """Asks for the database or sync server to sync with, returns an empty string when cancelled"""
+        target, accepted = QInputDialog.getText(self._window, "Sync",
+                                                "Path of another collection or URL of a sync server:")
+        return target.strip() if accepted else ""
+
+    def prefetchImages(self, sources: List[str]):
+        """Loads images of the upcoming card once the current one is displayed"""
+        if sources:
+            QTimer.singleShot(0, lambda: imageCache.prefetch(sources))
+
 
 class CardListView:
     def __init__(self, cards: List[str], ids: List[int]):
@@ -248,23 +324,50 @@ class CardFormView:
         self._window.close()
 
 
-class LayoutEditorView:
+class LayoutEditorView(QObject):
+    """
+    Preview is rendered in a worker thread once typing pauses,
+    the widget is only updated when the rendered html changes
+    """
+    PREVIEW_DELAY = 150  # ms
+    signalRenderPreview = Signal(int, str, str, object, bool)
+
     def __init__(self):
+        super().__init__()
         self._template = "views/templates/layout_editor.ui"
         self._window: QDialog = load_ui(self._template)
         # References
         self._textBoxFront: QPlainTextEdit = self._window.textBoxFront
         self._textBoxBack: QPlainTextEdit = self._window.textBoxBack
-        self._htmlPreview: QTextBrowser = self._window.htmlPreview
+        self._htmlPreview: MediaTextBrowser = self._window.htmlPreview
         self._buttonCancel: QPushButton = self._window.buttonCancel
         self._buttonSave: QPushButton = self._window.buttonSave
         self._buttonFlip: QPushButton = self._window.buttonFlip
+        self._comboSample: QComboBox = self._window.comboSample
+        self._samples: List[dict] = []
+        self._requestId = 0
+        self._shownHtml = None
+        # preview pipeline
+        self._previewTimer = QTimer(self)
+        self._previewTimer.setSingleShot(True)
+        self._previewTimer.setInterval(self.PREVIEW_DELAY)
+        self._renderer = PreviewRenderer()
+        self._rendererThread = QThread(self)
+        self._renderer.moveToThread(self._rendererThread)
+        self.signalRenderPreview.connect(self._renderer.render)
+        self._renderer.signalRendered.connect(self._onPreviewRendered)
+        self._rendererThread.start()
+        # signals
+        self._previewTimer.timeout.connect(self.loadPreview)
         self._buttonFlip.clicked.connect(self.flipNote)
-        self._textBoxFront.textChanged.connect(self.loadPreview)
-        self._textBoxBack.textChanged.connect(self.loadPreview)
+        self._comboSample.currentIndexChanged.connect(self.loadPreview)
+        self._textBoxFront.textChanged.connect(self._previewTimer.start)
+        self._textBoxBack.textChanged.connect(self._previewTimer.start)
+        self._window.finished.connect(self._stopRenderer)
         self.saveSignal = self._buttonSave.clicked
         self.cancelSignal = self._buttonCancel.clicked
         self.showFront = True
+        self._comboSample.setEnabled(False)
 
     def setContents(self, front: str, back: str) -> None:
         self._textBoxFront.setPlainText(front)
@@ -277,20 +380,44 @@ class LayoutEditorView:
         self.showFront = not self.showFront
         self.loadPreview()
 
+    def setSamples(self, fields: List[str], samples: List[List[str]]) -> None:
+        """Sets notes filled into the preview, without them the placeholders are shown"""
+        self._samples = [dict(zip(fields, values)) for values in samples]
+        self._comboSample.blockSignals(True)
+        self._comboSample.clear()
+        self._comboSample.addItems([f"Note: {values[0] if values else idx + 1}"[:40] for idx, values in enumerate(samples)])
+        self._comboSample.blockSignals(False)
+        self._comboSample.setEnabled(len(samples) > 1)
+        self.loadPreview()
+
     def loadPreview(self) -> None:
-        front = self._textBoxFront.toPlainText()
-        if self.showFront:
-            full = HTML_TEMPLATE.replace("{{Body}}", front)
-        else:
-            back = self._textBoxBack.toPlainText()
-            full = HTML_TEMPLATE.replace("{{Body}}", back.replace("{{FrontSide}}", front))
-        self._htmlPreview.setHtml(full)
+        """Sends the current contents to the renderer, replies to older requests are dropped"""
+        self._previewTimer.stop()
+        self._requestId += 1
+        self._renderer.latestRequest = self._requestId
+        idx = self._comboSample.currentIndex()
+        values = self._samples[idx] if 0 <= idx < len(self._samples) else {}
+        front, back = self.getContents()
+        self.signalRenderPreview.emit(self._requestId, front, back, values, self.showFront)
+
+    @Slot(int, str)
+    def _onPreviewRendered(self, requestId: int, html: str) -> None:
+        if requestId != self._requestId or html == self._shownHtml:
+            return
+        self._shownHtml = html
+        self._htmlPreview.setHtml(html)
+
+    def _stopRenderer(self) -> None:
+        self._previewTimer.stop()
+        self._rendererThread.quit()
+        self._rendererThread.wait()
 
     def exec(self) -> None:
         self._window.exec_()
 
     def close(self) -> None:
         self._window.close()
+        self._stopRenderer()
 
 
 class NoteFormView:
@@ -410,53 +537,143 @@ class DeckFormView:
         self._window.exec_()
 
 
-class NoteBrowserView:
-    def __init__(self, deck: str, fields: List[str], data: List[Tuple[int, List[str]]]):
+class NoteBrowserView(QObject):
+    """
+    Notes are sorted and filtered by the database and loaded in pages,
+    the next page is asked for when the table is scrolled near its end
+    """
+    FILTER_DELAY = 300  # ms
+    FETCH_MARGIN = 50  # rows left below the view when the next page is asked for
+    signalQueryChanged = Signal()
+    signalSortChanged = Signal()
+    signalMoreNeeded = Signal()
+
+    def __init__(self, deck: str, fields: List[str]):
+        super().__init__()
         self._template = "views/templates/note_browser.ui"
         self._window: QDialog = load_ui(self._template)
         self._data: List[Tuple[int, List[str]]] = []
         self._selectedIdx = -1
+        self._fields = fields
+        self._columns = list(range(len(fields))) + [SORT_DUE, SORT_LAST, SORT_REVIEWS]
+        self._sortColumn, self._descending = -1, False
+        self._nextKey: Optional[tuple] = None
         # references
         self._labelDeckName: QLabel = self._window.labelDeckName
         self._tableNotes: QTableWidget = self._window.tableNotes
+        self._comboFilterColumn: QComboBox = self._window.comboFilterColumn
+        self._entryFilter: QLineEdit = self._window.entryFilter
         self._buttonDelete: QPushButton = self._window.buttonDelete
         self._buttonEdit: QPushButton = self._window.buttonEdit
         self._buttonAdd: QPushButton = self._window.buttonAdd
+        self._buttonImport: QPushButton = self._window.buttonImport
+        self._buttonExport: QPushButton = self._window.buttonExport
+        self._buttonMove: QPushButton = self._window.buttonMove
+        self._buttonReset: QPushButton = self._window.buttonReset
+        self._buttonReschedule: QPushButton = self._window.buttonReschedule
+        self._filterTimer = QTimer(self)
+        self._filterTimer.setSingleShot(True)
+        self._filterTimer.setInterval(self.FILTER_DELAY)
         # signals
         self.signalDelete = self._buttonDelete.clicked
         self.signalEdit = self._buttonEdit.clicked
         self.signalAdd = self._buttonAdd.clicked
-        self._tableNotes.clicked.connect(self._onClicked)
+        self.signalImport = self._buttonImport.clicked
+        self.signalExport = self._buttonExport.clicked
+        self.signalMove = self._buttonMove.clicked
+        self.signalReset = self._buttonReset.clicked
+        self.signalReschedule = self._buttonReschedule.clicked
+        self._tableNotes.itemSelectionChanged.connect(self._onSelectionChanged)
+        self._tableNotes.horizontalHeader().sectionClicked.connect(self._onHeaderClicked)
+        self._tableNotes.verticalScrollBar().valueChanged.connect(self._onScrolled)
+        self._entryFilter.textChanged.connect(self._filterTimer.start)
+        self._comboFilterColumn.currentIndexChanged.connect(self._onFilterColumnChanged)
+        self._filterTimer.timeout.connect(self.signalQueryChanged.emit)
         # init
         self._labelDeckName.setText(deck)
+        self._comboFilterColumn.addItems(["All fields"] + fields + ["Due (days)", "Last review (days)", "Reviews"])
         self._tableNotes.setSelectionBehavior(QTableWidget.SelectRows)
-        self.refresh(fields, data)
+        self._tableNotes.setSelectionMode(QTableWidget.ExtendedSelection)
+        self._tableNotes.setVerticalScrollMode(QTableWidget.ScrollPerItem)
+        self._tableNotes.setColumnCount(len(self._columns))
+        self._tableNotes.setHorizontalHeaderLabels(fields + ["Due", "Last review", "Reviews"])
+        self._tableNotes.horizontalHeader().setSortIndicatorShown(False)
         self._setButtonsEnabled(False)
 
-    def _onClicked(self):
-        self._selectedIdx = self._tableNotes.currentRow()
-        self._setButtonsEnabled(True)
+    def _onHeaderClicked(self, column: int):
+        self._descending = not self._descending if column == self._sortColumn else False
+        self._sortColumn = column
+        header = self._tableNotes.horizontalHeader()
+        header.setSortIndicatorShown(True)
+        header.setSortIndicator(column, QtCore.Qt.DescendingOrder if self._descending else QtCore.Qt.AscendingOrder)
+        self.signalSortChanged.emit()
+
+    def _onFilterColumnChanged(self):
+        if self._entryFilter.text():
+            self._filterTimer.stop()
+            self.signalQueryChanged.emit()
+
+    def _onScrolled(self, value: int):
+        # the table scrolls per item, values of the scroll bar count rows
+        if self._nextKey is not None and self._tableNotes.verticalScrollBar().maximum() - value <= self.FETCH_MARGIN:
+            self.signalMoreNeeded.emit()
+
+    def getQuery(self, d_id: int) -> NoteQuery:
+        sort = SORT_ID if self._sortColumn == -1 else self._columns[self._sortColumn]
+        filterIdx = self._comboFilterColumn.currentIndex()
+        filterColumn = None if filterIdx <= 0 else self._columns[filterIdx - 1]
+        return NoteQuery(d_id, sort, self._descending, filterColumn, self._entryFilter.text().strip())
+
+    def getNextKey(self) -> Optional[tuple]:
+        return self._nextKey
+
+    def _selectedRows(self) -> List[int]:
+        return sorted(index.row() for index in self._tableNotes.selectionModel().selectedRows())
+
+    def _onSelectionChanged(self):
+        rows = self._selectedRows()
+        self._selectedIdx = rows[0] if len(rows) == 1 else -1
+        self._setButtonsEnabled(bool(rows))
+        self._buttonEdit.setEnabled(len(rows) == 1)
 
     def _setButtonsEnabled(self, state: bool):
-        self._buttonDelete.setEnabled(state)
-        self._buttonEdit.setEnabled(state)
+        for button in [self._buttonDelete, self._buttonEdit, self._buttonMove, self._buttonReset,
+                       self._buttonReschedule]:
+            button.setEnabled(state)
+
+    @staticmethod
+    def _formatDay(timestamp: int) -> str:
+        return time.strftime("%Y-%m-%d", time.localtime(timestamp))
+
+    def _scheduleValues(self, n_next_r: int, n_last_r: int) -> List[str]:
+        """Texts of the Due and Last review columns"""
+        return ["new" if not n_last_r else self._formatDay(n_next_r), self._formatDay(n_last_r) if n_last_r else ""]
+
+    def refresh(self, page: NotePage):
+        """Shows the first page of notes in place of the loaded ones"""
+        self._data = []
+        self._tableNotes.clearSelection()
+        self._tableNotes.setRowCount(0)
+        self._tableNotes.scrollToTop()
+        self.appendNotes(page)
+        self._setButtonsEnabled(False)
+        self._selectedIdx = -1
 
-    def refresh(self, fields: List[str], data: List[Tuple[int, List[str]]]):
-        if not data:
-            return
-        self._data = list(map(lambda t: (t[0], t[1].copy()), data))  # deep copy
-        self._tableNotes.clear()
-        self._tableNotes.setColumnCount(len(fields))
-        self._tableNotes.setRowCount(len(self._data))
-        self._tableNotes.setHorizontalHeaderLabels(fields)
-        for r in range(len(data)):
-            n_id, n_data = data[r]
-            for c in range(len(n_data)):
-                item = QTableWidgetItem(n_data[c])
+    def appendNotes(self, page: NotePage):
+        """Adds the following page of notes below the loaded ones"""
+        first = len(self._data)
+        self._nextKey = page.nextKey
+        self._tableNotes.setUpdatesEnabled(False)
+        self._tableNotes.setRowCount(first + len(page.rows))
+        for r, (n_id, n_data, n_next_r, n_last_r, reviews) in enumerate(page.rows, first):
+            self._data.append((n_id, n_data))
+            values = n_data[:len(self._fields)] + [""] * (len(self._fields) - len(n_data))
+            values += self._scheduleValues(n_next_r, n_last_r) + [str(reviews)]
+            for c, value in enumerate(values):
+                item = QTableWidgetItem(value)
                 item.setFlags(QtCore.Qt.ItemIsEnabled|QtCore.Qt.ItemIsSelectable)
                 self._tableNotes.setItem(r, c, item)
-        self._setButtonsEnabled(False)
-        self._selectedIdx = -1
+        self._tableNotes.setUpdatesEnabled(True)
 
     def getSelectedId(self) -> int:
         if self._selectedIdx == -1:
@@ -464,6 +681,167 @@ class NoteBrowserView:
         else:
             return self._data[self._selectedIdx][0]
 
+    def updateNote(self, n_id: int, n_data: List[str]):
+        """Shows edited fields of a loaded note"""
+        for r, (loaded, _) in enumerate(self._data):
+            if loaded == n_id:
+                self._data[r] = (n_id, n_data)
+                for c, value in enumerate(n_data[:len(self._fields)]):
+                    self._tableNotes.item(r, c).setText(value)
+                return
+
+    def getSelectedIds(self) -> List[int]:
+        return [self._data[row][0] for row in self._selectedRows()]
+
+    def updateSchedules(self, schedules: Dict[int, Tuple[int, int]]):
+        """Shows the new (n_next_r, n_last_r) of loaded notes keyed by their IDs, rows stay where they are"""
+        column = len(self._fields)
+        self._tableNotes.setUpdatesEnabled(False)
+        for r, (n_id, _) in enumerate(self._data):
+            if n_id in schedules:
+                for c, value in enumerate(self._scheduleValues(*schedules[n_id]), column):
+                    self._tableNotes.item(r, c).setText(value)
+        self._tableNotes.setUpdatesEnabled(True)
+
+    def removeNotes(self, ids: List[int]):
+        """Removes rows of the notes without rebuilding the table"""
+        removed = set(ids)
+        rows = [row for row, (n_id, _) in enumerate(self._data) if n_id in removed]
+        self._tableNotes.setUpdatesEnabled(False)
+        for row in reversed(rows):
+            self._tableNotes.removeRow(row)
+        self._tableNotes.setUpdatesEnabled(True)
+        self._data = [note for note in self._data if note[0] not in removed]
+        self._tableNotes.clearSelection()
+        self._onSelectionChanged()
+
+    def askTargetDeck(self, names: List[str]) -> str:
+        """Asks for the deck the notes are moved to, returns an empty string when cancelled"""
+        name, accepted = QInputDialog.getItem(self._window, "Move notes", "Move to deck:", names, 0, False)
+        return name if accepted else ""
+
+    def askRescheduleDate(self) -> Optional[int]:
+        """Asks for the day the notes become due, returns its midnight as a timestamp or None when cancelled"""
+        dialog = QDialog(self._window)
+        dialog.setWindowTitle("Reschedule notes")
+        layout = QVBoxLayout(dialog)
+        layout.addWidget(QLabel("Due on:"))
+        dateEdit = QDateEdit(QDate.currentDate())
+        dateEdit.setCalendarPopup(True)
+        layout.addWidget(dateEdit)
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(dialog.accept)
+        buttons.rejected.connect(dialog.reject)
+        layout.addWidget(buttons)
+        if dialog.exec_() != QDialog.Accepted:
+            return None
+        return QDateTime(dateEdit.date()).toSecsSinceEpoch()
+
+    def chooseExportFile(self) -> str:
+        """Asks where the notes are exported, returns an empty string when cancelled"""
+        fileDialog = QFileDialog()
+        return fileDialog.getSaveFileName(filter="CSV file (*.csv);;TSV file (*.tsv)")[0]
+
+    def close(self):
+        self._window.close()
+
+    def exec(self):
+        self._window.exec_()
+
+
+class DelimitedImportView:
+    """Columns are detected from the first lines of the source only, the whole source is read by the import"""
+    def __init__(self, fields: List[str]):
+        self._window = DelimitedImportWindow(fields)
+        self._fields = fields
+        self._path = ""
+        self._text: Optional[str] = None
+        self._dialect = csv.excel
+        self._sampleRows: List[List[str]] = []
+        # signals
+        self._window.buttonChooseFile.clicked.connect(self._onChooseFile)
+        self._window.buttonClipboard.clicked.connect(self._onClipboard)
+        self._window.checkHeader.toggled.connect(self._updateColumns)
+        self._window.buttonCancel.clicked.connect(self.close)
+        self.signalImport = self._window.buttonImport.clicked
+
+    def _onChooseFile(self):
+        fileDialog = QFileDialog()
+        path = fileDialog.getOpenFileName(filter="Delimited text (*.csv *.tsv *.txt)")[0]
+        if path:
+            self._path, self._text = path, None
+            self._window.labelSource.setText(path)
+            self._loadSample()
+
+    def _onClipboard(self):
+        text = QApplication.clipboard().text()
+        if text:
+            self._path, self._text = "", text
+            self._window.labelSource.setText(f"Clipboard, {text.count(chr(10)) + 1} lines")
+            self._loadSample()
+
+    def _loadSample(self):
+        # spreadsheets put tab separated rows into the clipboard
+        default = "\t" if self._text is not None or self._path.lower().endswith(".tsv") else ","
+        try:
+            with self.openSource() as stream:
+                sample = readSample(stream)
+        except (OSError, UnicodeDecodeError) as error:
+            self._window.labelSource.setText(f"Couldn't read the file: {error}")
+            self._path, self._text = "", None
+            return
+        self._dialect = sniffDialect(sample, default)
+        self._sampleRows = list(csv.reader(io.StringIO(sample), self._dialect))
+        try:
+            hasHeader = csv.Sniffer().has_header(sample)
+        except csv.Error:
+            hasHeader = False
+        self._window.checkHeader.blockSignals(True)
+        self._window.checkHeader.setChecked(hasHeader)
+        self._window.checkHeader.blockSignals(False)
+        self._updateColumns()
+
+    def _updateColumns(self):
+        """Fills the column selectors and the preview from the sample rows"""
+        rows = self._sampleRows
+        columnCount = max(map(len, rows), default=0)
+        header = rows[0] if rows and self.hasHeader() else None
+        labels = [header[idx] if header and idx < len(header) else f"Column {idx + 1}" for idx in range(columnCount)]
+        mapping = mapColumns(header, self._fields, columnCount)
+        for combo, column in zip(self._window.comboColumns, mapping):
+            combo.clear()
+            combo.addItems(["(none)"] + labels)
+            combo.setCurrentIndex(0 if column is None else column + 1)
+        preview = rows[1:] if header else rows
+        table = self._window.tablePreview
+        table.clear()
+        table.setColumnCount(columnCount)
+        table.setRowCount(len(preview))
+        table.setHorizontalHeaderLabels(labels)
+        for r, row in enumerate(preview):
+            for c, value in enumerate(row):
+                item = QTableWidgetItem(value)
+                item.setFlags(QtCore.Qt.ItemIsEnabled)
+                table.setItem(r, c, item)
+
+    def hasSource(self) -> bool:
+        return bool(self._path) or self._text is not None
+
+    def openSource(self) -> TextIO:
+        if self._text is not None:
+            return io.StringIO(self._text)
+        return open(self._path, "r", newline="", encoding="utf-8-sig")
+
+    def getDialect(self):
+        return self._dialect
+
+    def hasHeader(self) -> bool:
+        return self._window.checkHeader.isChecked()
+
+    def getMapping(self) -> List[Optional[int]]:
+        """Returns column of every field, None for fields without one"""
+        return [combo.currentIndex() - 1 if combo.currentIndex() > 0 else None for combo in self._window.comboColumns]
+
     def close(self):
         self._window.close()
 
@@ -544,10 +922,9 @@ class ImportFormView:
 
 
 class DeckStatsView:
-    def __init__(self, pieData, barData):
+    """Window is meant to be reused, it stays open while studying and its charts are updated live"""
+    def __init__(self):
         self._window: QDialog = DeckStatsWindow()
-        self.setDataPie(pieData)
-        self.setDataBar(barData)
 
     def setDataPie(self, pieData):
         self._window.setPieChartData(pieData)
@@ -555,6 +932,16 @@ class DeckStatsView:
     def setDataBar(self, barData):
         self._window.setBarChartData(barData)
 
+    def setDataForecast(self, forecastData):
+        self._window.setForecastChartData(*forecastData)
+
+    def isVisible(self) -> bool:
+        return self._window.isVisible()
+
+    def show(self):
+        self._window.show()
+        self._window.raise_()
+
     def close(self):
         self._window.close()
 
@@ -563,9 +950,8 @@ class DeckStatsView:
 
 
 class NoteStatsView:
-    def __init__(self, pieData):
+    def __init__(self):
         self._window: QDialog = NoteStatsWindow()
-        self.setNoteDataPie(pieData)
 
     def setNoteDataPie(self, pieData):
         self._window.setPieChartData(pieData)
@@ -574,4 +960,4 @@ class NoteStatsView:
         self._window.close()
 
     def exec(self):
-        self._window.exec_()
\ No newline at end of file
+        self._window.exec_()